@@ -10,21 +10,26 @@ pip install pymongo pandas seaborn matplotlib scikit-learn
 # In[23]:
 
 
+import os
 import pandas as pd
-from pymongo import MongoClient
-
-# MongoDB Connection
-MONGO_URI = "mongodb://localhost:27017/"
-client = MongoClient(MONGO_URI)
-db = client["user_database"]
-unique_collection = db["unique"]
-
-# Fetch Data from MongoDB
-cursor = unique_collection.find({}, {"_id": 0})  # Remove MongoDB's _id field
-data = list(cursor)
-
-# Convert to DataFrame
-df = pd.json_normalize(data)
+import analytics
+from connection import get_collection
+from snapshot import load_snapshot
+
+# MongoDB Connection (shared client and settings from connection.py; analytics
+# reads may go to secondaries with MONGO_READ_PREFERENCE=secondaryPreferred)
+unique_collection = get_collection("unique")
+
+# Fetch only the per-user columns the age / income charts need: from the local columnar
+# snapshot when one exists (python snapshot.py), otherwise with a projected, chunked cursor.
+# Counts per country, gender, income and interest are aggregated in MongoDB below.
+SNAPSHOT_PATH = "snapshots/unique"
+columns = ["data.created_at", "data.demographics.age", "data.demographics.income",
+           "data.demographics.education", "data.interests"]
+if os.path.exists(os.path.join(SNAPSHOT_PATH, "manifest.json")):
+    df = load_snapshot(SNAPSHOT_PATH, columns)
+else:
+    df = analytics.load_frame(unique_collection, columns)
 
 # Display first 5 rows
 df.head()
@@ -45,7 +50,7 @@ import numpy as np
 df['data.created_at'] = pd.to_datetime(df['data.created_at'], errors='coerce')
 
 # Fill missing values
-df.fillna({'data.location.city': 'Unknown', 'data.demographics.income': 'Unknown'}, inplace=True)
+df.fillna({'data.demographics.income': 'Unknown'}, inplace=True)
 
 # Display data types
 df.info()
@@ -57,12 +62,12 @@ df.info()
 import seaborn as sns
 import matplotlib.pyplot as plt
 
-# Count users per country
-location_counts = df['data.location.country'].value_counts()
+# Count users per country (aggregated in MongoDB)
+location_counts = analytics.country_counts(unique_collection)
 
 # Plot
 plt.figure(figsize=(12,6))
-sns.barplot(x=location_counts.index, y=location_counts.values, palette="viridis")
+sns.barplot(x="country", y="count", data=location_counts, palette="viridis")
 plt.xticks(rotation=45)
 plt.title("User Distribution by Country")
 plt.xlabel("Country")
@@ -86,8 +91,9 @@ plt.show()
 
 
 # Gender Distribution
+gender_counts = analytics.gender_counts(unique_collection)
 plt.figure(figsize=(8,5))
-sns.countplot(y=df['data.demographics.gender'], palette='coolwarm')
+sns.barplot(x="count", y="gender", data=gender_counts, palette='coolwarm')
 plt.title("User Distribution by Gender")
 plt.show()
 
@@ -95,14 +101,8 @@ plt.show()
 # In[32]:
 
 
-from collections import Counter
-
-# Flatten interest lists
-interests = df['data.interests'].dropna().explode()
-interest_counts = Counter(interests)
-
-# Convert to DataFrame
-interest_df = pd.DataFrame(interest_counts.items(), columns=["Interest", "Count"]).sort_values(by="Count", ascending=False)
+# Interest counts ($unwind + $group in MongoDB, largest first)
+interest_df = analytics.interest_counts(unique_collection).rename(columns={"interests": "Interest", "count": "Count"})
 
 # Plot
 plt.figure(figsize=(12,6))
@@ -116,27 +116,22 @@ plt.show()
 # In[33]:
 
 
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+import clustering
 
-# Selecting relevant numeric features
-features = df[['data.demographics.age']]
-features = features.dropna()  # Remove missing values
+# Fit scaler + MiniBatchKMeans on age, income, education and one-hot interests,
+# streaming users from MongoDB in chunks (bounded memory); saved for the API
+cluster_model = clustering.fit_clusters(unique_collection, n_clusters=3, chunk_size=10000)
+clustering.save_model(cluster_model)
 
-# Scale Data
-scaler = StandardScaler()
-scaled_features = scaler.fit_transform(features)
-
-# Display first 5 rows
-scaled_features[:5]
+# Display the scaled features of the first 5 users
+clustering.encode(cluster_model, df.head()).toarray()
 
 
 # In[42]:
 
 
-# Apply K-Means
-kmeans = KMeans(n_clusters=3, random_state=42)
-df.loc[features.index, 'Cluster'] = kmeans.fit_predict(scaled_features)
+# Assign clusters with the fitted model (predict only)
+df['Cluster'] = clustering.predict_frame(cluster_model, df)
 
 # Display first 5 rows
 df[['data.demographics.age', 'Cluster']].head()
@@ -145,12 +140,19 @@ df[['data.demographics.age', 'Cluster']].head()
 # In[43]:
 
 
+# Clusters are fitted on age, income, education and interests; two of them are plotted
+# (income brackets in rank order, unknown last) with one marker per education level
+income_order = clustering.INCOME_LEVELS + ['Unknown']
+income_rank = df['data.demographics.income'].map({level: rank for rank, level in enumerate(income_order)})
 plt.figure(figsize=(10,6))
-sns.scatterplot(x=df.loc[features.index, 'data.demographics.age'], y=df.loc[features.index, 'Cluster'], hue=df.loc[features.index, 'Cluster'], palette="Set2")
-plt.title("User Clusters Based on Age")
+sns.scatterplot(x=df['data.demographics.age'], y=income_rank.fillna(len(income_order) - 1),
+                hue=df['Cluster'], style=df['data.demographics.education'], palette="Set2")
+plt.title("User Clusters by Age, Income, Education and Interests")
 plt.xlabel("Age")
-plt.ylabel("Cluster")
+plt.ylabel("Income Range")
+plt.yticks(range(len(income_order)), income_order)
 plt.xlim(0, 100)
+plt.legend(title="Cluster / Education", bbox_to_anchor=(1.02, 1), loc="upper left")
 plt.show()
 
 
@@ -158,8 +160,9 @@ plt.show()
 
 
 # Count occurrences of each income group
+income_counts = analytics.income_counts(unique_collection)
 plt.figure(figsize=(12,6))
-sns.countplot(y=df["data.demographics.income"], order=df["data.demographics.income"].value_counts().index, palette="coolwarm")
+sns.barplot(x="count", y="income", data=income_counts, palette="coolwarm")
 plt.title("Income Distribution")
 plt.xlabel("Count")
 plt.ylabel("Income Range")
@@ -180,8 +183,9 @@ plt.show()
 # In[46]:
 
 
+income_gender = analytics.income_by_gender(unique_collection)
 plt.figure(figsize=(8,5))
-sns.countplot(y=df["data.demographics.income"], hue=df["data.demographics.gender"], palette="Set2")
+sns.barplot(x="count", y="income", hue="gender", data=income_gender, palette="Set2")
 plt.title("Income Distribution by Gender")
 plt.ylabel("Income Range")
 plt.xlabel("Count")
@@ -192,11 +196,11 @@ plt.show()
 # In[47]:
 
 
-# Extract Interests
-income_interests = df.explode("data.interests")
+# Users per (interest, income) pair, aggregated in MongoDB
+income_interests = analytics.income_by_interest(unique_collection)
 
 plt.figure(figsize=(12,6))
-sns.countplot(y=income_interests["data.interests"], hue=income_interests["data.demographics.income"], palette="Spectral")
+sns.barplot(x="count", y="interests", hue="income", data=income_interests, palette="Spectral")
 plt.title("Income Levels Across User Interests")
 plt.xlabel("User Count")
 plt.ylabel("Interests")
@@ -276,13 +280,10 @@ print(df[["interests", "Cohort"]])
 # In[63]:
 
 
-from pymongo import MongoClient
 import pandas as pd
 
-# ✅ Connect to MongoDB
-client = MongoClient("mongodb://localhost:27017/")
-db = client["user_database"]  # Replace with your DB name
-collection = db["cohort"]  # Replace with your collection name
+# ✅ Same shared client as above
+collection = get_collection("cohort")
 
 # ✅ Load Data from MongoDB
 cursor = collection.find({}, {"_id": 0, "data": 1})  # Excluding _id
@@ -298,33 +299,17 @@ print(df.head())  # ✅ Check the structure
 # In[65]:
 
 
-# ✅ Define Interest Categories (Lowercase Matching)
-interest_categories = {
-    "Sports": ["sports", "football", "basketball", "cricket", "tennis"],
-    "Tech": ["tech", "ai", "gadgets", "programming", "blockchain"],
-    "Movies": ["movies", "hollywood", "bollywood", "action", "drama"],
-    "Finance": ["finance", "stock market", "investment", "banking", "crypto"]
-}
-
-# ✅ Function to Assign User Cohort
-def assign_cohort(interests):
-    if isinstance(interests, float) or interests is None:  # Handle NaN or None values
-        return "Other"  
-
-    if isinstance(interests, str):  
-        interests = interests.lower().split(",")  # Convert string to a list of words
-
-    interests = [i.lower().strip() for i in interests]  # Normalize interests
+from cohort_assignment import DEFAULT_INTEREST_CATEGORIES, assign_cohorts, cohort_counts
 
-    for category, keywords in interest_categories.items():
-        if any(interest in keywords for interest in interests):
-            return category
-    return "Other"
+# ✅ Define Interest Categories (Lowercase Matching, order = priority for single-label)
+interest_categories = DEFAULT_INTEREST_CATEGORIES
 
-# ✅ Apply Cohort Assignment  
-df["Cohort"] = df["interests"].apply(assign_cohort)  
+# ✅ Apply Cohort Assignment (vectorized keyword index, no per-row loop)
+df["Cohort"] = assign_cohorts(df["interests"], interest_categories, multi_label=False)  # First match
+df["Cohorts"] = assign_cohorts(df["interests"], interest_categories)  # Every matching category
 
-print(df[["interests", "Cohort"]])
+print(df[["interests", "Cohort", "Cohorts"]])
+print(cohort_counts(df["interests"], interest_categories))  # Multi-label users per cohort
 
 
 
@@ -0,0 +1,102 @@
+import argparse
+import pandas as pd
+from connection import cli_settings, configure_collection, create_client
+
+# Field paths used by the Marketing_Model charts
+COUNTRY = "data.location.country"
+GENDER = "data.demographics.gender"
+INCOME = "data.demographics.income"
+AGE = "data.demographics.age"
+INTERESTS = "data.interests"
+UNKNOWN = "Unknown"
+
+# ✅ Group-by count pipeline: project only the grouped fields, unwind arrays,
+# count per combination and sort largest first. Missing values are dropped
+# (like value_counts) unless `missing` gives them a label.
+def count_pipeline(fields, unwind=(), missing=None, query=None):
+    names = {field: field.split(".")[-1] for field in fields}
+    pipeline = [{"$match": query}] if query else []
+    pipeline.append({"$project": {"_id": 0, **{name: f"${field}" for field, name in names.items()}}})
+    for field in unwind:
+        pipeline.append({"$unwind": f"${names[field]}"})
+
+    group_key = {}
+    for name in names.values():
+        group_key[name] = {"$ifNull": [f"${name}", missing]} if missing is not None else f"${name}"
+    if missing is None:
+        pipeline.append({"$match": {name: {"$ne": None} for name in names.values()}})
+
+    pipeline += [
+        {"$group": {"_id": group_key, "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, **{f"_id.{name}": 1 for name in names.values()}}},
+    ]
+    return pipeline
+
+# ✅ Run a count pipeline and return a small DataFrame [<field names>..., "count"]
+def count_by(collection, fields, unwind=(), missing=None, query=None):
+    names = [field.split(".")[-1] for field in fields]
+    rows = [{**row["_id"], "count": row["count"]}
+            for row in collection.aggregate(count_pipeline(fields, unwind, missing, query))]
+    return pd.DataFrame(rows, columns=names + ["count"])
+
+# ✅ Users per country
+def country_counts(collection, query=None):
+    return count_by(collection, [COUNTRY], query=query)
+
+# ✅ Users per gender
+def gender_counts(collection, query=None):
+    return count_by(collection, [GENDER], query=query)
+
+# ✅ Users per income bracket (missing income reported as "Unknown")
+def income_counts(collection, query=None):
+    return count_by(collection, [INCOME], missing=UNKNOWN, query=query)
+
+# ✅ Mentions per interest (one row per interest in each profile)
+def interest_counts(collection, query=None):
+    return count_by(collection, [INTERESTS], unwind=[INTERESTS], query=query)
+
+# ✅ Users per (income, gender)
+def income_by_gender(collection, query=None):
+    return count_by(collection, [INCOME, GENDER], missing=UNKNOWN, query=query)
+
+# ✅ Users per (interest, income bracket)
+def income_by_interest(collection, query=None):
+    return count_by(collection, [INTERESTS, INCOME], unwind=[INTERESTS], missing=UNKNOWN, query=query)
+
+# ✅ Explicit full load: stream a projected cursor and yield one DataFrame per chunk
+# (flattened column names, e.g. "data.demographics.age")
+def iter_frames(collection, fields, query=None, chunk_size=10000):
+    cursor = collection.find(query or {}, {"_id": 0, **{field: 1 for field in fields}}, batch_size=chunk_size)
+    chunk = []
+    for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= chunk_size:
+            yield pd.json_normalize(chunk).reindex(columns=fields)
+            chunk = []
+    if chunk:
+        yield pd.json_normalize(chunk).reindex(columns=fields)
+
+# ✅ Explicit full load of only the requested fields, built chunk by chunk
+def load_frame(collection, fields, query=None, chunk_size=10000):
+    frames = list(iter_frames(collection, fields, query, chunk_size))
+    if not frames:
+        return pd.DataFrame(columns=fields)
+    return pd.concat(frames, ignore_index=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the Marketing_Model summaries computed in MongoDB")
+    parser.add_argument("--uri", help="Overrides MONGO_URI / the configured URI (connection.py)")
+    parser.add_argument("--collection", default="unique")
+    args = parser.parse_args()
+
+    settings = cli_settings(args.uri)
+    collection = configure_collection(create_client(settings)[settings["database"]], args.collection, settings)
+    for title, summary in (
+        ("Country", country_counts),
+        ("Gender", gender_counts),
+        ("Income", income_counts),
+        ("Interests", interest_counts),
+        ("Income by interest", income_by_interest),
+    ):
+        print(f"\n📊 {title}")
+        print(summary(collection).to_string(index=False))
@@ -0,0 +1,303 @@
+import json
+import math
+import bson
+from bson import ObjectId
+from bson.errors import InvalidDocument, InvalidId
+from datetime import datetime
+from fastapi import HTTPException
+from bitmap_index import FIELDS as BITMAP_FIELDS
+from identity_resolver import UPDATED, EMAIL_MERGED, INSERTED, CONFLICT, FAILED
+from segments import AGE_BUCKETS
+from serialization import MongoJSONResponse, dumps as json_bytes
+from transform import DATE_FORMAT
+
+# Request parsing, validation, cohort queries and response shaping shared by server.py
+# and server_async.py. Nothing here holds state: importing this module creates no
+# client, cache, metrics or queue (those belong to the server module that runs).
+
+# ✅ Cache keys a profile can be looked up by
+def user_cache_keys(data):
+    return [("cookie", data.get("cookie")), ("email", data.get("email"))]
+
+# ✅ clustering.py needs scikit-learn, scipy and joblib, which the server does not:
+# it is imported at startup and the cluster endpoints answer 503 when it is missing
+def load_cluster_model():
+    try:
+        import clustering
+    except ImportError as exc:
+        print(f"⚠️ User clustering disabled ({exc}); install scikit-learn, scipy and joblib to enable it")
+        return None
+    return clustering.load_model(clustering.MODEL_PATH)
+
+# ✅ Function: Sanitize Data (Convert NaN to None) - applied once to ingest payloads,
+# responses are rendered by MongoJSONResponse (NaN -> null) without this copy
+def sanitize_data(data):
+    if isinstance(data, dict):
+        return {k: sanitize_data(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [sanitize_data(v) for v in data]
+    elif isinstance(data, float) and math.isnan(data):
+        return None
+    return data
+
+# Response messages per merge outcome (shared by single and batch ingest)
+INGEST_MESSAGES = {
+    UPDATED: "User updated successfully in unique table",
+    EMAIL_MERGED: "User email matched, merged profile in unique and stored in cohort",
+    INSERTED: "New user inserted successfully in unique table",
+    CONFLICT: "Email already belongs to another user profile",
+    FAILED: "User profile could not be written",
+}
+
+# Batch outcomes reported as failed items
+INGEST_ERRORS = {CONFLICT, FAILED}
+
+# ✅ Validate & sanitize one ingest payload (raises HTTPException on bad input)
+def prepare_ingest_data(payload):
+    if (not isinstance(payload, dict) or not isinstance(payload.get("data"), dict)
+            or "cookie" not in payload["data"] or "email" not in payload["data"]):
+        raise HTTPException(status_code=400, detail="Missing required fields in 'data'")
+
+    data = sanitize_data(payload["data"])  # Sanitize input
+
+    # ✅ Ensure created_at is handled properly
+    if "created_at" in data and isinstance(data["created_at"], str):
+        try:
+            data["created_at"] = datetime.strptime(data["created_at"], DATE_FORMAT)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format for created_at")
+
+    # ✅ Reject what MongoDB can never store (e.g. integers past 8 bytes) before it is
+    # accepted: a write-behind payload would otherwise fail on every retry
+    try:
+        bson.encode({"data": data})
+    except (InvalidDocument, OverflowError):
+        raise HTTPException(status_code=400, detail="Payload cannot be stored in MongoDB")
+
+    return data
+
+# Largest /api/ingest/batch accepted: a batch is validated, merged and answered in memory
+MAX_BATCH_ITEMS = 10000
+
+# ✅ 413 for a batch larger than MAX_BATCH_ITEMS
+def check_batch_size(count):
+    if count > MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch has {count} items, the limit is {MAX_BATCH_ITEMS}; split it into smaller batches",
+        )
+
+# ✅ Parse a batch body: JSON array (or single object) or NDJSON, one payload per line
+def parse_batch_body(body, content_type):
+    if "ndjson" in content_type or "jsonl" in content_type:
+        lines = [line for line in body.splitlines() if line.strip()]
+        check_batch_size(len(lines))  # Before any line is parsed
+        payloads = []
+        for line in lines:
+            try:
+                payloads.append(json.loads(line))
+            except ValueError:
+                payloads.append(None)  # Reported as an invalid item
+        return payloads
+
+    try:
+        payloads = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body is not valid JSON")
+    payloads = payloads if isinstance(payloads, list) else [payloads]
+    check_batch_size(len(payloads))
+    return payloads
+
+# ✅ Validate every payload of a batch -> (results with the invalid items already
+# reported, indexes of the valid items, their {"data": ...} records)
+def validate_batch(payloads):
+    results = [None] * len(payloads)
+    valid_indexes, records = [], []
+
+    for index, payload in enumerate(payloads):
+        try:
+            data = prepare_ingest_data(payload)
+        except HTTPException as exc:
+            results[index] = {"index": index, "status": "error", "detail": exc.detail}
+            continue
+        valid_indexes.append(index)
+        records.append({"data": data})
+    return results, valid_indexes, records
+
+# ✅ Batch response: the merge outcome of every valid item next to the invalid ones
+def batch_response(results, valid_indexes, outcomes):
+    for index, outcome in zip(valid_indexes, outcomes):
+        if outcome in INGEST_ERRORS:
+            results[index] = {"index": index, "status": "error", "detail": INGEST_MESSAGES[outcome]}
+        else:
+            results[index] = {"index": index, "status": outcome, "message": INGEST_MESSAGES[outcome]}
+
+    return {
+        "received": len(results),
+        "ingested": len(valid_indexes),
+        "failed": sum(result["status"] == "error" for result in results),
+        "results": results,
+    }
+
+# ✅ Build the Mongo filter for cohort searches
+def build_cohort_query(cookie=None, email=None, country=None, age_min=None, age_max=None,
+                       gender=None, income=None, education=None, interests=None):
+    query = {}
+
+    if cookie:
+        query["data.cookie"] = cookie
+    if email:
+        query["data.email"] = email
+    if country:
+        query["data.location.country"] = country
+    if age_min:
+        query["data.demographics.age"] = {"$gte": age_min}
+    if age_max:
+        query.setdefault("data.demographics.age", {})["$lte"] = age_max
+    if gender:
+        query["data.demographics.gender"] = gender
+    if income:
+        query["data.demographics.income"] = income
+    if education:
+        query["data.demographics.education"] = education
+    if interests:
+        query["data.interests"] = {"$in": interests}
+
+    return query
+
+# Cohort filters on plain profile fields (filter name -> path inside "data")
+COHORT_FIELD_PATHS = {
+    "cookie": ("cookie",),
+    "email": ("email",),
+    "country": ("location", "country"),
+    "gender": ("demographics", "gender"),
+    "income": ("demographics", "income"),
+    "education": ("demographics", "education"),
+}
+
+# ✅ Canonical cache key for cohort filters: parameter order and duplicate
+# interests do not change it (unset filters are dropped like build_cohort_query does)
+def canonical_cohort_filters(cookie=None, email=None, country=None, age_min=None, age_max=None,
+                             gender=None, income=None, education=None, interests=None):
+    filters = {
+        "cookie": cookie, "email": email, "country": country, "age_min": age_min, "age_max": age_max,
+        "gender": gender, "income": income, "education": education,
+        "interests": tuple(sorted(set(interests))) if interests else None,
+    }
+    return tuple(sorted((name, value) for name, value in filters.items() if value))
+
+# ✅ Does a profile written to "cohort" fall inside a cached segment's filters?
+def cohort_filters_match(filters, data):
+    filters = dict(filters)
+
+    for name, path in COHORT_FIELD_PATHS.items():
+        if name in filters:
+            value = data
+            for part in path:
+                value = value.get(part) if isinstance(value, dict) else None
+            if value != filters[name]:
+                return False
+
+    if "age_min" in filters or "age_max" in filters:
+        demographics = data.get("demographics")
+        age = demographics.get("age") if isinstance(demographics, dict) else None
+        if not isinstance(age, (int, float)) or math.isnan(age):
+            return False
+        if age < filters.get("age_min", age) or age > filters.get("age_max", age):
+            return False
+
+    if "interests" in filters:
+        interests = data.get("interests")
+        interests = interests if isinstance(interests, list) else [interests]
+        if not set(interests) & set(filters["interests"]):
+            return False
+
+    return True
+
+# Keyset pagination: pages are ordered by _id and the continuation token is the last _id
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+# ✅ Continuation token -> ObjectId to resume after
+def decode_continuation_token(after):
+    try:
+        return ObjectId(after)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid 'after' continuation token")
+
+# ✅ One NDJSON line per document
+def to_ndjson_line(doc):
+    doc.pop("_id", None)
+    return json_bytes(doc) + b"\n"
+
+# ✅ Split a fetched page (limit + 1 documents) into results and the next token
+def build_page(docs, page_size):
+    next_token = None
+    if len(docs) > page_size:
+        docs = docs[:page_size]
+        next_token = str(docs[-1]["_id"])
+    for doc in docs:
+        doc.pop("_id", None)
+    return MongoJSONResponse({"users": docs, "next": next_token})
+
+# Cohort results return the merged profile only (not the merge count / history)
+COHORT_PROJECTION = {"data": 1}
+
+STATS_FIELDS = {
+    "country": "$data.location.country",
+    "gender": "$data.demographics.gender",
+    "income": "$data.demographics.income",
+    "education": "$data.demographics.education",
+}
+
+# ✅ Group-by count facet, largest groups first
+def _count_by(field):
+    return [{"$group": {"_id": field, "count": {"$sum": 1}}}, {"$sort": {"count": -1, "_id": 1}}]
+
+# ✅ One $facet aggregation computing the total and every breakdown server-side
+def cohort_stats_pipeline(query):
+    facets = {name: _count_by(field) for name, field in STATS_FIELDS.items()}
+    facets["total"] = [{"$count": "count"}]
+    facets["age"] = [
+        {"$bucket": {"groupBy": "$data.demographics.age", "boundaries": AGE_BUCKETS,
+                     "default": "Unknown", "output": {"count": {"$sum": 1}}}},
+    ]
+    facets["interests"] = [{"$unwind": "$data.interests"}] + _count_by("$data.interests")
+    return [{"$match": query}, {"$facet": facets}]
+
+# ✅ Human-readable age band for a $bucket lower bound
+def _age_label(lower):
+    if lower == "Unknown":
+        return lower
+    upper = AGE_BUCKETS[AGE_BUCKETS.index(lower) + 1]
+    return f"{lower}+" if upper == AGE_BUCKETS[-1] else f"{lower}-{upper - 1}"
+
+# ✅ Flatten the $facet output into {"total": n, "<field>": [{"value": ..., "count": ...}]}
+def format_cohort_stats(result):
+    stats = {"total": result["total"][0]["count"] if result["total"] else 0}
+    for name in list(STATS_FIELDS) + ["interests"]:
+        stats[name] = [{"value": group["_id"], "count": group["count"]} for group in result[name]]
+    stats["age"] = [{"value": _age_label(group["_id"]), "count": group["count"]} for group in result["age"]]
+    return stats
+
+# ✅ Reject bitmap keys that are not "<field>:<value>" with an indexed field
+def check_bitmap_keys(keys):
+    for key in keys:
+        field, _, value = key.partition(":")
+        if field not in BITMAP_FIELDS or not value:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid segment key '{key}' (expected <field>:<value>, field in {', '.join(BITMAP_FIELDS)})",
+            )
+
+# ✅ Loaded cluster model, or 503 until clustering.py has been run (with its dependencies installed)
+def require_cluster_model(model):
+    if model is None:
+        raise HTTPException(status_code=503, detail="Cluster model not available (install scikit-learn, scipy and joblib, then run clustering.py)")
+    return model
+
+# ✅ Profile "data" dicts from a cluster batch body ([{"data": {...}}, ...])
+def parse_cluster_profiles(payloads):
+    if not all(isinstance(payload, dict) and isinstance(payload.get("data"), dict) for payload in payloads):
+        raise HTTPException(status_code=400, detail="Each item must be an object with a 'data' object")
+    return [payload["data"] for payload in payloads]
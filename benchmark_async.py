@@ -0,0 +1,85 @@
+import argparse
+import json
+import random
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+# Concurrency benchmark: sync server (server:app) vs async server (server_async:app).
+# Start both first, e.g.
+#   uvicorn server:app --port 8000 --workers 1
+#   uvicorn server_async:app --port 8001 --workers 1
+
+# ✅ Time one GET request (404s still count: the lookup round trip happened)
+def timed_get(url):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            response.read()
+    except urllib.error.HTTPError as exc:
+        if exc.code >= 500:
+            raise
+    return time.perf_counter() - start
+
+# ✅ Percentile over a sorted list of latencies
+def percentile(values, pct):
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+# ✅ Fire `requests` lookups with `concurrency` parallel clients
+def run_level(base_url, paths, concurrency, requests):
+    urls = [base_url + random.choice(paths) for _ in range(requests)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(timed_get, urls))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "throughput_rps": round(requests / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+# ✅ Request paths for /api/user and /api/cohort/user built from the sample CSV
+def build_paths(csv_path, endpoint, sample_size=1000):
+    df = pd.read_csv(csv_path, usecols=["cookie", "country"]).dropna().sample(frac=1, random_state=42)
+    if endpoint == "user":
+        return [f"/api/user?{urllib.parse.urlencode({'cookie': cookie})}" for cookie in df["cookie"].head(sample_size)]
+    return [f"/api/cohort/user?{urllib.parse.urlencode({'country': country})}" for country in df["country"].unique()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare sync vs async server latency under concurrency")
+    parser.add_argument("--sync-url", default="http://localhost:8000")
+    parser.add_argument("--async-url", default="http://localhost:8001")
+    parser.add_argument("--csv", default="sample_user_data.csv")
+    parser.add_argument("--endpoint", choices=["user", "cohort"], default="user")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 40, 80, 160])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    random.seed(42)
+    paths = build_paths(args.csv, args.endpoint)
+    results = {"sync": [], "async": []}
+
+    for name, base_url in (("sync", args.sync_url), ("async", args.async_url)):
+        timed_get(base_url + "/api/health")  # Warm up
+        for concurrency in args.concurrency:
+            result = run_level(base_url, paths, concurrency, args.requests)
+            results[name].append(result)
+            print(f"{name:>5} c={concurrency:<4} {result['throughput_rps']:>8} req/s  "
+                  f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
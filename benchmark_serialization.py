@@ -0,0 +1,63 @@
+import argparse
+import json
+import statistics
+import time
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+from api_common import sanitize_data
+from serialization import MongoJSONResponse
+from transform import transform_frame
+
+# Micro-benchmark of the /api/cohort/user response path for one uncached result:
+#   previous: sanitize_data copy -> cache size (json.dumps) -> jsonable_encoder -> JSONResponse
+#   current:  one orjson render (the bytes are also what gets cached)
+
+# ✅ Cohort-shaped profiles ({"data": {...}} with datetimes, as PyMongo returns them) built
+# from the sample CSV, repeated up to `rows`; every 10th profile keeps a NaN age like a
+# legacy document
+def build_documents(csv_path, rows):
+    _, records, _ = transform_frame(pd.read_csv(csv_path))
+    docs = [records[index % len(records)] for index in range(rows)]
+    docs = [{"data": {**doc["data"], "demographics": dict(doc["data"]["demographics"])}} for doc in docs]
+    for doc in docs:
+        if isinstance(doc["data"].get("created_at"), pd.Timestamp):
+            doc["data"]["created_at"] = doc["data"]["created_at"].to_pydatetime()
+    for doc in docs[::10]:
+        doc["data"]["demographics"]["age"] = float("nan")
+    return docs
+
+def previous_path(docs):
+    users = sanitize_data(docs)
+    len(json.dumps(users, default=str))  # Cache entry size
+    return JSONResponse(jsonable_encoder(users)).body
+
+def current_path(docs):
+    return MongoJSONResponse(docs).body
+
+# ✅ Median / best wall time of `repeat` runs, in milliseconds
+def time_path(path, docs, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        path(docs)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(timings), 2), "best_ms": round(min(timings), 2)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the previous and current cohort response serialization")
+    parser.add_argument("--csv", default="sample_user_data.csv")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        docs = build_documents(args.csv, rows)
+        if json.loads(previous_path(docs)) != json.loads(current_path(docs)):
+            raise SystemExit(f"❌ Serialized output differs for {rows} rows")
+
+        previous = time_path(previous_path, docs, args.repeat)
+        current = time_path(current_path, docs, args.repeat)
+        speedup = previous["median_ms"] / max(current["median_ms"], 0.01)
+        print(f"{rows:>7} rows  previous {previous['median_ms']:>9} ms  "
+              f"current {current['median_ms']:>8} ms  ({speedup:.1f}x)")
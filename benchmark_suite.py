@@ -0,0 +1,291 @@
+import argparse
+import atexit
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import pandas as pd
+from analytics import AGE, COUNTRY, GENDER, INCOME, INTERESTS, country_counts, income_by_interest, interest_counts, load_frame
+from benchmark_async import build_paths, percentile, run_level, timed_get
+from connection import cli_settings, configure_collection, create_client
+from generate_data import fit_profile, write_csv
+from transform import DATE_FORMAT, transform_frame
+
+# End-to-end benchmark suite on generated data (generate_data.py). Without --uri it
+# starts a throwaway mongod (pymongo_inmemory, downloaded on first use) and a server on
+# it, and stops both at the end:
+#   python benchmark_suite.py --rows 100000 --output bench/results.json
+# With --uri it runs against that MongoDB and a server already started on it:
+#   uvicorn server:app --port 8000 --workers 1
+#   python benchmark_suite.py --uri mongodb://localhost:27017 --base-url http://localhost:8000
+# Results are written as JSON; --baseline compares them with an earlier run and exits
+# with code 1 when a metric regressed by more than --tolerance.
+PHASES = ["ingest", "upload", "reads", "analytics"]
+ANALYTICS_FIELDS = [COUNTRY, GENDER, INCOME, AGE, INTERESTS]
+
+# ✅ /api/ingest payloads from a CSV, one list per chunk (created_at back in DATE_FORMAT)
+def iter_payloads(csv_path, chunk_size):
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+        _, records, _ = transform_frame(chunk)
+        payloads = []
+        for record in records:
+            data = dict(record["data"])
+            if data.get("created_at") is not None:
+                data["created_at"] = data["created_at"].strftime(DATE_FORMAT)
+            else:
+                data.pop("created_at", None)
+            payloads.append({"data": data})
+        yield payloads
+
+# ✅ Time one POST request (server errors abort the run)
+def timed_post(url, body, content_type="application/json"):
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            response.read()
+    except urllib.error.HTTPError as exc:
+        if exc.code >= 500:
+            raise
+    return time.perf_counter() - start
+
+# ✅ Throughput plus latency percentiles of a set of timed calls
+def summarize(latencies, rows, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else None,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+# ✅ NDJSON batches to /api/ingest/batch with `concurrency` parallel clients
+def bench_batch_ingest(base_url, csv_path, batch_size, concurrency):
+    batches = [
+        (len(payloads), "\n".join(json.dumps(payload) for payload in payloads).encode())
+        for payloads in iter_payloads(csv_path, batch_size)
+    ]
+    url = base_url + "/api/ingest/batch"
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(lambda batch: timed_post(url, batch[1], "application/x-ndjson"), batches))
+    return {**summarize(latencies, sum(rows for rows, _ in batches), time.perf_counter() - start),
+            "batch_size": batch_size, "concurrency": concurrency}
+
+# ✅ One payload per /api/ingest request with `concurrency` parallel clients
+def bench_single_ingest(base_url, csv_path, concurrency):
+    bodies = [json.dumps(payload).encode() for payloads in iter_payloads(csv_path, 10000) for payload in payloads]
+    url = base_url + "/api/ingest"
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(lambda body: timed_post(url, body), bodies))
+    return {**summarize(latencies, len(bodies), time.perf_counter() - start), "concurrency": concurrency}
+
+# ✅ upload_csv.ingest_csv rows/s (uses upload_csv's own connection)
+def bench_upload(csv_path, chunk_size):
+    import upload_csv
+
+    upload_csv.connect()
+    upload_csv.ensure_indexes(upload_csv.db)
+    start = time.perf_counter()
+    totals = upload_csv.ingest_csv(csv_path, chunk_size=chunk_size)
+    elapsed = time.perf_counter() - start
+    rows = sum(len(chunk) for chunk in pd.read_csv(csv_path, usecols=["cookie"], chunksize=100000))
+    return {"rows": rows, "seconds": round(elapsed, 3), "rows_per_s": round(rows / elapsed, 1),
+            "raw_inserted": totals["raw"], "chunk_size": chunk_size}
+
+# ✅ /api/user and /api/cohort/user latency at each concurrency level
+def bench_reads(base_url, csv_path, levels, requests):
+    timed_get(base_url + "/api/health")  # Warm up
+    results = {}
+    for endpoint in ("user", "cohort"):
+        paths = build_paths(csv_path, endpoint)
+        results[endpoint] = [run_level(base_url, paths, concurrency, requests) for concurrency in levels]
+    return results
+
+# ✅ Seconds to load the Marketing_Model fields and to run the chart aggregations
+def bench_analytics(uri=None):
+    settings = cli_settings(uri)
+    unique_collection = configure_collection(create_client(settings)[settings["database"]], "unique", settings)
+    results = {}
+    start = time.perf_counter()
+    frame = load_frame(unique_collection, ANALYTICS_FIELDS)
+    results["load_frame"] = {"rows": len(frame), "seconds": round(time.perf_counter() - start, 3)}
+    for name, summary in (("country_counts", country_counts), ("interest_counts", interest_counts),
+                          ("income_by_interest", income_by_interest)):
+        start = time.perf_counter()
+        summary(unique_collection)
+        results[name] = {"seconds": round(time.perf_counter() - start, 3)}
+    return results
+
+# ✅ Start a throwaway mongod and `uvicorn server:app` on it; returns (uri, base_url, stop)
+def start_local_stack(port, timeout=60):
+    try:
+        from pymongo_inmemory import Mongod
+    except ImportError:
+        raise SystemExit("❌ No --uri given and pymongo_inmemory is not installed (pip install pymongo_inmemory)")
+    try:
+        mongod = Mongod(None)
+        mongod.start()
+    except Exception as exc:
+        raise SystemExit(f"❌ Could not start a local mongod, pass --uri instead: {exc}")
+
+    uri = mongod.connection_string
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--workers", "1", "--log-level", "warning"],
+        env={**os.environ, "MONGO_URI": uri},
+    )
+
+    def stop():
+        server.terminate()
+        server.wait()
+        mongod.stop()
+
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(base_url + "/api/health", timeout=2) as response:
+                response.read()
+            break
+        except (urllib.error.URLError, ConnectionError):
+            if server.poll() is not None or time.monotonic() > deadline:
+                stop()
+                raise SystemExit(f"❌ The server on {uri} did not become healthy")
+            time.sleep(0.5)
+    print(f"🧪 Local mongod at {uri}, server at {base_url}")
+    return uri, base_url, stop
+
+# ✅ Generate the three input files once per (rows, seed)
+def prepare_inputs(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    profile = fit_profile(pd.read_csv(args.sample))
+    inputs = {}
+    # Separate seeds: single-request and upload rows are new users, not repeats of the batch data
+    for name, rows, seed in (("batch", args.rows, args.seed), ("single", args.single_rows, args.seed + 1),
+                             ("upload", args.upload_rows, args.seed + 2)):
+        path = os.path.join(args.workdir, f"{name}-{rows}-{seed}.csv")
+        if not os.path.exists(path):
+            write_csv(profile, path, rows, seed)
+        inputs[name] = path
+    return inputs
+
+# ✅ Flatten nested results into {"ingest.batch.rows_per_s": value, ...}
+def flatten(results, prefix=""):
+    flat = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            flat.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(results, list):
+        for item in results:
+            label = f"c{item['concurrency']}" if isinstance(item, dict) and "concurrency" in item else str(len(flat))
+            flat.update(flatten(item, f"{prefix}{label}."))
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        flat[prefix.rstrip(".")] = results
+    return flat
+
+# ✅ Metrics that got worse than the baseline by more than `tolerance` (a fraction)
+def compare(results, baseline, tolerance):
+    regressions = []
+    current, previous = flatten(results), flatten(baseline)
+    for name, value in current.items():
+        old = previous.get(name)
+        higher_is_better = name.endswith(("rows_per_s", "throughput_rps"))
+        lower_is_better = name.endswith(("_ms", "seconds"))
+        if not old or not (higher_is_better or lower_is_better):
+            continue
+        change = (value - old) / old
+        if (higher_is_better and change < -tolerance) or (lower_is_better and change > tolerance):
+            regressions.append((name, old, value, change))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks on generated data")
+    parser.add_argument("--base-url", default="http://localhost:8000", help="Server started on --uri")
+    parser.add_argument("--uri", help="MongoDB to benchmark (default: a throwaway pymongo_inmemory mongod)")
+    parser.add_argument("--port", type=int, default=8000, help="Port of the server started without --uri")
+    parser.add_argument("--sample", default="sample_user_data.csv")
+    parser.add_argument("--workdir", default="bench")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows ingested through /api/ingest/batch")
+    parser.add_argument("--single-rows", type=int, default=5000, help="Rows ingested one request at a time")
+    parser.add_argument("--upload-rows", type=int, default=100000, help="Rows ingested with upload_csv.py")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    # Concurrent batches that touch the same profile are resolved again on write (see
+    # identity_resolver.apply_identity_batch); sequential by default for comparable runs
+    parser.add_argument("--batch-concurrency", type=int, default=1)
+    parser.add_argument("--ingest-concurrency", type=int, default=4, help="Parallel clients for /api/ingest")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 40])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=PHASES)
+    parser.add_argument("--output", default=None, help="Results file (default: <workdir>/results-<timestamp>.json)")
+    parser.add_argument("--baseline", help="Earlier results file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    started_at = datetime.now(timezone.utc)
+    inputs = prepare_inputs(args)
+    results = {}
+
+    if args.uri is None:
+        args.uri, args.base_url, stop_local_stack = start_local_stack(args.port)
+        atexit.register(stop_local_stack)  # Also stops both when a phase fails
+    os.environ["MONGO_URI"] = args.uri  # upload_csv.connect() reads the URI from connection.py settings
+
+    if "ingest" in args.phases:
+        results["ingest"] = {
+            "batch": bench_batch_ingest(args.base_url, inputs["batch"], args.batch_size, args.batch_concurrency),
+            "single": bench_single_ingest(args.base_url, inputs["single"], args.ingest_concurrency),
+        }
+        print(f"📥 Ingest: batch {results['ingest']['batch']['rows_per_s']} rows/s, "
+              f"single {results['ingest']['single']['rows_per_s']} rows/s")
+    if "upload" in args.phases:
+        results["upload"] = bench_upload(inputs["upload"], args.batch_size * 5)
+        print(f"📂 upload_csv: {results['upload']['rows_per_s']} rows/s")
+    if "reads" in args.phases:
+        results["reads"] = bench_reads(args.base_url, inputs["batch"], args.concurrency, args.requests)
+        for endpoint, levels in results["reads"].items():
+            for level in levels:
+                print(f"🔎 {endpoint:>6} c={level['concurrency']:<4} {level['throughput_rps']:>8} req/s  "
+                      f"p50={level['p50_ms']}ms p95={level['p95_ms']}ms p99={level['p99_ms']}ms")
+    if "analytics" in args.phases:
+        results["analytics"] = bench_analytics(args.uri)
+        print(f"📊 Analytics load: {results['analytics']['load_frame']['seconds']}s "
+              f"for {results['analytics']['load_frame']['rows']} profiles")
+
+    report = {
+        "meta": {
+            "started_at": started_at.isoformat(),
+            "python": platform.python_version(),
+            "rows": args.rows, "single_rows": args.single_rows, "upload_rows": args.upload_rows,
+            "seed": args.seed, "phases": args.phases, "base_url": args.base_url,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(args.workdir, f"results-{started_at:%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for name, old, new, change in regressions:
+            print(f"❌ {name}: {old} -> {new} ({change:+.0%})")
+        if regressions:
+            raise SystemExit(1)
+        print(f"✅ No metric regressed by more than {args.tolerance:.0%}")
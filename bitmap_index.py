@@ -0,0 +1,207 @@
+import threading
+import time
+import numpy as np
+from segments import age_band
+
+# In-process bitmap index over "unique" profiles for interactive segment counts.
+# Every profile gets a stable ordinal (kept across cookie changes); each
+# "<field>:<value>" key maps to a numpy uint64 word array used as a bitset over those
+# ordinals, so "X AND Y AND NOT Z" is a few in-place vector operations plus one
+# popcount, and a write flips single bits by word index instead of copying bitsets.
+# Only this process's writes are applied incrementally; writes of other processes are
+# detected through the shared "unique" write version (cache.py) and picked up by a
+# rebuild (see check_due() / behind()), so counts lag other writers until then.
+FIELDS = ("country", "gender", "income", "education", "age", "interests")
+
+WORD_BITS = 64
+
+# ✅ Bitmap keys of a profile ("country:USA", "age:25-34", "interests:Tech", ...)
+def profile_keys(data):
+    if not isinstance(data, dict):
+        return set()
+    location = data.get("location") if isinstance(data.get("location"), dict) else {}
+    demographics = data.get("demographics") if isinstance(data.get("demographics"), dict) else {}
+
+    keys = {f"age:{age_band(demographics.get('age'))}"}
+    for field, value in (
+        ("country", location.get("country")),
+        ("gender", demographics.get("gender")),
+        ("income", demographics.get("income")),
+        ("education", demographics.get("education")),
+    ):
+        if value:
+            keys.add(f"{field}:{value}")
+
+    interests = data.get("interests")
+    if isinstance(interests, list):
+        keys.update(f"interests:{interest}" for interest in interests if interest)
+    return keys
+
+# ✅ Bitset of `words` uint64 words with the given ordinals set (one numpy pass)
+def _bitset(ordinals, words):
+    flags = np.zeros(words * WORD_BITS, dtype=bool)
+    flags[np.fromiter(ordinals, dtype=np.int64, count=len(ordinals))] = True
+    return np.packbits(flags, bitorder="little").view("<u8").astype(np.uint64)
+
+# ✅ Set bits of a word array
+if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+    def _popcount(words):
+        return int(np.bitwise_count(words).sum(dtype=np.int64))
+else:
+    _BYTE_COUNTS = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+    def _popcount(words):
+        return int(_BYTE_COUNTS[words.view(np.uint8)].sum(dtype=np.int64))
+
+# ✅ Word index and mask of an ordinal's bit
+def _bit(ordinal):
+    return ordinal // WORD_BITS, np.uint64(1 << (ordinal % WORD_BITS))
+
+# Fields read from "unique" to build the index
+PROJECTION = {"_id": 0, "data.cookie": 1, "data.location.country": 1, "data.demographics": 1, "data.interests": 1}
+
+# ✅ Ordinal / key lists collected while scanning "unique"
+class _Builder:
+    def __init__(self):
+        self.ordinals = {}         # cookie -> ordinal
+        self.keys_by_ordinal = []  # ordinal -> set of keys
+        self.members = {}          # key -> list of ordinals
+
+    def add(self, doc):
+        data = doc.get("data") or {}
+        ordinal = len(self.keys_by_ordinal)
+        self.ordinals[data.get("cookie")] = ordinal
+        keys = profile_keys(data)
+        self.keys_by_ordinal.append(keys)
+        for key in keys:
+            self.members.setdefault(key, []).append(ordinal)
+
+class BitmapIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ordinals = {}   # cookie -> ordinal
+        self._keys = []       # ordinal -> set of bitmap keys
+        self._words = 1       # uint64 words per bitset (capacity / 64)
+        self._bitmaps = {}    # key -> uint64 word array
+        self._all = np.zeros(self._words, dtype=np.uint64)  # every indexed profile
+        self._empty = np.zeros(self._words, dtype=np.uint64)
+        self.shared_version = None  # Shared "unique" write version the contents reflect
+        self.stale = False          # Another process wrote "unique" since the build
+        self._checked_at = None
+        self.rebuilding = threading.Lock()  # One rebuild at a time
+
+    # ✅ Full build from "unique" (startup, refresh); replaces the current contents.
+    # `shared_version` is the shared "unique" write version read before the scan.
+    def build(self, unique_collection, shared_version=None, batch_size=10000):
+        builder = _Builder()
+        for doc in unique_collection.find({}, PROJECTION, batch_size=batch_size):
+            builder.add(doc)
+        return self._install(builder, shared_version)
+
+    # ✅ Same build for an async (AsyncMongoClient) collection
+    async def build_async(self, unique_collection, shared_version=None, batch_size=10000):
+        builder = _Builder()
+        async for doc in unique_collection.find({}, PROJECTION, batch_size=batch_size):
+            builder.add(doc)
+        return self._install(builder, shared_version)
+
+    def _install(self, builder, shared_version=None):
+        size = len(builder.keys_by_ordinal)
+        words = max(1, -(-size // WORD_BITS) * 2)  # Room to grow before the first resize
+        bitmaps = {key: _bitset(ordinals, words) for key, ordinals in builder.members.items()}
+        everyone = _bitset(range(size), words)
+        with self._lock:
+            self._ordinals = builder.ordinals
+            self._keys = builder.keys_by_ordinal
+            self._words = words
+            self._bitmaps = bitmaps
+            self._all = everyone
+            self._empty = np.zeros(words, dtype=np.uint64)
+            self.shared_version = shared_version
+            self.stale = False
+            self._checked_at = time.monotonic()
+        return size
+
+    # ✅ Record the shared write version this process bumped after its own write
+    # (applied with apply_change): a gap means another process wrote in between
+    def record_write(self, shared_version):
+        with self._lock:
+            if self.shared_version is not None and shared_version != self.shared_version + 1:
+                self.stale = True
+            self.shared_version = shared_version
+
+    # ✅ Whether the shared write version should be read again (built, and the last
+    # build or check is at least `interval` seconds old)
+    def check_due(self, interval):
+        return self._checked_at is not None and time.monotonic() - self._checked_at >= interval
+
+    # ✅ Whether the shared write version read from MongoDB shows writes this process
+    # did not apply (the index then needs a rebuild)
+    def behind(self, shared_version):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            return self.stale or shared_version != self.shared_version
+
+    # ✅ Double the capacity of every bitset (amortized: new profiles usually fit)
+    def _grow(self):
+        words = self._words * 2
+        padding = np.zeros(words - self._words, dtype=np.uint64)
+        self._bitmaps = {key: np.concatenate((bitmap, padding)) for key, bitmap in self._bitmaps.items()}
+        self._all = np.concatenate((self._all, padding))
+        self._empty = np.zeros(words, dtype=np.uint64)
+        self._words = words
+
+    # ✅ Apply one profile write (before=None for a new profile). The ordinal follows
+    # the profile when an email merge gives it a new cookie.
+    def apply_change(self, before_data, after_data):
+        after_keys = profile_keys(after_data)
+        with self._lock:
+            ordinal = self._ordinals.pop(before_data.get("cookie"), None) if before_data else None
+            if ordinal is None:
+                ordinal = self._ordinals.get(after_data.get("cookie"))
+            if ordinal is None:
+                ordinal = len(self._keys)
+                self._keys.append(set())
+                if ordinal >= self._words * WORD_BITS:
+                    self._grow()
+                word, mask = _bit(ordinal)
+                self._all[word] |= mask
+            self._ordinals[after_data.get("cookie")] = ordinal
+
+            # Word-level updates: one bit per changed key, no bitset is copied
+            word, mask = _bit(ordinal)
+            old_keys = self._keys[ordinal]
+            for key in old_keys - after_keys:
+                self._bitmaps[key][word] &= ~mask
+            for key in after_keys - old_keys:
+                bitmap = self._bitmaps.get(key)
+                if bitmap is None:
+                    bitmap = self._bitmaps[key] = np.zeros(self._words, dtype=np.uint64)
+                bitmap[word] |= mask
+            self._keys[ordinal] = after_keys
+
+    def apply_changes(self, changes):
+        for before_data, after_data in changes:
+            self.apply_change(before_data, after_data)
+
+    # ✅ Users in every `include` key, in at least one `any` key and in no `exclude` key
+    # (combined in place into one result and one scratch buffer)
+    def count(self, include=(), exclude=(), any_of=()):
+        with self._lock:
+            result = self._all.copy()
+            scratch = np.empty_like(result)
+            for key in include:
+                np.bitwise_and(result, self._bitmaps.get(key, self._empty), out=result)
+            if any_of:
+                scratch.fill(0)
+                for key in any_of:
+                    np.bitwise_or(scratch, self._bitmaps.get(key, self._empty), out=scratch)
+                np.bitwise_and(result, scratch, out=result)
+            for key in exclude:
+                # result &= ~bitmap as result ^= (result & bitmap), without a complement array
+                np.bitwise_and(result, self._bitmaps.get(key, self._empty), out=scratch)
+                np.bitwise_xor(result, scratch, out=result)
+            return _popcount(result)
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,281 @@
+import threading
+import time
+from collections import OrderedDict
+from pymongo import ReturnDocument
+
+# ✅ In-process read-through cache with LRU eviction, TTL and a size limit.
+# Entries are keyed by lookup key (e.g. ("cookie", value)) and remember the profile
+# they belong to, so a write can drop every key of a profile (old email included).
+# Loads that overlap an invalidation are discarded (epoch check) so a read that raced
+# a write never re-populates the cache with the pre-write profile.
+# Writes from other processes are picked up from the shared "unique" write version
+# (see observe()), checked at most every `check_interval` seconds (0: on every lookup),
+# so another writer's change is served stale for at most that long.
+class LRUTTLCache:
+    def __init__(self, maxsize=10000, ttl=60.0, check_interval=1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._entries = OrderedDict()  # key -> (expires_at, profile_id, value)
+        self._by_profile = {}          # profile_id -> set of keys
+        self._lock = threading.Lock()
+        self.epoch = 0                 # bumped on every invalidation
+        self.shared_version = None     # Last shared write version seen (None until the first check)
+        self._checked_at = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _drop(self, key):
+        _, profile_id, _ = self._entries.pop(key)
+        keys = self._by_profile.get(profile_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_profile[profile_id]
+
+    # ✅ Cached value, or None on a miss / expired entry
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    # ✅ Store a loaded value unless an invalidation happened since `epoch`
+    def set(self, key, value, profile_id, epoch):
+        with self._lock:
+            if epoch != self.epoch:
+                return False
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, profile_id, value)
+            self._by_profile.setdefault(profile_id, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    # ✅ Drop the given keys and every key cached for the given profiles
+    def invalidate(self, keys=(), profile_ids=()):
+        with self._lock:
+            self.epoch += 1
+            doomed = set(keys)
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    doomed |= self._by_profile.get(entry[1], set())
+            for profile_id in profile_ids:
+                doomed |= self._by_profile.get(profile_id, set())
+            for key in doomed:
+                if key in self._entries:
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self.epoch += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._by_profile.clear()
+
+    # ✅ Record the shared write version this process bumped after its own write (whose
+    # keys it already invalidated): unless it directly follows the last one seen,
+    # another process wrote in between and every entry is dropped
+    def record_write(self, shared_version):
+        with self._lock:
+            if self.shared_version is not None and shared_version != self.shared_version + 1:
+                self._clear()
+            self.shared_version = shared_version
+
+    # ✅ Whether the shared write version should be read before the next lookup
+    def check_due(self):
+        return self._checked_at is None or time.monotonic() - self._checked_at >= self.check_interval
+
+    # ✅ Apply the shared write version read from MongoDB: a change this process did
+    # not record means another writer changed "unique", so every entry is dropped
+    def observe(self, shared_version):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if self.shared_version is not None and shared_version != self.shared_version:
+                self._clear()
+            self.shared_version = shared_version
+
+    # ✅ Counters for tuning size / TTL
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "shared_version": self.shared_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+# ✅ Shared write versions: one counter document per cached collection in
+# "cache_versions" ("unique" for /api/user, "cohort" for the segment results), bumped
+# by every process that writes the collection (API workers, upload_csv.py,
+# parallel_ingest.py, maintenance jobs), so a server process can tell that someone
+# else changed it
+VERSIONS_COLLECTION = "cache_versions"
+
+def bump_write_version(versions_collection, name):
+    doc = versions_collection.find_one_and_update(
+        {"_id": name}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return doc["version"]
+
+async def bump_write_version_async(versions_collection, name):
+    doc = await versions_collection.find_one_and_update(
+        {"_id": name}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return doc["version"]
+
+def read_write_version(versions_collection, name):
+    doc = versions_collection.find_one({"_id": name})
+    return doc["version"] if doc else 0
+
+async def read_write_version_async(versions_collection, name):
+    doc = await versions_collection.find_one({"_id": name})
+    return doc["version"] if doc else 0
+
+# ✅ Result cache with a memory budget for segment queries.
+# Each entry carries the collection write version it was computed from and is only
+# served while that version is current; writes either drop the entries they affect
+# or move unaffected entries to the new version. Entries are evicted LRU-first once
+# the summed result sizes exceed `max_bytes`, and expire after `ttl` seconds.
+# Writes from other processes are picked up from the shared write version (see
+# observe()), checked at most every `check_interval` seconds (0: on every lookup).
+class VersionedResultCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300.0, check_interval=1.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._entries = OrderedDict()  # key -> (version, size, value, expires_at)
+        self._lock = threading.Lock()
+        self.version = 0
+        self.shared_version = None     # Last shared write version seen (None until the first check)
+        self._checked_at = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def _drop_all(self):
+        self.version += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self.bytes = 0
+
+    # ✅ Cached value computed at the current version, or None
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != self.version:
+                self._drop(key)
+                self.stale += 1
+                self.misses += 1
+                return None
+            if entry[3] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    # ✅ Store a result computed at `version` (ignored if a write happened since)
+    def set(self, key, value, version, size):
+        with self._lock:
+            if version != self.version or size > self.max_bytes:
+                return False
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (version, size, value, time.monotonic() + self.ttl)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+            return True
+
+    # ✅ Record a collection write: bump the version, drop entries `affected(key)`
+    # says the write touches and carry the others over to the new version.
+    # Without a predicate every entry becomes stale. `shared_version` is the shared
+    # write version this write bumped to: unless it directly follows the last one
+    # seen, another process wrote in between and every entry becomes stale.
+    def record_write(self, affected=None, shared_version=None):
+        with self._lock:
+            if shared_version is not None:
+                if self.shared_version is not None and shared_version != self.shared_version + 1:
+                    affected = None
+                self.shared_version = shared_version
+            self.version += 1
+            for key in list(self._entries):
+                entry_version, size, value, expires_at = self._entries[key]
+                if affected is None or affected(key):
+                    self._drop(key)
+                    self.invalidations += 1
+                elif entry_version == self.version - 1:
+                    self._entries[key] = (self.version, size, value, expires_at)
+
+    # ✅ Whether the shared write version should be read before the next lookup
+    def check_due(self):
+        return self._checked_at is None or time.monotonic() - self._checked_at >= self.check_interval
+
+    # ✅ Apply the shared write version read from MongoDB: a change this process did
+    # not record means another writer changed the collection, so every entry is stale
+    def observe(self, shared_version):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if self.shared_version is not None and shared_version != self.shared_version:
+                self._drop_all()
+            self.shared_version = shared_version
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "version": self.version,
+                "shared_version": self.shared_version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stale": self.stale,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,130 @@
+import argparse
+import os
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+from analytics import AGE, INCOME, INTERESTS, interest_counts, iter_frames
+from cohort_assignment import explode_interests
+from connection import cli_settings, configure_collection, create_client
+
+# Out-of-core user clustering: features are streamed from MongoDB in chunks (projected
+# cursor), the scaler and MiniBatchKMeans are fitted with partial_fit, and the fitted
+# bundle is saved once so the API only ever calls predict.
+EDUCATION = "data.demographics.education"
+FEATURE_FIELDS = [AGE, INCOME, EDUCATION, INTERESTS]
+MODEL_PATH = os.environ.get("CLUSTER_MODEL_PATH", "models/user_clusters.joblib")
+
+# Ordinal encodings (unknown / missing values are imputed with the mean after scaling)
+INCOME_LEVELS = [
+    "Under $25,000", "$25,000-$49,999", "$50,000-$74,999",
+    "$75,000-$99,999", "$100,000-$149,999", "$150,000+",
+]
+EDUCATION_LEVELS = [
+    "High School", "Trade School", "Some College",
+    "Bachelor's Degree", "Master's Degree", "Doctorate",
+]
+
+def _ordinal(series, levels):
+    return series.map({level: rank for rank, level in enumerate(levels)}).astype(float)
+
+# ✅ Dense numeric features: age, income rank, education rank (NaN when unknown)
+def dense_features(frame):
+    return np.column_stack([
+        pd.to_numeric(frame[AGE], errors="coerce").astype(float),
+        _ordinal(frame[INCOME], INCOME_LEVELS),
+        _ordinal(frame[EDUCATION], EDUCATION_LEVELS),
+    ])
+
+# ✅ Sparse one-hot interests (one column per vocabulary keyword)
+def interest_matrix(interests, vocabulary):
+    positions = pd.Series(interests.to_numpy(), index=np.arange(len(interests)))
+    keywords = explode_interests(positions)
+    columns = keywords.map({keyword: column for column, keyword in enumerate(vocabulary)}).dropna()
+    matrix = sparse.csr_matrix(
+        (np.ones(len(columns)), (columns.index.to_numpy(), columns.to_numpy(dtype=np.int64))),
+        shape=(len(interests), len(vocabulary)),
+    )
+    matrix.data[:] = 1.0  # Repeated interests count once
+    return matrix
+
+# ✅ Model input: scaled dense features (missing -> mean) next to the interest columns
+def encode(bundle, frame):
+    scaled = np.nan_to_num(bundle["scaler"].transform(dense_features(frame)), nan=0.0)
+    return sparse.hstack([sparse.csr_matrix(scaled), interest_matrix(frame[INTERESTS], bundle["vocabulary"])]).tocsr()
+
+# ✅ Interest vocabulary from a $group aggregation (no profile is loaded)
+def interest_vocabulary(collection, query=None):
+    counts = interest_counts(collection, query)
+    return sorted({str(value).lower().strip() for value in counts["interests"]})
+
+# ✅ Two streaming passes: scaler statistics, then mini-batch KMeans updates
+def fit_clusters(collection, n_clusters=5, chunk_size=10000, passes=1, query=None, random_state=42):
+    bundle = {
+        "vocabulary": interest_vocabulary(collection, query),
+        "scaler": StandardScaler(),
+        "model": MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state, n_init=3),
+        "fields": FEATURE_FIELDS,
+    }
+
+    for frame in iter_frames(collection, FEATURE_FIELDS, query, chunk_size):
+        bundle["scaler"].partial_fit(dense_features(frame))
+
+    fitted = False
+    for _ in range(passes):
+        for frame in iter_frames(collection, FEATURE_FIELDS, query, chunk_size):
+            if not fitted and len(frame) < n_clusters:
+                continue  # The first update needs at least one user per cluster
+            bundle["model"].partial_fit(encode(bundle, frame))
+            fitted = True
+
+    if not fitted:
+        raise ValueError(f"Not enough users to fit {n_clusters} clusters")
+    return bundle
+
+def save_model(bundle, path=MODEL_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    joblib.dump(bundle, path)
+
+# ✅ Fitted bundle, or None when no model has been trained yet
+def load_model(path=MODEL_PATH):
+    if not os.path.exists(path):
+        return None
+    return joblib.load(path)
+
+# ✅ Cluster per row of a frame with flattened columns (e.g. from analytics.load_frame)
+def predict_frame(bundle, frame):
+    frame = frame.reindex(columns=FEATURE_FIELDS)
+    if frame.empty:
+        return np.array([], dtype=int)
+    return bundle["model"].predict(encode(bundle, frame))
+
+# ✅ Cluster per profile "data" dict
+def predict_profiles(bundle, profiles):
+    return predict_frame(bundle, pd.json_normalize([{"data": data} for data in profiles])).tolist()
+
+# ✅ Stream every profile and count users per cluster (bounded memory)
+def cluster_sizes(bundle, collection, chunk_size=10000, query=None):
+    sizes = np.zeros(bundle["model"].n_clusters, dtype=int)
+    for frame in iter_frames(collection, FEATURE_FIELDS, query, chunk_size):
+        sizes += np.bincount(predict_frame(bundle, frame), minlength=len(sizes))
+    return sizes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit user clusters from the 'unique' collection")
+    parser.add_argument("--uri", help="Overrides MONGO_URI / the configured URI (connection.py)")
+    parser.add_argument("--clusters", type=int, default=5)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--passes", type=int, default=1)
+    parser.add_argument("--output", default=MODEL_PATH)
+    args = parser.parse_args()
+
+    settings = cli_settings(args.uri)
+    unique_collection = configure_collection(create_client(settings)[settings["database"]], "unique", settings)
+    bundle = fit_clusters(unique_collection, args.clusters, args.chunk_size, args.passes)
+    save_model(bundle, args.output)
+    print(f"✅ Model saved to {args.output}")
+    for cluster, size in enumerate(cluster_sizes(bundle, unique_collection, args.chunk_size)):
+        print(f"   Cluster {cluster}: {size} users")
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+OTHER = "Other"
+
+# ✅ Default interest categories (keywords are matched lowercased and trimmed).
+# The order of the categories is the priority used for single-label output.
+DEFAULT_INTEREST_CATEGORIES = {
+    "Sports": ["sports", "football", "basketball", "cricket", "tennis"],
+    "Tech": ["tech", "ai", "gadgets", "programming", "blockchain"],
+    "Movies": ["movies", "hollywood", "bollywood", "action", "drama"],
+    "Finance": ["finance", "stock market", "investment", "banking", "crypto"],
+}
+
+# ✅ Inverted index: keyword -> categories containing it (in category priority order)
+def build_keyword_index(categories=None):
+    categories = categories or DEFAULT_INTEREST_CATEGORIES
+    index = {}
+    for category, keywords in categories.items():
+        for keyword in keywords:
+            matches = index.setdefault(keyword.lower().strip(), [])
+            if category not in matches:
+                matches.append(category)
+    return index
+
+# ✅ Explode an interests column to one normalized keyword per row (index = user).
+# Accepts lists, "a, b" strings (comma separated) and missing values.
+def explode_interests(interests):
+    is_text = interests.map(type) == str
+    if is_text.any():  # An all-missing column is float64, which has no .str accessor
+        interests = interests.where(~is_text, interests[is_text].str.split(","))
+    exploded = interests.explode().dropna().astype(str)
+    return exploded.str.lower().str.strip()
+
+# ✅ (user, category, priority) matches for every user, computed column-wise
+def _category_matches(interests, categories):
+    categories = categories or DEFAULT_INTEREST_CATEGORIES
+    keyword_index = build_keyword_index(categories)
+    priority = {category: rank for rank, category in enumerate(categories)}
+
+    keywords = explode_interests(interests)
+    matches = keywords.map(keyword_index).dropna().explode()
+    matches = matches.rename("category").to_frame()
+    matches["priority"] = matches["category"].map(priority)
+    matches["user"] = matches.index
+    return matches.drop_duplicates(["user", "category"])
+
+# ✅ Assign interest cohorts to every user.
+# multi_label=True  -> list of categories per user (e.g. ["Tech", "Finance"]), ["Other"] if none
+# multi_label=False -> first matching category in priority order (original assign_cohort)
+def assign_cohorts(interests, categories=None, multi_label=True):
+    categories = categories or DEFAULT_INTEREST_CATEGORIES
+
+    if multi_label:
+        # One bit per category -> each distinct combination is turned into a label list once
+        names = list(categories)
+        membership = cohort_membership(interests, categories)[names].to_numpy()
+        codes = pd.Series(membership @ (1 << np.arange(len(names))), index=interests.index)
+        labels = {
+            code: [name for bit, name in enumerate(names) if code >> bit & 1] or [OTHER]
+            for code in codes.unique()
+        }
+        return codes.map(labels)
+
+    users = interests.reset_index(drop=True)  # positional users, original index restored below
+    matches = _category_matches(users, categories).sort_values(["user", "priority"])
+    first = matches.drop_duplicates("user").set_index("user")["category"]
+    result = first.reindex(users.index).fillna(OTHER)
+    result.index = interests.index
+    return result
+
+# ✅ One boolean column per category (multi-label membership), "Other" for users with no match
+def cohort_membership(interests, categories=None):
+    categories = categories or DEFAULT_INTEREST_CATEGORIES
+    users = interests.reset_index(drop=True)
+    matches = _category_matches(users, categories)
+
+    names = list(categories)
+    column = matches["category"].map({name: position for position, name in enumerate(names)})
+    flags = np.zeros((len(users), len(names)), dtype=bool)
+    flags[matches["user"].to_numpy(dtype=np.int64), column.to_numpy(dtype=np.int64)] = True
+
+    membership = pd.DataFrame(flags, index=interests.index, columns=names)
+    membership[OTHER] = ~membership.any(axis=1)
+    return membership
+
+# ✅ Users per cohort (a user counts once in every cohort it belongs to)
+def cohort_counts(interests, categories=None):
+    return cohort_membership(interests, categories).sum().sort_values(ascending=False)
@@ -0,0 +1,83 @@
+import argparse
+from itertools import groupby
+from pymongo import DeleteMany, UpdateOne
+from cache import VERSIONS_COLLECTION, bump_write_version
+from connection import cli_settings, configure_collection, create_client
+from identity_resolver import COHORT_HISTORY_LIMIT
+
+# One-off compaction of "cohort" documents written before it kept one document per
+# identity: every email merge used to append a full copy of the merged profile
+# ({"data": {...}} without "merges"). Copies of the same email are folded into the
+# document of the "unique" profile owning that email (the _id new merges upsert),
+# keeping the latest copy's profile, the merge count and the last merges as history.
+LEGACY_FILTER = {"merges": {"$exists": False}}
+
+# ✅ History entry of a legacy copy (its merge time is the ObjectId timestamp)
+def _history_entry(doc):
+    return {"cookie": doc["data"].get("cookie"), "merged_at": doc["_id"].generation_time}
+
+# ✅ Writes for a batch of legacy groups [(email, [docs oldest first]), ...]
+def _compaction_ops(groups, cohort_collection, unique_collection, history_limit):
+    emails = [email for email, _ in groups if email is not None]
+    owners = {doc["data"]["email"]: doc["_id"] for doc in unique_collection.find(
+        {"data.email": {"$in": emails}}, {"data.email": 1}
+    )}
+    # Identities that already have a current document (merged again since the upgrade)
+    current = {doc["_id"] for doc in cohort_collection.find(
+        {"_id": {"$in": list(owners.values())}, "merges": {"$exists": True}}, {"_id": 1}
+    )}
+
+    ops = []
+    for email, docs in groups:
+        history = [_history_entry(doc) for doc in docs][-history_limit:] if history_limit else []
+        target = owners.get(email, docs[-1]["_id"])  # Orphaned copies keep the latest one
+        if target in current:
+            # The current document is newer: keep its profile, prepend the older merges
+            update = {"$inc": {"merges": len(docs)}}
+            if history:
+                update["$push"] = {"history": {"$each": history, "$position": 0, "$slice": -history_limit}}
+            ops.append(UpdateOne({"_id": target}, update))
+        else:
+            fields = {"data": docs[-1]["data"], "merges": len(docs), "updated_at": docs[-1]["_id"].generation_time}
+            if history:
+                fields["history"] = history
+            ops.append(UpdateOne({"_id": target}, {"$set": fields}, upsert=True))
+        copies = [doc["_id"] for doc in docs if doc["_id"] != target]
+        if copies:
+            ops.append(DeleteMany({"_id": {"$in": copies}}))
+    return ops
+
+# ✅ Fold legacy copies into one document per identity; returns (identities, removed copies).
+# Streams the legacy documents in (email, _id) order, `batch_size` identities per bulk write.
+def compact_cohort(cohort_collection, unique_collection, batch_size=1000, history_limit=COHORT_HISTORY_LIMIT):
+    cursor = cohort_collection.find(LEGACY_FILTER, {"data": 1}).sort([("data.email", 1), ("_id", 1)])
+    identities, removed, groups = 0, 0, []
+    for email, docs in groupby(cursor, key=lambda doc: doc["data"].get("email")):
+        docs = list(docs)
+        groups.append((email, docs))
+        identities += 1
+        removed += len(docs) - 1
+        if len(groups) >= batch_size:
+            cohort_collection.bulk_write(_compaction_ops(groups, cohort_collection, unique_collection, history_limit), ordered=True)
+            groups = []
+    if groups:
+        cohort_collection.bulk_write(_compaction_ops(groups, cohort_collection, unique_collection, history_limit), ordered=True)
+    if identities:
+        bump_write_version(cohort_collection.database[VERSIONS_COLLECTION], "cohort")  # Running servers drop cached cohorts
+    return identities, removed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact 'cohort' to one document per merged identity")
+    parser.add_argument("--uri", help="Overrides MONGO_URI / the configured URI (connection.py)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Identities per bulk write")
+    parser.add_argument("--history-limit", type=int, default=COHORT_HISTORY_LIMIT, help="Merges kept per identity (0: none)")
+    args = parser.parse_args()
+
+    settings = cli_settings(args.uri)
+    db = create_client(settings)[settings["database"]]
+    cohort_collection = configure_collection(db, "cohort", settings)
+    unique_collection = configure_collection(db, "unique", settings)
+    before = cohort_collection.count_documents({})
+    identities, removed = compact_cohort(cohort_collection, unique_collection, args.batch_size, args.history_limit)
+    print(f"✅ Compacted {identities} identities, removed {removed} copies "
+          f"({before} -> {cohort_collection.count_documents({})} documents)")
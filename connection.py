@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+from pymongo import AsyncMongoClient, MongoClient, ReadPreference, WriteConcern
+
+# Shared MongoDB connection settings. Values come from the defaults below, then from a
+# JSON config file (MONGO_CONFIG, default mongo_config.json when it exists), then from
+# MONGO_* environment variables. Clients are only created when first needed, so importing
+# a module that uses them opens no connections.
+CONFIG_PATH = "mongo_config.json"
+
+DEFAULTS = {
+    "uri": "mongodb://localhost:27017/",
+    "database": "user_database",
+    "max_pool_size": 100,
+    "min_pool_size": 0,
+    "max_idle_time_ms": None,
+    "wait_queue_timeout_ms": 10000,
+    "connect_timeout_ms": 20000,
+    "server_selection_timeout_ms": 30000,
+    "socket_timeout_ms": None,
+    "read_preference": "primary",
+    # Per collection: write concern and optional read preference.
+    # "users" is an append-only log that the content hash deduplicates, so it does not wait
+    # for the journal. Profiles wait for a majority so a failover cannot roll back merges.
+    "collections": {
+        "users": {"write_concern": {"w": 1, "j": False}},
+        "unique": {"write_concern": {"w": "majority"}},
+        "cohort": {"write_concern": {"w": "majority"}},
+    },
+}
+
+# Environment variable -> setting (timeouts in milliseconds)
+ENVIRONMENT = {
+    "MONGO_URI": ("uri", str),
+    "MONGO_DATABASE": ("database", str),
+    "MONGO_MAX_POOL_SIZE": ("max_pool_size", int),
+    "MONGO_MIN_POOL_SIZE": ("min_pool_size", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("max_idle_time_ms", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("wait_queue_timeout_ms", int),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connect_timeout_ms", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("server_selection_timeout_ms", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socket_timeout_ms", int),
+    "MONGO_READ_PREFERENCE": ("read_preference", str),
+}
+WRITE_CONCERN_PREFIX = "MONGO_WRITE_CONCERN_"  # e.g. MONGO_WRITE_CONCERN_USERS=0
+
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+# ✅ "0" / "1" / "majority" -> {"w": ...}; a JSON object ('{"w": 1, "j": true}') is used as is
+def parse_write_concern(value):
+    value = value.strip()
+    if value.startswith("{"):
+        return json.loads(value)
+    return {"w": int(value) if value.isdigit() else value}
+
+# ✅ Defaults < config file < environment
+def load_settings(config_path=None, environ=None):
+    environ = os.environ if environ is None else environ
+    settings = {**DEFAULTS, "collections": {name: dict(options) for name, options in DEFAULTS["collections"].items()}}
+
+    config_path = config_path or environ.get("MONGO_CONFIG", CONFIG_PATH)
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            config = json.load(f)
+        for name, options in config.pop("collections", {}).items():
+            settings["collections"].setdefault(name, {}).update(options)
+        unknown = set(config) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown MongoDB settings in {config_path}: {sorted(unknown)}")
+        settings.update(config)
+
+    for variable, (key, cast) in ENVIRONMENT.items():
+        if environ.get(variable):
+            settings[key] = cast(environ[variable])
+    for variable, value in environ.items():
+        if variable.startswith(WRITE_CONCERN_PREFIX) and value:
+            name = variable[len(WRITE_CONCERN_PREFIX):].lower()
+            settings["collections"].setdefault(name, {})["write_concern"] = parse_write_concern(value)
+
+    if settings["read_preference"] not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference: {settings['read_preference']}")
+    return settings
+
+# ✅ Client keyword arguments (unset timeouts are left to the driver defaults)
+def client_options(settings):
+    options = {
+        "maxPoolSize": settings["max_pool_size"],
+        "minPoolSize": settings["min_pool_size"],
+        "maxIdleTimeMS": settings["max_idle_time_ms"],
+        "waitQueueTimeoutMS": settings["wait_queue_timeout_ms"],
+        "connectTimeoutMS": settings["connect_timeout_ms"],
+        "serverSelectionTimeoutMS": settings["server_selection_timeout_ms"],
+        "socketTimeoutMS": settings["socket_timeout_ms"],
+        "readPreference": settings["read_preference"],
+    }
+    return {key: value for key, value in options.items() if value is not None}
+
+# ✅ New client from the settings; extra keyword arguments (e.g. event_listeners) are
+# passed to the driver. The caller owns it and closes it.
+def create_client(settings=None, asynchronous=False, **extra):
+    settings = settings or load_settings()
+    client_class = AsyncMongoClient if asynchronous else MongoClient
+    return client_class(settings["uri"], **client_options(settings), **extra)
+
+# ✅ Settings for a command-line tool: an explicit --uri overrides the configured URI,
+# everything else (pool, timeouts, read preference, write concerns) comes from load_settings()
+def cli_settings(uri=None):
+    settings = load_settings()
+    if uri:
+        settings["uri"] = uri
+    return settings
+
+# ✅ Collection from a (sync or async) database with its configured write concern
+# and read preference
+def configure_collection(db, name, settings=None):
+    settings = settings or load_settings()
+    options = settings["collections"].get(name, {})
+    kwargs = {}
+    if "write_concern" in options:
+        kwargs["write_concern"] = WriteConcern(**options["write_concern"])
+    if "read_preference" in options:
+        kwargs["read_preference"] = READ_PREFERENCES[options["read_preference"]]
+    return db.get_collection(name, **kwargs)
+
+_client = None
+_settings = None
+_lock = threading.Lock()
+
+# ✅ Process-wide client for scripts, created on first use
+def get_client():
+    global _client, _settings
+    with _lock:
+        if _client is None:
+            _settings = load_settings()
+            _client = create_client(_settings)
+        return _client
+
+def get_database():
+    client = get_client()
+    return client[_settings["database"]]
+
+def get_collection(name):
+    return configure_collection(get_database(), name, _settings)
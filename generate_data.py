@@ -0,0 +1,169 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+# Seeded synthetic user data with the schema and value distributions of the sample CSV.
+# Every random draw is a hash of (seed, row or person, field), so a run is reproducible
+# chunk by chunk and 50M rows never need more than one chunk in memory.
+# Identity collisions are generated on purpose:
+#   email repeat  -> an earlier person's email with a new cookie (email merge + "cohort")
+#   cookie repeat -> an earlier person's cookie and email again (cookie-match update)
+COLUMNS = ["cookie", "email", "phone_number", "country", "state", "city", "age",
+           "gender", "income", "education", "interests", "created_at"]
+CATEGORICAL = ["gender", "income", "education"]
+
+# Field numbers mixed into the hash of each draw
+(F_KIND, F_EARLIER, F_LOCATION, F_AGE, F_AGE_NULL, F_PHONE, F_PHONE_NULL, F_CREATED,
+ F_INTEREST_COUNT, F_FIRST, F_LAST, F_DOMAIN, F_COOKIE, F_COOKIE_HIGH) = range(14)
+F_CATEGORICAL = 20   # + position in CATEGORICAL
+F_KEYWORD = 40       # + keyword position
+
+# ✅ Empirical distributions of a sample frame (value lists and probabilities)
+def fit_profile(df):
+    def distribution(values):
+        counts = values.value_counts(dropna=False, normalize=True)
+        return [None if pd.isna(value) else value for value in counts.index], counts.to_numpy()
+
+    locations = df[["country", "state", "city"]].astype(object).where(df[["country", "state", "city"]].notna(), None)
+    location_counts = locations.value_counts(dropna=False, normalize=True)
+
+    local_parts = df["email"].str.split("@").str[0].str.replace(r"\d+$", "", regex=True).str.split(".")
+    interests = df["interests"].dropna().str.split("|")
+    keyword_counts = interests.explode().str.strip().value_counts(normalize=True)
+    email_seen = df["email"].duplicated()
+    pair_seen = df.duplicated(["cookie", "email"])
+
+    return {
+        "locations": (list(location_counts.index), location_counts.to_numpy()),
+        "categorical": {column: distribution(df[column]) for column in CATEGORICAL},
+        "ages": df["age"].dropna().to_numpy(dtype=float),
+        "age_null_rate": df["age"].isna().mean(),
+        "phone_null_rate": df["phone_number"].isna().mean(),
+        "created_at": df["created_at"].dropna().to_numpy(dtype=object),
+        "first_names": sorted(local_parts.str[0].dropna().unique()),
+        "last_names": sorted(local_parts.str[-1].dropna().unique()),
+        "domains": distribution(df["email"].str.split("@").str[1]),
+        "keywords": (list(keyword_counts.index), keyword_counts.to_numpy()),
+        "interest_counts": distribution(interests.map(len).reindex(df.index)),
+        "email_repeat_rate": float((email_seen & ~pair_seen).mean()),
+        "cookie_repeat_rate": float(pair_seen.mean()),
+    }
+
+# ✅ Deterministic 64-bit hash of (seed, id, field) for a whole array (splitmix64)
+def _hash(seed, ids, field):
+    with np.errstate(over="ignore"):
+        x = ids.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15) + np.uint64((seed * 1_000_003 + field * 7919) & (2**64 - 1))
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+# ✅ Uniform floats in [0, 1) from the hash
+def _uniform(seed, ids, field):
+    return (_hash(seed, ids, field) >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+# ✅ Inverse-CDF draw from a (values, probabilities) distribution
+def _pick(values, probabilities, u):
+    positions = np.searchsorted(np.cumsum(probabilities), u * probabilities.sum(), side="right")
+    choices = np.empty(len(values), dtype=object)  # Filled one by one: values may be tuples
+    for position, value in enumerate(values):
+        choices[position] = value
+    return choices[np.minimum(positions, len(values) - 1)]
+
+def _cookies(seed, ids, field):
+    low, high = _hash(seed, ids, field), _hash(seed, ids, F_COOKIE_HIGH + field)
+    return [f"{h >> 32:08x}-{(h >> 16) & 0xFFFF:04x}-4{h & 0xFFF:03x}-{8 | (l >> 62):x}{(l >> 48) & 0xFFF:03x}-{l & 0xFFFFFFFFFFFF:012x}"
+            for h, l in zip(high.tolist(), low.tolist())]
+
+# ✅ Rows [start, start + count): identities first, then row attributes
+def _generate_chunk(profile, seed, start, count, persons_before, email_repeat_rate, cookie_repeat_rate):
+    rows = np.arange(start, start + count, dtype=np.uint64)
+    kind = _uniform(seed, rows, F_KIND)
+    is_new = kind >= email_repeat_rate + cookie_repeat_rate
+    if start == 0:
+        is_new[0] = True  # Nobody to collide with yet
+
+    # Persons are numbered in order of their first row; repeats pick an earlier one
+    persons_so_far = persons_before + np.cumsum(is_new)
+    earlier = np.floor(_uniform(seed, rows, F_EARLIER) * np.maximum(persons_so_far - is_new, 1)).astype(np.int64)
+    person = np.where(is_new, persons_so_far - 1, earlier).astype(np.uint64)
+    email_repeat = ~is_new & (kind < email_repeat_rate)
+
+    primary_cookies = _cookies(seed, person, F_COOKIE)
+    new_cookies = _cookies(seed, rows, F_COOKIE + 100)
+    cookies = [new if repeat else primary for primary, new, repeat in zip(primary_cookies, new_cookies, email_repeat)]
+
+    first = _pick(profile["first_names"], np.ones(len(profile["first_names"])), _uniform(seed, person, F_FIRST))
+    last = _pick(profile["last_names"], np.ones(len(profile["last_names"])), _uniform(seed, person, F_LAST))
+    domains = _pick(*profile["domains"], _uniform(seed, person, F_DOMAIN))
+    emails = [f"{f}.{l}{p}@{d}" for f, l, p, d in zip(first, last, person.tolist(), domains)]
+
+    locations = _pick(*profile["locations"], _uniform(seed, rows, F_LOCATION))
+    ages = profile["ages"][np.floor(_uniform(seed, rows, F_AGE) * len(profile["ages"])).astype(np.int64)]
+    ages[_uniform(seed, rows, F_AGE_NULL) < profile["age_null_rate"]] = np.nan
+    phones = 1e10 + np.floor(_uniform(seed, rows, F_PHONE) * 9e9)
+    phones[_uniform(seed, rows, F_PHONE_NULL) < profile["phone_null_rate"]] = np.nan
+    created = profile["created_at"][np.floor(_uniform(seed, rows, F_CREATED) * len(profile["created_at"])).astype(np.int64)]
+
+    frame = pd.DataFrame({
+        "cookie": cookies,
+        "email": emails,
+        "phone_number": phones,
+        "country": [location[0] for location in locations],
+        "state": [location[1] for location in locations],
+        "city": [location[2] for location in locations],
+        "age": ages,
+    })
+    for position, column in enumerate(CATEGORICAL):
+        frame[column] = _pick(*profile["categorical"][column], _uniform(seed, rows, F_CATEGORICAL + position))
+    frame["interests"] = _interests(profile, seed, rows)
+    frame["created_at"] = created
+    return frame[COLUMNS], int(persons_so_far[-1])
+
+# ✅ "A|B|C" interest strings: how many from the sample's counts, which ones by
+# weighted sampling without replacement (Gumbel top-k over the keyword frequencies)
+def _interests(profile, seed, rows):
+    keywords, weights = profile["keywords"]
+    counts = _pick(*profile["interest_counts"], _uniform(seed, rows, F_INTEREST_COUNT))
+    gumbel = np.column_stack([
+        np.log(weights[position]) - np.log(-np.log(np.maximum(_uniform(seed, rows, F_KEYWORD + position), 1e-300)))
+        for position in range(len(keywords))
+    ])
+    order = np.argsort(-gumbel, axis=1)
+    keywords = np.asarray(keywords, dtype=object)
+    return [None if count is None else "|".join(keywords[order[row, :int(count)]])
+            for row, count in enumerate(counts)]
+
+# ✅ Yield DataFrames of `chunk_size` rows until `rows` rows were generated
+def generate_frames(profile, rows, seed=42, chunk_size=100_000, email_repeat_rate=None, cookie_repeat_rate=None):
+    email_repeat_rate = profile["email_repeat_rate"] if email_repeat_rate is None else email_repeat_rate
+    cookie_repeat_rate = profile["cookie_repeat_rate"] if cookie_repeat_rate is None else cookie_repeat_rate
+    persons = 0
+    for start in range(0, rows, chunk_size):
+        frame, persons = _generate_chunk(
+            profile, seed, start, min(chunk_size, rows - start), persons, email_repeat_rate, cookie_repeat_rate
+        )
+        yield frame
+
+# ✅ Stream generated rows to a CSV with the sample's columns
+def write_csv(profile, path, rows, seed=42, chunk_size=100_000, **rates):
+    written = 0
+    for index, frame in enumerate(generate_frames(profile, rows, seed, chunk_size, **rates)):
+        frame.to_csv(path, mode="w" if index == 0 else "a", header=index == 0, index=False)
+        written += len(frame)
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic user data shaped like the sample CSV")
+    parser.add_argument("--sample", default="sample_user_data.csv")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--output", default="synthetic_user_data.csv")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--email-repeat-rate", type=float, help="Rows reusing an earlier email with a new cookie (default: sample rate)")
+    parser.add_argument("--cookie-repeat-rate", type=float, help="Rows repeating an earlier cookie and email (default: sample rate)")
+    args = parser.parse_args()
+
+    profile = fit_profile(pd.read_csv(args.sample))
+    written = write_csv(profile, args.output, args.rows, args.seed, args.chunk_size,
+                        email_repeat_rate=args.email_repeat_rate, cookie_repeat_rate=args.cookie_repeat_rate)
+    print(f"✅ Wrote {written} rows to {args.output}")
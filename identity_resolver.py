@@ -0,0 +1,340 @@
+import os
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from cache import VERSIONS_COLLECTION, bump_write_version, bump_write_version_async
+from segments import SEGMENTS_COLLECTION, apply_size_delta, profile_segments, segment_delta, size_ops
+
+# Merge outcomes (same rules as the row-by-row path)
+UPDATED = "updated"
+EMAIL_MERGED = "email_merged"
+INSERTED = "inserted"
+# Cookie match whose new email already belongs to another profile (rejected by the unique email index)
+CONFLICT = "conflict"
+# Profile write rejected by MongoDB for another reason (e.g. document validation)
+FAILED = "failed"
+
+DUPLICATE_KEY = 11000
+# Resolve-and-write rounds per batch: a round fails only for the profiles a concurrent
+# ingest changed (or inserted) since they were read, and their records are resolved again
+MERGE_ATTEMPTS = 3
+
+# Merge events kept per "cohort" document (0 keeps no history)
+COHORT_HISTORY_LIMIT = int(os.environ.get("COHORT_HISTORY_LIMIT", "10"))
+
+# ✅ Upsert of the single "cohort" document of a merged identity, keyed by the "unique"
+# profile _id: current merged profile, merge count and the last merges (cookie + time).
+# Returns (filter, update) for update_one / find_one_and_update / UpdateOne with upsert=True.
+def cohort_update(profile_id, merged_data, merged_at, history_limit=COHORT_HISTORY_LIMIT):
+    update = {"$set": {"data": merged_data, "updated_at": merged_at}, "$inc": {"merges": 1}}
+    if history_limit:
+        entry = {"cookie": merged_data.get("cookie"), "merged_at": merged_at}
+        update["$push"] = {"history": {"$each": [entry], "$slice": -history_limit}}
+    return {"_id": profile_id}, update
+
+# ✅ Filter for the atomic merge: with unique cookie/email indexes at most one profile
+# matches, otherwise the merge would duplicate a key and is rejected as a conflict
+def merge_filter(data):
+    return {"$or": [{"data.cookie": data["cookie"]}, {"data.email": data["email"]}]}
+
+# ✅ Pipeline update applying the merge rules server-side in one round trip:
+# cookie match -> merge; email match -> merge and keep the stored created_at; no match -> upsert
+def merge_pipeline(data, keep_created_at_on_email_merge=True):
+    keep_created_at = {}
+    if keep_created_at_on_email_merge:
+        is_email_merge = {"$and": [
+            {"$ne": ["$data.cookie", {"$literal": data["cookie"]}]},
+            {"$eq": ["$data.email", {"$literal": data["email"]}]},
+        ]}
+        stored_created_at = {"$cond": [
+            {"$eq": [{"$type": "$data.created_at"}, "missing"]},
+            {"$literal": data.get("created_at")},
+            "$data.created_at",
+        ]}
+        keep_created_at = {"$cond": [is_email_merge, {"created_at": stored_created_at}, {}]}
+
+    # $literal keeps user values starting with "$" from being read as field paths
+    merged = {"$mergeObjects": [{"$ifNull": ["$data", {}]}, {"$literal": data}, keep_created_at]}
+    return [{"$set": {
+        "data": merged,
+        # Snapshot export watermark, kept when the payload changes nothing (re-ingest)
+        "updated_at": {"$cond": [{"$eq": [merged, "$data"]}, {"$ifNull": ["$updated_at", "$$NOW"]}, "$$NOW"]},
+    }}]
+
+# ✅ Outcome of an atomic merge from the pre-image, plus the merged profile for "cohort"
+def classify_merge(before, data, keep_created_at_on_email_merge=True):
+    if before is None:
+        return INSERTED, data
+
+    existing_data = before["data"]
+    merged_data = {**existing_data, **data}
+    if existing_data.get("cookie") == data["cookie"]:
+        return UPDATED, merged_data
+
+    if keep_created_at_on_email_merge:
+        merged_data["created_at"] = existing_data.get("created_at", data.get("created_at"))
+    return EMAIL_MERGED, merged_data
+
+# ✅ Track / untrack a document in the in-memory key maps
+def _track(doc, by_cookie, by_email):
+    data = doc["data"]
+    by_cookie.setdefault(data.get("cookie"), set()).add(doc["_id"])
+    by_email.setdefault(data.get("email"), set()).add(doc["_id"])
+
+def _untrack(doc, by_cookie, by_email):
+    data = doc["data"]
+    by_cookie.get(data.get("cookie"), set()).discard(doc["_id"])
+    by_email.get(data.get("email"), set()).discard(doc["_id"])
+
+# ✅ Same document find_one() would return: first match in insertion (_id) order
+def _first(index, key):
+    ids = index.get(key)
+    return min(ids) if ids else None
+
+# ✅ Filter matching every "unique" document a batch of records can touch
+def candidate_filter(records):
+    cookies = list({record["data"]["cookie"] for record in records})
+    emails = list({record["data"]["email"] for record in records})
+    return {"$or": [
+        {"data.cookie": {"$in": cookies}},
+        {"data.email": {"$in": emails}},
+    ]}
+
+# ✅ Resolve a batch of formatted records against "unique" entirely in memory
+def resolve_identities(unique_collection, records, keep_created_at_on_email_merge=False):
+    # One $in round trip loads every document any record in the batch can touch.
+    candidates = unique_collection.find(candidate_filter(records)) if records else []
+    return resolve_against(candidates, records, keep_created_at_on_email_merge)
+
+# ✅ A batch resolved in memory: one guarded write per touched "unique" profile, the
+# "cohort" upserts, and per record its outcome and the profile it was merged into.
+# cohort_ops, updated_ids and changes are filled by settle() once the "unique" write is
+# known, so they only cover the profiles whose write went through.
+class Resolution:
+    def __init__(self):
+        self.outcomes = []    # Per record
+        self.targets = []     # Per record: _id of its profile (None for a conflict found in memory)
+        self.unique_ops = []  # One write per touched profile...
+        self.op_ids = []      # ...and the _id it writes
+        self.cohort_ops = []
+        self.updated_ids = []
+        self.changes = []     # (before, after) profile data
+        self._cohort = []     # (_id, cohort upsert) per email merge
+        self._written = []    # (_id, before, after, is_new) per touched profile
+
+    def add(self, outcome, doc_id):
+        self.outcomes.append(outcome)
+        self.targets.append(doc_id)
+
+    # ✅ Apply the write errors of the "unique" bulk write ({op index: error code}) and
+    # return the positions of the records to resolve again: a duplicate key means the
+    # profile changed or was inserted by a concurrent ingest since it was read (on the
+    # last round these become conflicts); other errors fail the profile's records
+    def settle(self, failures, last_round=False):
+        failed = {self.op_ids[index]: code for index, code in failures.items()}
+        retry = []
+        for position, doc_id in enumerate(self.targets):
+            if doc_id not in failed:
+                continue
+            if failed[doc_id] != DUPLICATE_KEY:
+                self.outcomes[position] = FAILED
+            elif last_round:
+                self.outcomes[position] = CONFLICT
+            else:
+                retry.append(position)
+
+        self.cohort_ops = [op for doc_id, op in self._cohort if doc_id not in failed]
+        for doc_id, before, after, is_new in self._written:
+            if doc_id not in failed:
+                self.changes.append((before, after))
+                if not is_new:
+                    self.updated_ids.append(doc_id)
+        return retry
+
+# ✅ {op index: error code} of a failed bulk write (write concern errors are not
+# listed: those writes were applied on the primary)
+def failed_writes(exc):
+    return {error["index"]: error["code"] for error in exc.details.get("writeErrors", [])}
+
+# ✅ Pure in-memory resolution against already loaded candidate documents.
+# Rows only ever modify loaded documents, so merges between rows of the same
+# batch are resolved against this working set as well.
+def resolve_against(candidates, records, keep_created_at_on_email_merge=False):
+    docs, by_cookie, by_email = {}, {}, {}
+    for doc in candidates:
+        docs[doc["_id"]] = doc
+        _track(doc, by_cookie, by_email)
+
+    resolution = Resolution()
+    touched = {}  # _id -> is_new, in first-touch order
+    original_data = {}  # _id -> profile data before this batch (None for new profiles)
+    updated_at = datetime.now(timezone.utc)
+
+    for record in records:
+        data = record["data"]
+
+        doc_id = _first(by_cookie, data["cookie"])
+        if doc_id is not None:
+            if by_email.get(data["email"], set()) - {doc_id}:
+                resolution.add(CONFLICT, None)  # Would duplicate an email owned by another profile
+                continue
+
+            # ✅ Cookie match: merge new fields over the stored profile
+            merged_data = {**docs[doc_id]["data"], **data}
+            outcome = UPDATED
+        else:
+            doc_id = _first(by_email, data["email"])
+            if doc_id is not None:
+                # ✅ Email match: merge, keep latest cookie and update the identity's "cohort" document
+                existing_data = docs[doc_id]["data"]
+                merged_data = {**existing_data, **data}
+                if keep_created_at_on_email_merge:
+                    merged_data["created_at"] = existing_data.get("created_at", data.get("created_at"))
+                resolution._cohort.append((doc_id, UpdateOne(*cohort_update(doc_id, merged_data, updated_at), upsert=True)))
+                outcome = EMAIL_MERGED
+            else:
+                # ✅ New user: ObjectId assigned client-side so later rows can match it
+                doc_id = ObjectId()
+                doc = {"_id": doc_id, "data": data}
+                docs[doc_id] = doc
+                _track(doc, by_cookie, by_email)
+                touched[doc_id] = True
+                original_data[doc_id] = None
+                resolution.add(INSERTED, doc_id)
+                continue
+
+        doc = docs[doc_id]
+        original_data.setdefault(doc_id, doc["data"])
+        _untrack(doc, by_cookie, by_email)
+        doc["data"] = merged_data
+        _track(doc, by_cookie, by_email)
+        touched.setdefault(doc_id, False)
+        resolution.add(outcome, doc_id)
+
+    # ✅ Only the final state of each touched "unique" document is written, together
+    # with its materialized segments. Updates only match the data that was read: if a
+    # concurrent ingest changed the profile, the upsert collides on _id and the write
+    # fails as a duplicate key instead of overwriting it (as does a colliding insert).
+    # A profile that ends the batch as stored (re-ingested rows) is not written at all:
+    # its updated_at and its "cohort" document keep their values.
+    unchanged = set()
+    for doc_id, is_new in touched.items():
+        data = docs[doc_id]["data"]
+        segments = profile_segments(data)
+        if not is_new and data == original_data[doc_id] and docs[doc_id].get("segments") == segments:
+            unchanged.add(doc_id)
+            continue
+        fields = {"segments": segments, "updated_at": updated_at}
+        if is_new:
+            op = InsertOne({**docs[doc_id], **fields})
+        else:
+            op = UpdateOne({"_id": doc_id, "data": original_data[doc_id]}, {"$set": {"data": data, **fields}}, upsert=True)
+        resolution.unique_ops.append(op)
+        resolution.op_ids.append(doc_id)
+        resolution._written.append((doc_id, original_data[doc_id], data, is_new))
+
+    resolution._cohort = [(doc_id, op) for doc_id, op in resolution._cohort if doc_id not in unchanged]
+    return resolution
+
+# ✅ The I/O-free part of a batch write, shared by the sync and async drivers below:
+# each round resolves the pending records against the candidates the driver loaded,
+# then settles the "unique" write failures. Records of profiles changed concurrently
+# stay pending for the next round (up to MERGE_ATTEMPTS rounds).
+class IdentityBatch:
+    def __init__(self, records, keep_created_at_on_email_merge=False):
+        self.records = records
+        self.keep_created_at_on_email_merge = keep_created_at_on_email_merge
+        self.outcomes = [None] * len(records)
+        self.updated_ids = []
+        self.changes = []     # (before, after) data of every written profile
+        self.merged = False   # Whether any "cohort" upsert was produced
+        self.pending = list(range(len(records)))
+        self.attempt = 0
+        self.resolution = None
+
+    @property
+    def done(self):
+        return not self.pending or self.attempt == MERGE_ATTEMPTS
+
+    def pending_records(self):
+        return [self.records[position] for position in self.pending]
+
+    # ✅ Resolve the pending records against the loaded candidates -> Resolution
+    # (its unique_ops are for the driver to write)
+    def resolve(self, candidates):
+        self.resolution = resolve_against(candidates, self.pending_records(), self.keep_created_at_on_email_merge)
+        return self.resolution
+
+    # ✅ Record the round's outcomes from the failed "unique" writes ({op index: code})
+    # and return the "cohort" upserts of the profiles that were written
+    def settle(self, failures):
+        resolution = self.resolution
+        retry = resolution.settle(failures, last_round=self.attempt == MERGE_ATTEMPTS - 1)
+        for position, outcome in zip(self.pending, resolution.outcomes):
+            self.outcomes[position] = outcome
+        self.updated_ids += resolution.updated_ids
+        self.changes += resolution.changes
+        self.merged |= bool(resolution.cohort_ops)
+        self.pending = [self.pending[position] for position in retry]
+        self.attempt += 1
+        return resolution.cohort_ops
+
+    def result(self):
+        return self.outcomes, self.updated_ids, self.changes
+
+# ✅ Resolve and write one batch, returning the per-record outcomes, the _ids of
+# existing profiles that were modified (e.g. for cache invalidation) and the
+# (before, after) data of every written profile (e.g. for in-memory indexes).
+# Records of profiles changed concurrently are read and resolved again.
+# The shared "unique" / "cohort" write versions (cache.py) are bumped when the batch
+# wrote that collection; `versions`, when given, receives the bumped values.
+def apply_identity_batch(unique_collection, cohort_collection, records, keep_created_at_on_email_merge=False, versions=None):
+    batch = IdentityBatch(records, keep_created_at_on_email_merge)
+    while not batch.done:
+        resolution = batch.resolve(unique_collection.find(candidate_filter(batch.pending_records())))
+        failures = {}
+        if resolution.unique_ops:
+            try:
+                unique_collection.bulk_write(resolution.unique_ops, ordered=False)
+            except BulkWriteError as exc:
+                failures = failed_writes(exc)
+        cohort_ops = batch.settle(failures)
+        if cohort_ops:
+            cohort_collection.bulk_write(cohort_ops, ordered=True)
+
+    apply_size_delta(unique_collection.database[SEGMENTS_COLLECTION], segment_delta(batch.changes))
+    versions = {} if versions is None else versions
+    if batch.changes:
+        # Cached profiles of every API process are stale (cache.py)
+        versions["unique"] = bump_write_version(cohort_collection.database[VERSIONS_COLLECTION], "unique")
+    if batch.merged:
+        # Cached cohort results of every API process are stale (cache.py)
+        versions["cohort"] = bump_write_version(cohort_collection.database[VERSIONS_COLLECTION], "cohort")
+    return batch.result()
+
+# ✅ Same batch write for async (AsyncMongoClient) collections
+async def apply_identity_batch_async(unique_collection, cohort_collection, records, keep_created_at_on_email_merge=False, versions=None):
+    batch = IdentityBatch(records, keep_created_at_on_email_merge)
+    while not batch.done:
+        candidates = await unique_collection.find(candidate_filter(batch.pending_records())).to_list(None)
+        resolution = batch.resolve(candidates)
+        failures = {}
+        if resolution.unique_ops:
+            try:
+                await unique_collection.bulk_write(resolution.unique_ops, ordered=False)
+            except BulkWriteError as exc:
+                failures = failed_writes(exc)
+        cohort_ops = batch.settle(failures)
+        if cohort_ops:
+            await cohort_collection.bulk_write(cohort_ops, ordered=True)
+
+    segment_ops = size_ops(segment_delta(batch.changes))
+    if segment_ops:
+        await unique_collection.database[SEGMENTS_COLLECTION].bulk_write(segment_ops, ordered=False)
+    versions = {} if versions is None else versions
+    if batch.changes:
+        versions["unique"] = await bump_write_version_async(cohort_collection.database[VERSIONS_COLLECTION], "unique")
+    if batch.merged:
+        versions["cohort"] = await bump_write_version_async(cohort_collection.database[VERSIONS_COLLECTION], "cohort")
+    return batch.result()
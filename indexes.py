@@ -0,0 +1,168 @@
+import argparse
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+from connection import cli_settings, create_client
+
+AGE = "data.demographics.age"
+
+# ✅ Declared indexes per collection: (keys, options)
+# "unique": one profile per cookie and per email (backs the atomic merge in /api/ingest);
+#           updated_at drives the incremental snapshot export.
+# "users":  unique content hash of each raw event (sparse: events stored before
+#           hashing have none until raw_events.py backfills them).
+# "cohort": every filter of get_cohort_users leads an index, with age as the trailing
+#           range key (equality first, range last); data.interests is multikey.
+#           Keyset pages sort by _id, so each equality filter also leads an index with _id
+#           as the trailing key: a page walks the segment in _id order and stops after
+#           limit + 1 documents instead of sorting the whole segment in memory.
+INDEXES = {
+    "users": [
+        ([("hash", ASCENDING)], {"unique": True, "sparse": True}),
+    ],
+    "unique": [
+        ([("data.cookie", ASCENDING)], {"unique": True}),
+        ([("data.email", ASCENDING)], {"unique": True}),
+        ([("updated_at", ASCENDING)], {}),
+    ],
+    "cohort": [
+        ([("data.cookie", ASCENDING)], {}),
+        ([("data.email", ASCENDING)], {}),
+        ([("data.location.country", ASCENDING), (AGE, ASCENDING)], {}),
+        ([("data.demographics.gender", ASCENDING), (AGE, ASCENDING)], {}),
+        ([("data.demographics.income", ASCENDING), (AGE, ASCENDING)], {}),
+        ([("data.demographics.education", ASCENDING), (AGE, ASCENDING)], {}),
+        ([("data.interests", ASCENDING), (AGE, ASCENDING)], {}),
+        ([(AGE, ASCENDING)], {}),
+        ([("data.location.country", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("data.demographics.gender", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("data.demographics.income", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("data.demographics.education", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("data.interests", ASCENDING), ("_id", ASCENDING)], {}),
+    ],
+}
+
+# ✅ Create every declared index (idempotent); returns the specs that failed
+def ensure_indexes(db):
+    failed = []
+    for collection_name, specs in INDEXES.items():
+        for keys, options in specs:
+            try:
+                db[collection_name].create_index(keys, **options)
+            except OperationFailure as exc:
+                print(f"⚠️ Could not create index {keys} on '{collection_name}' (existing duplicates?): {exc}")
+                failed.append((collection_name, keys))
+    return failed
+
+# ✅ Async variant for server_async (same specs, awaited driver calls)
+async def ensure_indexes_async(db):
+    failed = []
+    for collection_name, specs in INDEXES.items():
+        for keys, options in specs:
+            try:
+                await db[collection_name].create_index(keys, **options)
+            except OperationFailure as exc:
+                print(f"⚠️ Could not create index {keys} on '{collection_name}' (existing duplicates?): {exc}")
+                failed.append((collection_name, keys))
+    return failed
+
+# Keyset page filters of /api/cohort/user (find(filter).sort("_id").limit(n)): each must be
+# read in _id order from an index, without a blocking SORT stage
+PAGE_FILTERS = [
+    {},
+    {"country": "USA"},
+    {"country": "USA", "age_min": 20, "age_max": 30},
+    {"gender": "Female"},
+    {"income": "$50,000-$74,999"},
+    {"education": "Bachelor's Degree"},
+    {"interests": ["Tech", "Gaming"]},
+    {"country": "USA", "gender": "Male", "interests": ["Tech"]},
+]
+
+# ✅ Keyset page queries: (label, collection, filter) sorted by _id
+def page_queries():
+    from api_common import build_cohort_query
+
+    return [
+        ("/api/cohort/user?" + "&".join(sorted(params) + ["limit"]), "cohort", build_cohort_query(**params))
+        for params in PAGE_FILTERS
+    ]
+
+# ✅ Representative filters issued by the API endpoints: (label, collection, filter)
+def endpoint_queries():
+    from api_common import build_cohort_query
+    from identity_resolver import merge_filter
+
+    sample = {"cookie": "sample-cookie", "email": "sample@example.com"}
+    cohort_filters = [
+        {"cookie": sample["cookie"]},
+        {"email": sample["email"]},
+        {"country": "USA"},
+        {"country": "USA", "age_min": 20, "age_max": 30},
+        {"age_min": 20, "age_max": 30},
+        {"gender": "Female"},
+        {"income": "$50,000-$74,999"},
+        {"education": "Bachelor's Degree"},
+        {"interests": ["Tech", "Gaming"]},
+        {"interests": ["Tech"], "age_min": 20},
+        {"country": "USA", "gender": "Male", "interests": ["Tech"]},
+    ]
+
+    queries = [
+        ("/api/user?email", "unique", {"data.email": sample["email"]}),
+        ("/api/user?cookie", "unique", {"data.cookie": sample["cookie"]}),
+        ("/api/ingest merge", "unique", merge_filter(sample)),
+    ]
+    for params in cohort_filters:
+        label = "/api/cohort/user?" + "&".join(sorted(params))
+        queries.append((label, "cohort", build_cohort_query(**params)))
+    return queries
+
+# ✅ True when any stage of a winning plan is `stage` (e.g. a full collection scan)
+def _has_stage(plan, stage):
+    if isinstance(plan, dict):
+        if plan.get("stage") == stage:
+            return True
+        return any(_has_stage(value, stage) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_has_stage(value, stage) for value in plan)
+    return False
+
+def _winning_plan(explain):
+    return explain.get("queryPlanner", {}).get("winningPlan", {})
+
+# ✅ explain() every endpoint query and report the ones still falling back to COLLSCAN,
+# and the keyset page queries that sort in memory (blocking SORT stage)
+def check_query_plans(db, page_size=1000):
+    problems = []
+    for label, collection_name, query in endpoint_queries():
+        if _has_stage(_winning_plan(db[collection_name].find(query).explain()), "COLLSCAN"):
+            problems.append((label, query))
+            print(f"❌ COLLSCAN: {label} -> {query}")
+        else:
+            print(f"✅ Indexed: {label}")
+
+    for label, collection_name, query in page_queries():
+        plan = _winning_plan(db[collection_name].find(query).sort("_id", ASCENDING).limit(page_size + 1).explain())
+        if _has_stage(plan, "SORT"):
+            problems.append((label, query))
+            print(f"❌ In-memory SORT: {label} -> {query}")
+        elif _has_stage(plan, "COLLSCAN"):
+            problems.append((label, query))
+            print(f"❌ COLLSCAN: {label} -> {query}")
+        else:
+            print(f"✅ Indexed, _id order: {label}")
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create indexes and check endpoint query plans")
+    parser.add_argument("--uri", help="Overrides MONGO_URI / the configured URI (connection.py)")
+    parser.add_argument("--check", action="store_true", help="Only report query plans, do not create indexes")
+    args = parser.parse_args()
+
+    settings = cli_settings(args.uri)
+    db = create_client(settings)[settings["database"]]
+    if not args.check:
+        ensure_indexes(db)
+        print("✅ Indexes ensured")
+    if check_query_plans(db):
+        raise SystemExit(1)
@@ -0,0 +1,266 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pymongo import monitoring
+
+# In-process metrics in the Prometheus text format (no client library needed).
+# Recording is a bisect plus a few additions under a lock, so it stays on in production;
+# gauges are callbacks evaluated only when /api/metrics is scraped.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, _format_labels(self.labelnames, labels), value) for labels, value in sorted(values.items())]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help, labelnames, buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if position < len(self.buckets):
+                series[position] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    # ✅ Time the enclosed block into this histogram
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        samples = []
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", _format_labels(self.labelnames, labels, [f'le="{bound}"']), cumulative))
+            samples.append((f"{self.name}_bucket", _format_labels(self.labelnames, labels, ['le="+Inf"']), values[-1]))
+            samples.append((f"{self.name}_sum", _format_labels(self.labelnames, labels), values[-2]))
+            samples.append((f"{self.name}_count", _format_labels(self.labelnames, labels), values[-1]))
+        return samples
+
+# ✅ Value(s) read at scrape time: `read()` returns a number or {label tuple: number}
+# (kind="counter" for totals another component already keeps, e.g. cache hits)
+class Gauge:
+    def __init__(self, name, help, read, labelnames=(), kind="gauge"):
+        self.name, self.help, self.labelnames, self.read, self.kind = name, help, labelnames, read, kind
+
+    def samples(self):
+        value = self.read()
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            return [(self.name, "", value)]
+        return [(self.name, _format_labels(self.labelnames, labels), number) for labels, number in sorted(value.items())]
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    # ✅ Prometheus text exposition of every registered metric
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+# ✅ Per-command timing from the driver's command monitoring (collection from the
+# started event, duration from the succeeded / failed event)
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self, registry):
+        self.duration = registry.register(Histogram(
+            "mongo_command_duration_seconds", "MongoDB command round trip time", ("command", "collection")
+        ))
+        self.failures = registry.register(Counter(
+            "mongo_command_failures_total", "MongoDB commands that returned an error", ("command", "collection")
+        ))
+        self._collections = {}  # (connection, request_id) -> collection of a running command
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        self.duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        self.duration.observe(event.duration_micros / 1e6, event.command_name, collection)
+        self.failures.inc(event.command_name, collection)
+
+# ✅ Connection pool gauges (open / checked-out connections) and check-out wait times
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self, registry):
+        self._lock = threading.Lock()
+        self._open = {}         # address -> open connections
+        self._checked_out = {}  # address -> connections in use
+        self.wait = registry.register(Histogram(
+            "mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection"
+        ))
+        self.check_out_failures = registry.register(Counter(
+            "mongo_pool_checkout_failures_total", "Connection check-outs that failed or timed out", ("reason",)
+        ))
+        registry.register(Gauge("mongo_pool_open_connections", "Open connections per server",
+                                lambda: self._by_address(self._open), ("address",)))
+        registry.register(Gauge("mongo_pool_checked_out_connections", "Connections in use per server",
+                                lambda: self._by_address(self._checked_out), ("address",)))
+
+    def _by_address(self, counts):
+        with self._lock:
+            return {(f"{host}:{port}",): count for (host, port), count in counts.items()}
+
+    def _add(self, counts, address, delta):
+        with self._lock:
+            counts[address] = counts.get(address, 0) + delta
+
+    def connection_created(self, event):
+        self._add(self._open, event.address, 1)
+
+    def connection_closed(self, event):
+        self._add(self._open, event.address, -1)
+
+    def connection_checked_out(self, event):
+        self._add(self._checked_out, event.address, 1)
+        self.wait.observe(event.duration)
+
+    def connection_checked_in(self, event):
+        self._add(self._checked_out, event.address, -1)
+
+    def connection_check_out_failed(self, event):
+        self.check_out_failures.inc(str(event.reason))
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+# ✅ ASGI middleware: request latency per route template, method and status code
+class MetricsMiddleware:
+    def __init__(self, app, histogram):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"  # Templates keep cardinality bounded
+            self.histogram.observe(time.perf_counter() - start, scope["method"], path, str(status[0]))
+
+# ✅ The metrics one API process exposes on /api/metrics: pass `listeners` to the
+# MongoClient, wrap the app in MetricsMiddleware(app, requests) and count ingest outcomes
+class ServiceMetrics:
+    def __init__(self):
+        self.registry = Registry()
+        self.requests = self.registry.register(Histogram(
+            "http_request_duration_seconds", "HTTP request latency by route", ("method", "path", "status")
+        ))
+        self.ingest_outcomes = self.registry.register(Counter(
+            "ingest_outcomes_total", "Ingested records by merge outcome", ("outcome",)
+        ))
+        self.ingest_stages = self.registry.register(Histogram(
+            "ingest_stage_duration_seconds", "Time spent in each ingest step", ("stage",)
+        ))
+        self.commands = CommandMetrics(self.registry)
+        self.pool = PoolMetrics(self.registry)
+        self.listeners = [self.commands, self.pool]
+
+    def count_outcomes(self, outcomes):
+        for outcome in outcomes:
+            self.ingest_outcomes.inc(outcome)
+
+    # ✅ Gauges over in-process state, read from each component's stats() when scraped
+    def watch_state(self, user_cache, cohort_cache, raw_events, write_behind=None):
+        def caches():
+            user, cohort = user_cache.stats(), cohort_cache.stats()
+            return {"entries": {("user",): user["size"], ("cohort",): cohort["entries"]},
+                    "hits": {("user",): user["hits"], ("cohort",): cohort["hits"]},
+                    "misses": {("user",): user["misses"], ("cohort",): cohort["misses"]}}
+
+        register = self.registry.register
+        register(Gauge("cache_entries", "Entries held per response cache",
+                       lambda: caches()["entries"], ("cache",)))
+        register(Gauge("cache_hits_total", "Response cache hits", lambda: caches()["hits"], ("cache",), "counter"))
+        register(Gauge("cache_misses_total", "Response cache misses", lambda: caches()["misses"], ("cache",), "counter"))
+        register(Gauge("cohort_cache_bytes", "Bytes held by the cohort result cache", lambda: cohort_cache.stats()["bytes"]))
+        register(Gauge("raw_events_total", "Raw events by deduplication result",
+                       lambda: {("inserted",): raw_events.inserted, ("dropped",): raw_events.dropped},
+                       ("result",), "counter"))
+        register(Gauge("raw_event_lookups_total", "Raw events checked against MongoDB instead of the Bloom filter",
+                       lambda: raw_events.lookups, kind="counter"))
+        if write_behind is not None:
+            register(Gauge("ingest_queue_pending", "Payloads logged but not yet applied",
+                           lambda: write_behind.stats()["pending"]))
+            register(Gauge("ingest_queue_rejected_total", "Payloads rejected because the queue was full",
+                           lambda: write_behind.stats()["rejected"], kind="counter"))
+
+    def render(self):
+        return self.registry.render()
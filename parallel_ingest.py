@@ -0,0 +1,289 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import pickle
+import queue
+import shutil
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+import pandas as pd
+from connection import get_collection, get_database
+from identity_resolver import apply_identity_batch, UPDATED, EMAIL_MERGED, INSERTED, CONFLICT, FAILED
+from indexes import ensure_indexes
+from raw_events import RawEventStore
+from transform import transform_frame, report_invalid_dates
+
+# Parallel ingest of many CSV files into "users", "unique" and "cohort" (settings from
+# connection.py). Three checkpointed phases in a work directory:
+#   parse     -> a process pool parses the files chunk by chunk and spills the records
+#   partition -> cookies and emails are joined into identity groups (rows sharing a key,
+#                plus the stored profiles those keys match); groups are hash-partitioned
+#   ingest    -> one worker per partition applies its rows in file order, so no two
+#                workers ever read or write the same profile
+# After a failure, run the same command again to continue from the last finished chunk
+# of every partition (rows of an interrupted chunk are applied again, which repeats
+# their merges but inserts no duplicate profiles or raw events).
+MANIFEST = "manifest.json"
+PARTITIONED = "partitioned.json"  # Written once every chunk's partition array exists
+
+# ✅ Expand file names and glob patterns (sorted, duplicates dropped, order kept)
+def expand_paths(patterns):
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            raise SystemExit(f"❌ No files match {pattern}")
+        paths.extend(os.path.abspath(path) for path in matches if os.path.abspath(path) not in paths)
+    return paths
+
+def _write_json(path, value):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+def _read_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def _spill_path(workdir, file_index, chunk_index):
+    return os.path.join(workdir, f"chunk-{file_index:05d}-{chunk_index:05d}.pkl")
+
+def _keys_path(workdir, file_index):
+    return os.path.join(workdir, f"keys-{file_index:05d}.pkl")
+
+# Partition of each unique record of a chunk (int32 array, same order as the spill)
+def _partition_path(workdir, file_index, chunk_index):
+    return os.path.join(workdir, f"partitions-{file_index:05d}-{chunk_index:05d}.npy")
+
+# ✅ Parse worker: transform one file chunk by chunk; records are spilled to disk and
+# only the (cookie, email) keys are kept for partitioning
+def parse_file(workdir, file_index, path, chunk_size):
+    done_path = os.path.join(workdir, f"parsed-{file_index:05d}.json")
+    if os.path.exists(done_path):
+        return _read_json(done_path)
+
+    start = time.perf_counter()
+    keys, rows, raw = [], 0, 0
+    for chunk_index, chunk in enumerate(pd.read_csv(path, chunksize=chunk_size)):
+        raw_records, unique_records, invalid_rows = transform_frame(chunk)
+        report_invalid_dates(invalid_rows)
+        with open(_spill_path(workdir, file_index, chunk_index), "wb") as f:
+            pickle.dump((raw_records, unique_records), f, protocol=pickle.HIGHEST_PROTOCOL)
+        keys.append([(record["data"]["cookie"], record["data"]["email"]) for record in unique_records])
+        rows += len(chunk)
+        raw += len(raw_records)
+
+    with open(_keys_path(workdir, file_index), "wb") as f:
+        pickle.dump(keys, f, protocol=pickle.HIGHEST_PROTOCOL)
+    summary = {"file": path, "chunks": len(keys), "rows": rows, "raw": raw,
+               "seconds": round(time.perf_counter() - start, 3)}
+    _write_json(done_path, summary)
+    return summary
+
+# ✅ Union-find over "c:<cookie>" / "e:<email>" keys
+class IdentityGroups:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, key):
+        parent = self.parent.setdefault(key, key)
+        while parent != key:
+            grandparent = self.parent[parent]
+            self.parent[key] = grandparent  # Path halving
+            key, parent = parent, grandparent
+        return key
+
+    def union(self, cookie, email):
+        first, second = self.find("c:" + cookie), self.find("e:" + email)
+        if first != second:
+            self.parent[second] = first
+
+# ✅ Join the stored profiles matching any key of the run (one $in query per batch of keys),
+# so two groups of the run never touch the same existing profile
+def link_stored_profiles(groups, unique_collection, batch_size=5000):
+    keys = list(groups.parent)
+    cookies = [key[2:] for key in keys if key.startswith("c:")]
+    emails = [key[2:] for key in keys if key.startswith("e:")]
+    for field, values in (("data.cookie", cookies), ("data.email", emails)):
+        for start in range(0, len(values), batch_size):
+            cursor = unique_collection.find({field: {"$in": values[start:start + batch_size]}},
+                                            {"_id": 0, "data.cookie": 1, "data.email": 1})
+            for doc in cursor:
+                data = doc.get("data", {})
+                if data.get("cookie") and data.get("email"):
+                    groups.union(data["cookie"], data["email"])
+
+# ✅ Partition of every unique record of a chunk: crc32 of its identity group root
+def assign_partitions(key_chunk, groups, partitions):
+    return np.fromiter((zlib.crc32(groups.find("c:" + cookie).encode()) % partitions for cookie, _ in key_chunk),
+                       dtype=np.int32, count=len(key_chunk))
+
+# ✅ Join the keys of every file (and the stored profiles they match) into identity groups,
+# then write one partition array per chunk, file by file, so neither this process nor a
+# worker ever holds the assignment of the whole run. Returns the number of groups.
+def partition_chunks(workdir, file_count, unique_collection, partitions):
+    groups = IdentityGroups()
+    for file_index in range(file_count):
+        with open(_keys_path(workdir, file_index), "rb") as f:
+            for chunk in pickle.load(f):
+                for cookie, email in chunk:
+                    groups.union(cookie, email)
+    link_stored_profiles(groups, unique_collection)
+
+    for file_index in range(file_count):
+        with open(_keys_path(workdir, file_index), "rb") as f:
+            key_chunks = pickle.load(f)
+        for chunk_index, chunk in enumerate(key_chunks):
+            path = _partition_path(workdir, file_index, chunk_index)
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, assign_partitions(chunk, groups, partitions))
+            os.replace(path + ".tmp", path)
+
+    group_count = len({groups.find(key) for key in groups.parent})
+    _write_json(os.path.join(workdir, PARTITIONED), {"groups": group_count})
+    return group_count
+
+# ✅ Ingest worker for one partition: its unique records of every chunk in file order,
+# plus every partitions-th raw record (identical raw events in two partitions are caught
+# by the unique hash index). Only the partition array of the current chunk is loaded.
+# Progress is checkpointed after each chunk.
+def ingest_partition(workdir, partition, partitions, chunks, progress=None):
+    checkpoint_path = os.path.join(workdir, f"partition-{partition:03d}.json")
+    state = _read_json(checkpoint_path, {"chunks_done": 0, "rows": 0, "totals": _empty_totals()})
+    totals, rows = {**_empty_totals(), **state["totals"]}, state["rows"]
+
+    users_collection = get_collection("users")
+    unique_collection = get_collection("unique")
+    cohort_collection = get_collection("cohort")
+    raw_events = RawEventStore(capacity=1000)  # Not loaded: one hash lookup per chunk
+
+    for position in range(state["chunks_done"], len(chunks)):
+        file_index, chunk_index = chunks[position]
+        with open(_spill_path(workdir, file_index, chunk_index), "rb") as f:
+            raw_records, unique_records = pickle.load(f)
+        owners = np.load(_partition_path(workdir, file_index, chunk_index))
+        records = [unique_records[index] for index in np.flatnonzero(owners == partition)]
+
+        raw_share = raw_records[partition::partitions]
+        if raw_share:
+            totals["raw"] += raw_events.insert_many(users_collection, raw_share)
+        if records:
+            outcomes, _, _ = apply_identity_batch(unique_collection, cohort_collection, records)
+            for outcome in outcomes:
+                totals[outcome] += 1
+
+        rows += len(raw_share)
+        _write_json(checkpoint_path, {"chunks_done": position + 1, "rows": rows, "totals": totals})
+        if progress is not None:
+            progress.put(len(raw_share))
+    return totals
+
+def _empty_totals():
+    return {"raw": 0, UPDATED: 0, EMAIL_MERGED: 0, INSERTED: 0, CONFLICT: 0, FAILED: 0}
+
+# ✅ Open the work directory: a new run writes the manifest, a run with the same files,
+# chunk size and partitions resumes, anything else needs --restart
+def open_workdir(workdir, paths, chunk_size, partitions, restart):
+    files = [{"path": path, "size": os.path.getsize(path), "mtime": os.path.getmtime(path)} for path in paths]
+    manifest = {"files": files, "chunk_size": chunk_size, "partitions": partitions}
+    if restart and os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(workdir, exist_ok=True)
+
+    existing = _read_json(os.path.join(workdir, MANIFEST))
+    if existing is None:
+        _write_json(os.path.join(workdir, MANIFEST), manifest)
+        return False
+    if existing != manifest:
+        raise SystemExit(f"❌ {workdir} holds a different run (files, chunk size or workers changed); "
+                         f"pass --restart to discard it")
+    return True
+
+# ✅ Print progress and throughput while futures run (progress items are row counts);
+# returns the rows processed in this session and the seconds it took
+def track(futures, progress, total_rows, done_rows, label, interval=2.0):
+    start = last = time.perf_counter()
+    session_rows = 0
+    pending = set(futures)
+    while pending:
+        finished, pending = wait(pending, timeout=interval, return_when=FIRST_COMPLETED)
+        for future in finished:
+            future.result()  # Re-raise a worker failure
+        while True:
+            try:
+                session_rows += progress.get_nowait()
+            except queue.Empty:
+                break
+        now = time.perf_counter()
+        if now - last >= interval or not pending:
+            print(f"⏳ {label}: {done_rows + session_rows:,}/{total_rows:,} rows "
+                  f"({(done_rows + session_rows) / max(total_rows, 1):.0%}), {session_rows / (now - start):,.0f} rows/s")
+            last = now
+    return session_rows, time.perf_counter() - start
+
+# ✅ Parse, partition and ingest `paths` with `workers` processes
+def run(paths, workdir, workers, chunk_size, restart=False, keep=False):
+    resumed = open_workdir(workdir, paths, chunk_size, workers, restart)
+    if resumed:
+        print(f"🔁 Resuming the run in {workdir}")
+    ensure_indexes(get_database())
+    context = multiprocessing.get_context("spawn")  # Workers open their own MongoDB clients
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool, context.Manager() as manager:
+        # ✅ 1. Parse every file (one task per file)
+        start = time.perf_counter()
+        futures = [pool.submit(parse_file, workdir, index, path, chunk_size) for index, path in enumerate(paths)]
+        parsed = []
+        for future in futures:
+            summary = future.result()
+            parsed.append(summary)
+            print(f"📂 Parsed {summary['file']}: {summary['rows']:,} rows in {summary['seconds']}s")
+        total_rows = sum(summary["rows"] for summary in parsed)
+        elapsed = time.perf_counter() - start
+        print(f"✅ Parsed {total_rows:,} rows from {len(paths)} files in {elapsed:.1f}s")
+
+        # ✅ 2. Identity groups -> partitions (computed once, reused on resume)
+        chunks = [(file_index, chunk_index) for file_index, summary in enumerate(parsed)
+                  for chunk_index in range(summary["chunks"])]
+        if not os.path.exists(os.path.join(workdir, PARTITIONED)):
+            group_count = partition_chunks(workdir, len(paths), get_collection("unique"), workers)
+            print(f"🧩 {group_count:,} identity groups in {workers} partitions")
+
+        # ✅ 3. One ingest task per partition (progress counts raw rows)
+        progress = manager.Queue()
+        done_rows = sum(_read_json(os.path.join(workdir, f"partition-{partition:03d}.json"), {"rows": 0})["rows"]
+                        for partition in range(workers))
+        futures = [pool.submit(ingest_partition, workdir, partition, workers, chunks, progress)
+                   for partition in range(workers)]
+        session_rows, elapsed = track(futures, progress, sum(summary["raw"] for summary in parsed), done_rows, "Ingest")
+        partition_totals = [future.result() for future in futures]
+
+    totals = _empty_totals()
+    for partition_total in partition_totals:
+        for key, value in partition_total.items():
+            totals[key] += value
+    print(f"✅ Ingested {session_rows:,} rows in {elapsed:.1f}s ({session_rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    print(f"✅ Raw rows inserted into 'users': {totals['raw']:,}")
+    print(f"🔄 Updated: {totals[UPDATED]} | 📌 Email merged: {totals[EMAIL_MERGED]} | ✅ Inserted: {totals[INSERTED]} | ⚠️ Conflicts: {totals[CONFLICT]} | ❌ Failed: {totals[FAILED]}")
+    if not keep:
+        shutil.rmtree(workdir)
+    return totals
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest many CSV files in parallel (resumable)")
+    parser.add_argument("paths", nargs="+", help="CSV files or glob patterns, e.g. 'drops/2024-06-01/*.csv'")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes (and identity partitions)")
+    parser.add_argument("--chunk-size", type=int, default=20000, help="Rows parsed per chunk (checkpoint granularity)")
+    parser.add_argument("--workdir", default=".ingest", help="Spilled chunks and checkpoints")
+    parser.add_argument("--restart", action="store_true", help="Discard an unfinished run in --workdir")
+    parser.add_argument("--keep", action="store_true", help="Keep --workdir after a successful run")
+    args = parser.parse_args()
+
+    run(expand_paths(args.paths), args.workdir, args.workers, args.chunk_size, args.restart, args.keep)
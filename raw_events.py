@@ -0,0 +1,235 @@
+import argparse
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from connection import cli_settings, configure_collection, create_client
+
+# Idempotent raw event writes to "users": every document stores a 16-byte content hash
+# of its "data" under a unique (sparse) index. A Bloom filter of the stored hashes
+# tells apart events that are certainly new (inserted straight away) from possible
+# repeats, which are confirmed with one $in lookup per batch; recently written hashes
+# are also kept exactly, so a client retry is dropped without any round trip.
+HASH_FIELD = "hash"
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+# ✅ Content hash of a raw event (key order does not matter)
+def content_hash(data):
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_json_default)
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).digest()
+
+# ✅ Bloom filter over content hashes (bit positions by double hashing of the digest)
+class BloomFilter:
+    def __init__(self, capacity=10_000_000, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, digests):
+        halves = np.frombuffer(b"".join(digests), dtype="<u8").reshape(-1, 2)
+        steps = np.arange(self.hash_count, dtype=np.uint64)
+        return (halves[:, :1] + steps * halves[:, 1:]) % np.uint64(self.size)  # uint64 wraps, as intended
+
+    def add_many(self, digests):
+        if not digests:
+            return
+        positions = self._positions(digests).ravel()
+        np.bitwise_or.at(self._bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self.count += len(digests)
+
+    # ✅ One flag per digest: False means "certainly never added"
+    def contains_many(self, digests):
+        if not digests:
+            return np.zeros(0, dtype=bool)
+        positions = self._positions(digests)
+        bits = self._bits[positions >> np.uint64(3)] & np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+        return (bits != 0).all(axis=1)
+
+class RawEventStore:
+    def __init__(self, capacity=10_000_000, error_rate=0.001, recent_size=100_000):
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._recent = OrderedDict()  # Exact hashes of the latest writes (retries)
+        self.recent_size = recent_size
+        self.loaded = False           # Until load(), every event is checked with a lookup
+        self.inserted = 0
+        self.dropped = 0
+        self.lookups = 0
+
+    # ✅ Fill the Bloom filter from the stored hashes (startup)
+    def load(self, users_collection, batch_size=50000):
+        digests = []
+        for doc in users_collection.find({HASH_FIELD: {"$exists": True}}, {"_id": 0, HASH_FIELD: 1}, batch_size=batch_size):
+            digests.append(bytes(doc[HASH_FIELD]))
+            if len(digests) >= batch_size:
+                self._add(digests)
+                digests = []
+        return self._finish_load(digests)
+
+    # ✅ Same load for an async (AsyncMongoClient) collection
+    async def load_async(self, users_collection, batch_size=50000):
+        digests = []
+        async for doc in users_collection.find({HASH_FIELD: {"$exists": True}}, {"_id": 0, HASH_FIELD: 1}, batch_size=batch_size):
+            digests.append(bytes(doc[HASH_FIELD]))
+            if len(digests) >= batch_size:
+                self._add(digests)
+                digests = []
+        return self._finish_load(digests)
+
+    def _finish_load(self, digests):
+        self._add(digests)
+        self.loaded = True
+        return self._bloom.count
+
+    def _add(self, digests, recent=False):
+        with self._lock:
+            self._bloom.add_many(digests)
+            if not recent:
+                return
+            for digest in digests:
+                self._recent[digest] = None
+                self._recent.move_to_end(digest)
+            while len(self._recent) > self.recent_size:
+                self._recent.popitem(last=False)
+
+    # ✅ Hash the documents and drop repeats that need no round trip (same batch or
+    # recently written). Returns (documents to write, hashes to confirm with a lookup).
+    def _plan(self, docs):
+        candidates, seen = [], set()
+        for doc in docs:
+            digest = content_hash(doc["data"])
+            if digest in seen:
+                continue
+            seen.add(digest)
+            with self._lock:
+                if digest in self._recent:
+                    continue
+            candidates.append({**doc, HASH_FIELD: digest})
+
+        digests = [doc[HASH_FIELD] for doc in candidates]
+        if not self.loaded:
+            return candidates, digests
+        with self._lock:
+            maybe_seen = self._bloom.contains_many(digests)
+        return candidates, [digest for digest, flag in zip(digests, maybe_seen) if flag]
+
+    def _lookup_query(self, unsure):
+        return {HASH_FIELD: {"$in": unsure}}, {"_id": 0, HASH_FIELD: 1}
+
+    def _finish(self, docs, candidates, stored):
+        self.dropped += len(docs) - len(candidates) + len(stored)
+        if stored:
+            self._add(list(stored), recent=True)
+        return [doc for doc in candidates if doc[HASH_FIELD] not in stored]
+
+    # ✅ Insert raw events whose content is not stored yet; returns how many were written.
+    # A concurrent writer of the same content is caught by the unique index (E11000).
+    def insert_many(self, users_collection, docs):
+        candidates, unsure = self._plan(docs)
+        stored = set()
+        if unsure:
+            self.lookups += 1
+            stored = {bytes(doc[HASH_FIELD]) for doc in users_collection.find(*self._lookup_query(unsure))}
+        new_docs = self._finish(docs, candidates, stored)
+        if not new_docs:
+            return 0
+
+        failed = set()
+        try:
+            users_collection.insert_many(new_docs, ordered=False)
+        except BulkWriteError as exc:
+            failed = self._duplicate_errors(exc)
+        return self._record(new_docs, failed)
+
+    # ✅ Async variant for server_async
+    async def insert_many_async(self, users_collection, docs):
+        candidates, unsure = self._plan(docs)
+        stored = set()
+        if unsure:
+            self.lookups += 1
+            stored = {bytes(doc[HASH_FIELD]) async for doc in users_collection.find(*self._lookup_query(unsure))}
+        new_docs = self._finish(docs, candidates, stored)
+        if not new_docs:
+            return 0
+
+        failed = set()
+        try:
+            await users_collection.insert_many(new_docs, ordered=False)
+        except BulkWriteError as exc:
+            failed = self._duplicate_errors(exc)
+        return self._record(new_docs, failed)
+
+    # ✅ Indexes of duplicate-key failures (anything else is re-raised)
+    def _duplicate_errors(self, exc):
+        errors = exc.details["writeErrors"]
+        if any(error["code"] != 11000 for error in errors):
+            raise exc
+        return {error["index"] for error in errors}
+
+    def _record(self, new_docs, failed):
+        self._add([doc[HASH_FIELD] for doc in new_docs], recent=True)
+        self.inserted += len(new_docs) - len(failed)
+        self.dropped += len(failed)
+        return len(new_docs) - len(failed)
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "hashes": self._bloom.count,
+            "inserted": self.inserted,
+            "dropped": self.dropped,
+            "lookups": self.lookups,
+        }
+
+# ✅ Hash raw documents written before deduplication and delete the byte-identical
+# copies (the unique hash index rejects every copy after the first one)
+def backfill_hashes(users_collection, batch_size=5000):
+    hashed, removed = 0, 0
+    cursor = users_collection.find({HASH_FIELD: {"$exists": False}}, {"data": 1}, batch_size=batch_size)
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            hashed, removed = _backfill_batch(users_collection, batch, hashed, removed)
+            batch = []
+    if batch:
+        hashed, removed = _backfill_batch(users_collection, batch, hashed, removed)
+    return hashed, removed
+
+def _backfill_batch(users_collection, batch, hashed, removed):
+    ops = [UpdateOne({"_id": doc["_id"]}, {"$set": {HASH_FIELD: content_hash(doc.get("data"))}}) for doc in batch]
+    duplicates = []
+    try:
+        users_collection.bulk_write(ops, ordered=False)
+    except BulkWriteError as exc:
+        errors = exc.details["writeErrors"]
+        if any(error["code"] != 11000 for error in errors):
+            raise
+        duplicates = [batch[error["index"]]["_id"] for error in errors]
+    if duplicates:
+        users_collection.delete_many({"_id": {"$in": duplicates}})
+    return hashed + len(batch) - len(duplicates), removed + len(duplicates)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hash existing raw events and remove duplicate copies")
+    parser.add_argument("--uri", help="Overrides MONGO_URI / the configured URI (connection.py)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    from indexes import ensure_indexes
+
+    settings = cli_settings(args.uri)
+    db = create_client(settings)[settings["database"]]
+    ensure_indexes(db)
+    hashed, removed = backfill_hashes(configure_collection(db, "users", settings), args.batch_size)
+    print(f"✅ Hashed {hashed} raw events, removed {removed} duplicates")
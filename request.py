@@ -1,9 +1,7 @@
-from pymongo import MongoClient
+from connection import get_collection
 
-# Connect to MongoDB
-client = MongoClient("mongodb://localhost:27017/")
-db = client["user_database"]
-cohort_collection = db["cohort"]
+# Connect to MongoDB (settings from connection.py)
+cohort_collection = get_collection("cohort")
 
 # Query the collection
 cookie = "ashokpravin10"
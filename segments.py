@@ -0,0 +1,166 @@
+import argparse
+import math
+import numbers
+from bisect import bisect_right
+from collections import Counter
+from pymongo import UpdateOne
+from cache import VERSIONS_COLLECTION, bump_write_version
+from cohort_assignment import DEFAULT_INTEREST_CATEGORIES, OTHER, build_keyword_index
+from connection import cli_settings, create_client
+
+# Materialized segments: every "unique" profile stores its segment ids in a
+# "segments" field and the "segments" collection keeps one size counter per segment
+# ({"_id": "interests:Tech", "dimension": "interests", "value": "Tech", "size": n}).
+# Writers apply the (before, after) difference of the profiles they change, so
+# membership and sizes are read directly instead of re-segmenting every profile.
+SEGMENTS_COLLECTION = "segments"
+UNKNOWN = "Unknown"
+
+# Age bands ($bucket lower bounds; the last band is open-ended)
+AGE_BUCKETS = [0, 18, 25, 35, 45, 55, 65, 200]
+
+KEYWORD_INDEX = build_keyword_index(DEFAULT_INTEREST_CATEGORIES)
+CATEGORY_PRIORITY = {category: rank for rank, category in enumerate(DEFAULT_INTEREST_CATEGORIES)}
+
+# ✅ Interest cohorts of one profile (same rules as cohort_assignment.assign_cohorts)
+def interest_cohorts(interests):
+    if isinstance(interests, str):
+        interests = interests.split(",")
+    if not isinstance(interests, list):
+        return [OTHER]
+
+    categories = set()
+    for interest in interests:
+        if interest is not None:
+            categories.update(KEYWORD_INDEX.get(str(interest).lower().strip(), ()))
+    return sorted(categories, key=CATEGORY_PRIORITY.get) or [OTHER]
+
+# ✅ Age band label ("25-34", "65+"), "Unknown" outside the bands or when missing
+def age_band(age):
+    if isinstance(age, bool) or not isinstance(age, numbers.Real) or math.isnan(age):
+        return UNKNOWN
+    position = bisect_right(AGE_BUCKETS, age) - 1
+    if position < 0 or position >= len(AGE_BUCKETS) - 1:
+        return UNKNOWN
+    lower, upper = AGE_BUCKETS[position], AGE_BUCKETS[position + 1]
+    return f"{lower}+" if upper == AGE_BUCKETS[-1] else f"{lower}-{upper - 1}"
+
+# ✅ Segment ids of a profile: interest cohorts, income bracket and age band
+def profile_segments(data):
+    if data is None:
+        return []
+    demographics = data.get("demographics")
+    if not isinstance(demographics, dict):
+        demographics = {}
+
+    segments = [f"interests:{category}" for category in interest_cohorts(data.get("interests"))]
+    segments.append(f"income:{demographics.get('income') or UNKNOWN}")
+    segments.append(f"age:{age_band(demographics.get('age'))}")
+    return segments
+
+# ✅ Add the size changes of one profile write (before=None for a new profile)
+def add_segment_delta(delta, before_data, after_data):
+    before, after = set(profile_segments(before_data)), set(profile_segments(after_data))
+    for segment in before - after:
+        delta[segment] -= 1
+    for segment in after - before:
+        delta[segment] += 1
+    return delta
+
+# ✅ Size changes of a list of (before, after) profile writes
+def segment_delta(changes):
+    delta = Counter()
+    for before_data, after_data in changes:
+        add_segment_delta(delta, before_data, after_data)
+    return delta
+
+# ✅ Upserting $inc per changed segment counter
+def size_ops(delta):
+    ops = []
+    for segment, change in sorted(delta.items()):
+        if change:
+            dimension, value = segment.split(":", 1)
+            ops.append(UpdateOne(
+                {"_id": segment},
+                {"$inc": {"size": change}, "$setOnInsert": {"dimension": dimension, "value": value}},
+                upsert=True,
+            ))
+    return ops
+
+# ✅ Store a profile's segments only while its segment fields still hold these values.
+# Segments are a pure function of the matched fields, so a concurrent write that got
+# there first is never overwritten with stale membership.
+def membership_update(data):
+    query = {
+        "data.cookie": data["cookie"],
+        "data.interests": data.get("interests"),
+        "data.demographics": data.get("demographics"),
+    }
+    return query, {"$set": {"segments": profile_segments(data)}}
+
+# ✅ Incremental maintenance for a single profile write (row-by-row / single ingest)
+def record_profile_change(unique_collection, before_data, after_data):
+    query, update = membership_update(after_data)
+    unique_collection.update_one(query, update)
+
+    ops = size_ops(add_segment_delta(Counter(), before_data, after_data))
+    if ops:
+        unique_collection.database[SEGMENTS_COLLECTION].bulk_write(ops, ordered=False)
+
+# ✅ Flush accumulated size changes (batched writers)
+def apply_size_delta(segments_collection, delta):
+    ops = size_ops(delta)
+    if ops:
+        segments_collection.bulk_write(ops, ordered=False)
+
+# ✅ Sizes per dimension: {"interests": [{"value": "Tech", "size": n}, ...], ...}
+def format_segment_sizes(docs):
+    sizes = {}
+    for doc in docs:
+        sizes.setdefault(doc["dimension"], []).append({"value": doc["value"], "size": doc["size"]})
+    for groups in sizes.values():
+        groups.sort(key=lambda group: (-group["size"], group["value"]))
+    return sizes
+
+def segment_sizes_query(dimension=None):
+    query = {"size": {"$gt": 0}}
+    if dimension:
+        query["dimension"] = dimension
+    return query
+
+# ✅ Full recompute (backfill profiles written before segments were maintained,
+# or reconcile counters after concurrent batch writes)
+def rebuild_segments(db, batch_size=5000):
+    unique_collection = db["unique"]
+    sizes = Counter()
+    ops = []
+
+    projection = {"data.interests": 1, "data.demographics": 1}
+    for doc in unique_collection.find({}, projection):
+        segments = profile_segments(doc.get("data"))
+        sizes.update(segments)
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"segments": segments}}))
+        if len(ops) >= batch_size:
+            unique_collection.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        unique_collection.bulk_write(ops, ordered=False)
+
+    segments_collection = db[SEGMENTS_COLLECTION]
+    segments_collection.delete_many({})
+    apply_size_delta(segments_collection, sizes)
+    bump_write_version(db[VERSIONS_COLLECTION], "unique")  # Cached profiles carry the old segments
+    return sizes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild materialized segments from the 'unique' collection")
+    parser.add_argument("--uri", help="Overrides MONGO_URI / the configured URI (connection.py)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    settings = cli_settings(args.uri)
+    db = create_client(settings)[settings["database"]]
+    sizes = rebuild_segments(db, args.batch_size)
+    print(f"✅ Rebuilt {len(sizes)} segments")
+    for segment, size in sorted(sizes.items()):
+        print(f"   {segment}: {size}")
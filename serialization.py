@@ -0,0 +1,27 @@
+from datetime import datetime
+import orjson
+from fastapi.responses import JSONResponse
+
+# Response serialization for Mongo documents. orjson writes datetimes as ISO 8601
+# (same text as datetime.isoformat() for the naive datetimes PyMongo returns) and
+# NaN / Infinity as null, so documents are serialized as read, without a sanitizing
+# copy and without FastAPI's jsonable_encoder walk.
+
+# ✅ Fallback for values orjson does not know (ObjectId, Decimal128, datetime subclasses
+# such as pandas.Timestamp)
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+# ✅ Mongo document(s) -> JSON bytes
+def dumps(value):
+    return orjson.dumps(value, default=_default)
+
+# ✅ JSON response rendered with orjson; `content` may also be pre-rendered bytes
+# (e.g. a cached body), which are sent as they are
+class MongoJSONResponse(JSONResponse):
+    def render(self, content):
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
@@ -1,101 +1,312 @@
 import pandas as pd
-from pymongo import MongoClient
-from datetime import datetime
-from fastapi import FastAPI, HTTPException, Query
+from bson import ObjectId
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from typing import Optional, List, Dict
-import math
-
-app = FastAPI()
-
-# ✅ MongoDB Connection
-MONGO_URI = "mongodb://localhost:27017/"
-client = MongoClient(MONGO_URI)
-db = client["user_database"]
-
-# Collections
-users_collection = db["users"]       # Raw insertion (no transformations)
-unique_collection = db["unique"]     # Unique user data (one record per cookie)
-cohort_collection = db["cohort"]     # Tracks updated users (merged email records)
-
-# ✅ Function: Sanitize Data (Convert NaN to None)
-def sanitize_data(data):
-    if isinstance(data, dict):
-        return {k: sanitize_data(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [sanitize_data(v) for v in data]
-    elif isinstance(data, float) and math.isnan(data):
-        return None
-    return data
+import os
+from cache import (
+    VERSIONS_COLLECTION,
+    LRUTTLCache,
+    VersionedResultCache,
+    bump_write_version,
+    read_write_version,
+)
+from connection import configure_collection, create_client, load_settings
+from transform import transform_frame, report_invalid_dates
+from indexes import ensure_indexes
+from metrics import MetricsMiddleware, ServiceMetrics
+from bitmap_index import BitmapIndex
+from raw_events import RawEventStore
+from serialization import MongoJSONResponse, dumps as json_bytes
+from write_behind import WriteBehindQueue, coalesce_records
+from segments import (
+    SEGMENTS_COLLECTION,
+    format_segment_sizes,
+    record_profile_change,
+    segment_sizes_query,
+)
+from identity_resolver import (
+    apply_identity_batch,
+    classify_merge,
+    cohort_update,
+    merge_filter,
+    merge_pipeline,
+    EMAIL_MERGED,
+    CONFLICT,
+)
+from api_common import (
+    COHORT_PROJECTION,
+    DEFAULT_PAGE_SIZE,
+    INGEST_MESSAGES,
+    MAX_PAGE_SIZE,
+    batch_response,
+    build_cohort_query,
+    build_page,
+    canonical_cohort_filters,
+    check_bitmap_keys,
+    cohort_filters_match,
+    cohort_stats_pipeline,
+    decode_continuation_token,
+    format_cohort_stats,
+    load_cluster_model,
+    parse_batch_body,
+    parse_cluster_profiles,
+    prepare_ingest_data,
+    require_cluster_model,
+    sanitize_data,
+    to_ndjson_line,
+    user_cache_keys,
+    validate_batch,
+)
 
-# ✅ Insert CSV Data (Only to "users")
-def insert_csv_to_users(csv_path):
-    df = pd.read_csv(csv_path)
-    records = df.to_dict(orient="records")
+metrics = ServiceMetrics()  # Command timings and pool usage come from the driver's event listeners
+
+# ✅ MongoDB Connection (settings from connection.py), opened on startup
+client = None
+db = None
+
+# Collections (each with its configured write concern)
+users_collection = None     # Raw insertion (no transformations)
+unique_collection = None    # Unique user data (one record per cookie)
+cohort_collection = None    # Tracks updated users (merged email records)
+segments_collection = None  # Materialized segment sizes
+versions_collection = None  # Shared write versions of cached collections (cache.py)
+
+# ✅ Read-through cache for /api/user (keyed by ("email", ...) / ("cookie", ...)),
+# invalidated by "unique" writes (this process's directly, other writers' through
+# the shared write version)
+user_cache = LRUTTLCache(
+    maxsize=int(os.environ.get("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("USER_CACHE_TTL_SECONDS", "60")),
+    check_interval=float(os.environ.get("USER_CACHE_CHECK_SECONDS", "1")),
+)
+
+# ✅ Result cache for cohort segment queries, invalidated by "cohort" writes
+# (this process's directly, other writers' through the shared write version)
+cohort_cache = VersionedResultCache(
+    max_bytes=int(os.environ.get("COHORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.environ.get("COHORT_CACHE_TTL_SECONDS", "300")),
+    check_interval=float(os.environ.get("COHORT_CACHE_CHECK_SECONDS", "1")),
+)
+
+# ✅ Drop cached cohort results if another process wrote "cohort" since the last check
+def refresh_cohort_cache():
+    if cohort_cache.check_due():
+        cohort_cache.observe(read_write_version(versions_collection, "cohort"))
+
+# ✅ Drop cached profiles if another process wrote "unique" since the last check
+def refresh_user_cache():
+    if user_cache.check_due():
+        user_cache.observe(read_write_version(versions_collection, "unique"))
 
-    formatted_records = []
-    for record in records:
-        # Convert created_at to datetime
-        if "created_at" in record and pd.notna(record["created_at"]):
-            record["created_at"] = datetime.strptime(str(record["created_at"]), "%m/%d/%Y %H:%M")
+# ✅ Fitted user cluster model (clustering.py), loaded once at startup
+cluster_model = None
 
-        # Ensure interests are stored as an array
-        if "interests" in record and pd.notna(record["interests"]):
-            record["interests"] = [interest.strip() for interest in record["interests"].split("|")]
+# ✅ Bitmap index over "unique" for boolean segment counts (built at startup, rebuilt
+# when other processes wrote "unique", checked at most every BITMAP_REBUILD_SECONDS)
+bitmap_index = BitmapIndex()
+BITMAP_REBUILD_SECONDS = float(os.environ.get("BITMAP_REBUILD_SECONDS", "60"))
 
-        # Format for MongoDB
-        formatted_record = {"data": record}
-        formatted_records.append(formatted_record)
+def refresh_bitmap_index():
+    if not bitmap_index.check_due(BITMAP_REBUILD_SECONDS):
+        return
+    shared_version = read_write_version(versions_collection, "unique")
+    if bitmap_index.behind(shared_version) and bitmap_index.rebuilding.acquire(blocking=False):
+        try:
+            bitmap_index.build(unique_collection, shared_version)  # Other requests keep counting meanwhile
+        finally:
+            bitmap_index.rebuilding.release()
+
+# ✅ Content-hash deduplication of raw "users" events (Bloom filter loaded at startup)
+raw_events = RawEventStore(capacity=int(os.environ.get("RAW_DEDUP_CAPACITY", "10000000")))
+
+# ✅ Startup: connect, create the declared indexes (unique cookie/email, cohort filters),
+# load the cluster model and build the bitmap index
+@asynccontextmanager
+async def lifespan(app):
+    global client, db, users_collection, unique_collection, cohort_collection, segments_collection, versions_collection
+    global cluster_model
+
+    settings = load_settings()
+    client = create_client(settings, event_listeners=metrics.listeners)
+    db = client[settings["database"]]
+    users_collection = configure_collection(db, "users", settings)
+    unique_collection = configure_collection(db, "unique", settings)
+    cohort_collection = configure_collection(db, "cohort", settings)
+    segments_collection = configure_collection(db, SEGMENTS_COLLECTION, settings)
+    versions_collection = configure_collection(db, VERSIONS_COLLECTION, settings)
+
+    await run_in_threadpool(ensure_indexes, db)
+    cluster_model = await run_in_threadpool(load_cluster_model)
+    shared_version = await run_in_threadpool(read_write_version, versions_collection, "unique")
+    await run_in_threadpool(bitmap_index.build, unique_collection, shared_version)
+    await run_in_threadpool(raw_events.load, users_collection)
+    if write_behind is not None:
+        await run_in_threadpool(write_behind.start)  # Replays payloads logged before a crash
+    yield
+    if write_behind is not None:
+        await run_in_threadpool(write_behind.stop)  # Flush what is still queued
+    client.close()
+
+app = FastAPI(lifespan=lifespan, default_response_class=MongoJSONResponse)
+app.add_middleware(MetricsMiddleware, histogram=metrics.requests)
+
+# ✅ Insert CSV Data (Only to "users")
+def insert_csv_to_users(csv_path):
+    df = pd.read_csv(csv_path)
+    formatted_records, _, invalid_rows = transform_frame(df)
+    report_invalid_dates(invalid_rows)
 
     # Insert into "users" collection (Raw Data)
     if formatted_records:
-        users_collection.insert_many(formatted_records)
-        print("✅ CSV Data Successfully Inserted into MongoDB!")
+        inserted = raw_events.insert_many(users_collection, formatted_records)
+        print(f"✅ CSV Data Successfully Inserted into MongoDB! ({inserted} new, {len(formatted_records) - inserted} duplicates skipped)")
     else:
         print("⚠️ No valid records found to insert.")
 
 # ✅ Insert or Update Unique & Cohort Users
 @app.post("/api/ingest")
 def insert_user(payload: Dict):
-    if "data" not in payload or "cookie" not in payload["data"] or "email" not in payload["data"]:
-        raise HTTPException(status_code=400, detail="Missing required fields in 'data'")
+    with metrics.ingest_stages.time("sanitize"):
+        data = prepare_ingest_data(payload)
+        # Write-behind logs the payload as JSON, so created_at stays text there
+        logged_data = sanitize_data(payload["data"]) if write_behind is not None else None
+
+    if write_behind is not None:
+        # ✅ Write-behind mode: log + enqueue, answer before the MongoDB writes
+        if not write_behind.submit(logged_data):
+            raise HTTPException(status_code=503, detail="Ingest queue is full, retry later",
+                                headers={"Retry-After": "1"})
+        return JSONResponse(status_code=202, content={"message": "Accepted for processing"})
+
+    # ✅ 1. Insert into "users" (Raw Data - No transformation); repeated payloads are skipped
+    with metrics.ingest_stages.time("raw_insert"):
+        raw_events.insert_many(users_collection, [{"data": data}])
+
+    # ✅ 2. Merge into "unique" with one atomic upsert (cookie match, email match or insert)
+    with metrics.ingest_stages.time("merge"):
+        outcome, merged_data, profile_id = merge_into_unique(data)
+    metrics.count_outcomes([outcome])
+
+    if outcome == EMAIL_MERGED:
+        # ✅ Email match: replace the identity's "cohort" document with the merged profile
+        with metrics.ingest_stages.time("cohort_upsert"):
+            previous = cohort_collection.find_one_and_update(
+                *cohort_update(profile_id, merged_data, datetime.now(timezone.utc)),
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+            shared_version = bump_write_version(versions_collection, "cohort")
+        # Cached segments that held the old snapshot or now hold the new one are stale
+        cohort_cache.record_write(lambda key: cohort_filters_match(key[1], merged_data) or (
+            previous is not None and cohort_filters_match(key[1], previous["data"])
+        ), shared_version)
 
-    data = sanitize_data(payload["data"])  # Sanitize input
-    cookie = data["cookie"]
-    email = data["email"]
+    return {"message": INGEST_MESSAGES[outcome]}
 
-    # ✅ Ensure created_at is handled properly
-    if "created_at" in data and isinstance(data["created_at"], str):
+# ✅ Atomic merge into "unique" -> (outcome, merged profile, _id of the merged profile or
+# None for an insert); a DuplicateKeyError means a concurrent ingest inserted the same
+# key first, so retry once to merge into that profile instead
+def merge_into_unique(data):
+    for attempt in range(2):
         try:
-            data["created_at"] = datetime.strptime(data["created_at"], "%m/%d/%Y %H:%M")
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid date format for created_at")
+            before = unique_collection.find_one_and_update(
+                merge_filter(data),
+                merge_pipeline(data),
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+            outcome, merged_data = classify_merge(before, data)
+            if before is None or before["data"] != merged_data:
+                # ✅ Drop cached lookups for the new keys and the profile's previous keys,
+                # here and (through the shared version) in every other process
+                user_cache.invalidate(user_cache_keys(data), [before["_id"]] if before else [])
+                shared_version = bump_write_version(versions_collection, "unique")
+                user_cache.record_write(shared_version)
+                bitmap_index.record_write(shared_version)  # Its change is applied below
 
-    # ✅ 1. Insert into "users" (Raw Data - No transformation)
-    users_collection.insert_one({"data": data})
+            # ✅ Move the profile between materialized segments (only what changed)
+            record_profile_change(unique_collection, before["data"] if before else None, merged_data)
+            bitmap_index.apply_change(before["data"] if before else None, merged_data)
+            return outcome, merged_data, before["_id"] if before else None
+        except DuplicateKeyError:
+            if attempt:
+                raise HTTPException(status_code=409, detail=INGEST_MESSAGES[CONFLICT])
 
-    # ✅ 2. Check if user exists in "unique" (by cookie or email)
-    existing_cookie_user = unique_collection.find_one({"data.cookie": cookie})
-    existing_email_user = unique_collection.find_one({"data.email": email})
+# ✅ Validate all payloads, then write the whole batch with bulk operations
+def ingest_batch(payloads):
+    with metrics.ingest_stages.time("sanitize"):
+        results, valid_indexes, records = validate_batch(payloads)
+    outcomes = []
 
-    if existing_cookie_user:
-        # ✅ Update Unique user by cookie (Merge & keep created_at)
-        merged_data = {**existing_cookie_user["data"], **data}
-        unique_collection.update_one({"data.cookie": cookie}, {"$set": {"data": merged_data}})
-        return {"message": "User updated successfully in unique table"}
+    if records:
+        # ✅ 1. Raw events into "users" in one round trip (repeated payloads are skipped)
+        with metrics.ingest_stages.time("batch_raw_insert"):
+            raw_events.insert_many(users_collection, [{"data": record["data"]} for record in records])
 
-    elif existing_email_user:
-        # ✅ Merge Email (Keep latest cookie but retain previous created_at)
-        merged_data = {**existing_email_user["data"], **data}
-        merged_data["created_at"] = existing_email_user["data"].get("created_at", data.get("created_at"))
+        # ✅ 2. Resolve cookie/email merges for the whole batch in memory
+        outcomes = write_identity_records(records)
 
-        unique_collection.update_one({"data.email": email}, {"$set": {"data": merged_data}})
-        cohort_collection.insert_one({"data": merged_data})
-        return {"message": "User email matched, merged profile in unique and stored in cohort"}
+    return batch_response(results, valid_indexes, outcomes)
 
-    else:
-        # ✅ Insert as a new user into "unique" table
-        unique_collection.insert_one({"data": data})
-        return {"message": "New user inserted successfully in unique table"}
+# ✅ Merge a batch of records into "unique"/"cohort" and update the in-process caches
+def write_identity_records(records):
+    with metrics.ingest_stages.time("batch_merge"):
+        versions = {}
+        outcomes, updated_ids, changes = apply_identity_batch(
+            unique_collection, cohort_collection, records, keep_created_at_on_email_merge=True, versions=versions
+        )
+    metrics.count_outcomes(outcomes)
+    bitmap_index.apply_changes(changes)
+    user_cache.invalidate([key for record in records for key in user_cache_keys(record["data"])], updated_ids)
+    if "unique" in versions:
+        user_cache.record_write(versions["unique"])
+        bitmap_index.record_write(versions["unique"])
+    if "cohort" in versions:
+        # Batch cohort upserts (the shared version was bumped by apply_identity_batch): every cached segment is stale
+        cohort_cache.record_write(shared_version=versions["cohort"])
+    return outcomes
+
+# ✅ Write-behind flush: raw events keep their logged _id (a replayed batch skips the
+# ones already inserted), then repeated updates of a user are merged into one write
+def apply_write_behind_batch(entries):
+    with metrics.ingest_stages.time("sanitize"):
+        datas = [prepare_ingest_data({"data": data}) for _, data in entries]
+    raw_events.insert_many(
+        users_collection, [{"_id": ObjectId(raw_id), "data": data} for (raw_id, _), data in zip(entries, datas)]
+    )
+    write_identity_records([{"data": data} for data in coalesce_records(datas)])
+
+# ✅ Optional write-behind mode for /api/ingest (INGEST_WRITE_BEHIND=1)
+write_behind = None
+if os.environ.get("INGEST_WRITE_BEHIND") == "1":
+    write_behind = WriteBehindQueue(
+        os.environ.get("INGEST_WAL_PATH", "ingest.wal"),
+        apply_write_behind_batch,
+        max_pending=int(os.environ.get("INGEST_QUEUE_SIZE", "10000")),
+        batch_size=int(os.environ.get("INGEST_QUEUE_BATCH_SIZE", "1000")),
+        fsync=os.environ.get("INGEST_WAL_FSYNC", "1") == "1",
+    )
+metrics.watch_state(user_cache, cohort_cache, raw_events, write_behind)
+
+# ✅ Write-behind queue counters (pending, last logged / applied sequence, rejections)
+@app.get("/api/ingest/queue")
+def get_ingest_queue_stats():
+    if write_behind is None:
+        return {"enabled": False}
+    return {"enabled": True, **write_behind.stats()}
+
+# ✅ Bulk Insert or Update (JSON array or NDJSON body)
+@app.post("/api/ingest/batch")
+async def insert_users_batch(request: Request):
+    body = await request.body()
+    payloads = parse_batch_body(body, request.headers.get("content-type", ""))
+    return await run_in_threadpool(ingest_batch, payloads)
 
 # ✅ Retrieve User by Email or Cookie (From Unique Table)
 @app.get("/api/user")
@@ -103,15 +314,33 @@ def get_user(email: Optional[str] = None, cookie: Optional[str] = None):
     if not email and not cookie:
         raise HTTPException(status_code=400, detail="Provide either 'email' or 'cookie'")
 
+    key = ("email", email) if email else ("cookie", cookie)
+    refresh_user_cache()
+    body = user_cache.get(key)
+    if body is not None:
+        return MongoJSONResponse(body)
+
+    epoch = user_cache.epoch
     query = {"data.email": email} if email else {"data.cookie": cookie}
-    user = unique_collection.find_one(query, {"_id": 0})
+    user = unique_collection.find_one(query)
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return sanitize_data(user)
+    profile_id = user.pop("_id")
+    body = json_bytes(user)  # Cached rendered, so a hit costs no serialization
+    user_cache.set(key, body, profile_id, epoch)
+    return MongoJSONResponse(body)
+
+# ✅ /api/user cache counters (hits, misses, evictions...) for tuning size and TTL
+@app.get("/api/user/cache")
+def get_user_cache_stats():
+    return user_cache.stats()
 
 # ✅ Retrieve Cohort Users (Filtered Search)
+# - no paging params: full list (original behaviour)
+# - limit / after: one keyset page {"users": [...], "next": token}
+# - stream=true: NDJSON written straight from the cursor (constant server memory)
 @app.get("/api/cohort/user")
 def get_cohort_users(
     cookie: Optional[str] = None,
@@ -122,37 +351,133 @@ def get_cohort_users(
     gender: Optional[str] = None,
     income: Optional[str] = None,
     education: Optional[str] = None,
-    interests: Optional[List[str]] = Query(None)
+    interests: Optional[List[str]] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    stream: bool = False
 ):
-    query = {}
-
-    if cookie:
-        query["data.cookie"] = cookie
-    if email:
-        query["data.email"] = email
-    if country:
-        query["data.location.country"] = country
-    if age_min:
-        query["data.demographics.age"] = {"$gte": age_min}
-    if age_max:
-        query.setdefault("data.demographics.age", {})["$lte"] = age_max
-    if gender:
-        query["data.demographics.gender"] = gender
-    if income:
-        query["data.demographics.income"] = income
-    if education:
-        query["data.demographics.education"] = education
-    if interests:
-        query["data.interests"] = {"$in": interests}
-
-    users = list(cohort_collection.find(query, {"_id": 0}))
-
-    if not users:
+    query = build_cohort_query(cookie, email, country, age_min, age_max, gender, income, education, interests)
+    if after:
+        query["_id"] = {"$gt": decode_continuation_token(after)}
+
+    if stream:
+        cursor = cohort_collection.find(query, COHORT_PROJECTION)
+        if after:
+            cursor = cursor.sort("_id", ASCENDING)
+        if limit:
+            cursor = cursor.limit(limit)
+        return StreamingResponse((to_ndjson_line(doc) for doc in cursor), media_type="application/x-ndjson")
+
+    if limit or after:
+        page_size = limit or DEFAULT_PAGE_SIZE
+        docs = list(cohort_collection.find(query, COHORT_PROJECTION).sort("_id", ASCENDING).limit(page_size + 1))
+        return build_page(docs, page_size)
+
+    # Cached as the rendered body (its size is the entry's memory cost)
+    key = ("users", canonical_cohort_filters(cookie, email, country, age_min, age_max, gender, income, education, interests))
+    refresh_cohort_cache()
+    body = cohort_cache.get(key)
+    if body is None:
+        version = cohort_cache.version
+        body = json_bytes(list(cohort_collection.find(query, {"_id": 0, "data": 1})))
+        cohort_cache.set(key, body, version, len(body))
+
+    if body == b"[]":
         raise HTTPException(status_code=404, detail="No users found")
 
-    return sanitize_data(users)
+    return MongoJSONResponse(body)
+
+# ✅ Segment Statistics (same filters as /api/cohort/user, aggregated in MongoDB)
+@app.get("/api/cohort/stats")
+def get_cohort_stats(
+    cookie: Optional[str] = None,
+    email: Optional[str] = None,
+    country: Optional[str] = None,
+    age_min: Optional[int] = None,
+    age_max: Optional[int] = None,
+    gender: Optional[str] = None,
+    income: Optional[str] = None,
+    education: Optional[str] = None,
+    interests: Optional[List[str]] = Query(None)
+):
+    key = ("stats", canonical_cohort_filters(cookie, email, country, age_min, age_max, gender, income, education, interests))
+    refresh_cohort_cache()
+    body = cohort_cache.get(key)
+    if body is None:
+        version = cohort_cache.version
+        query = build_cohort_query(cookie, email, country, age_min, age_max, gender, income, education, interests)
+        body = json_bytes(format_cohort_stats(next(cohort_collection.aggregate(cohort_stats_pipeline(query)))))
+        cohort_cache.set(key, body, version, len(body))
+    return MongoJSONResponse(body)
+
+# ✅ Cohort result cache counters (entries, bytes, hits, misses, evictions...)
+@app.get("/api/cohort/cache")
+def get_cohort_cache_stats():
+    return cohort_cache.stats()
+
+# ✅ Materialized segment sizes (interests / income / age), updated by every ingest.
+# Eventually consistent: counters are bumped in a separate write after the profile
+# write, so a crash in between leaves them off until `python segments.py` rebuilds them
+@app.get("/api/segments")
+def get_segment_sizes(dimension: Optional[str] = None):
+    return format_segment_sizes(segments_collection.find(segment_sizes_query(dimension)))
+
+# ✅ Segments a single user belongs to (stored on the "unique" profile)
+@app.get("/api/segments/user")
+def get_user_segments(email: Optional[str] = None, cookie: Optional[str] = None):
+    if not email and not cookie:
+        raise HTTPException(status_code=400, detail="Provide either 'email' or 'cookie'")
+
+    query = {"data.email": email} if email else {"data.cookie": cookie}
+    user = unique_collection.find_one(query, {"_id": 0, "segments": 1})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return {"segments": user.get("segments", [])}
+
+# ✅ Boolean segment count from the in-memory bitmap index:
+# users in every `include` key AND at least one `any` key AND NOT in any `exclude` key,
+# e.g. ?include=country:USA&include=interests:Tech&exclude=gender:Male
+@app.get("/api/segments/count")
+async def count_segment(
+    include: List[str] = Query([]),
+    exclude: List[str] = Query([]),
+    any_of: List[str] = Query([], alias="any")
+):
+    check_bitmap_keys(include + exclude + any_of)
+    await run_in_threadpool(refresh_bitmap_index)
+    return {"count": bitmap_index.count(include, exclude, any_of), "total": len(bitmap_index)}
+
+# ✅ Cluster of a stored user (predicted with the preloaded model, never refitted)
+@app.get("/api/cluster/user")
+def get_user_cluster(email: Optional[str] = None, cookie: Optional[str] = None):
+    model = require_cluster_model(cluster_model)
+    if not email and not cookie:
+        raise HTTPException(status_code=400, detail="Provide either 'email' or 'cookie'")
+
+    query = {"data.email": email} if email else {"data.cookie": cookie}
+    user = unique_collection.find_one(query, {"_id": 0, "data": 1})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    from clustering import predict_profiles  # Importable: the model was loaded with it
+    return {"cluster": predict_profiles(model, [user["data"]])[0]}
+
+# ✅ Clusters for a batch of profiles, in request order
+@app.post("/api/cluster/batch")
+def get_clusters_batch(payloads: List[Dict]):
+    model = require_cluster_model(cluster_model)
+    from clustering import predict_profiles
+    return {"clusters": predict_profiles(model, parse_cluster_profiles(payloads))}
 
 # ✅ Health Check Endpoint
 @app.get("/api/health")
 def health_check():
-    return {"status": "OK"}
\ No newline at end of file
+    return {"status": "OK"}
+
+# ✅ Prometheus-style metrics (request latency, MongoDB commands, pool, ingest outcomes, caches)
+@app.get("/api/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
\ No newline at end of file
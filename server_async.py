@@ -0,0 +1,409 @@
+import os
+from collections import Counter
+from datetime import datetime, timezone
+from cache import (
+    VERSIONS_COLLECTION,
+    LRUTTLCache,
+    VersionedResultCache,
+    bump_write_version_async,
+    read_write_version_async,
+)
+from connection import configure_collection, create_client, load_settings
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
+from typing import Optional, List, Dict
+from indexes import ensure_indexes_async
+from metrics import MetricsMiddleware, ServiceMetrics
+from bitmap_index import BitmapIndex
+from raw_events import RawEventStore
+from serialization import MongoJSONResponse, dumps as json_bytes
+from segments import (
+    SEGMENTS_COLLECTION,
+    add_segment_delta,
+    format_segment_sizes,
+    membership_update,
+    segment_sizes_query,
+    size_ops,
+)
+from identity_resolver import (
+    apply_identity_batch_async,
+    classify_merge,
+    cohort_update,
+    merge_filter,
+    merge_pipeline,
+    EMAIL_MERGED,
+    CONFLICT,
+)
+from api_common import (
+    COHORT_PROJECTION,
+    DEFAULT_PAGE_SIZE,
+    INGEST_MESSAGES,
+    MAX_PAGE_SIZE,
+    batch_response,
+    build_cohort_query,
+    build_page,
+    check_bitmap_keys,
+    canonical_cohort_filters,
+    cohort_filters_match,
+    cohort_stats_pipeline,
+    decode_continuation_token,
+    format_cohort_stats,
+    load_cluster_model,
+    parse_batch_body,
+    parse_cluster_profiles,
+    prepare_ingest_data,
+    require_cluster_model,
+    to_ndjson_line,
+    user_cache_keys,
+    validate_batch,
+)
+
+# ✅ Read-through cache for /api/user (keyed by ("email", ...) / ("cookie", ...)),
+# invalidated by "unique" writes (this process's directly, other writers' through
+# the shared write version)
+user_cache = LRUTTLCache(
+    maxsize=int(os.environ.get("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("USER_CACHE_TTL_SECONDS", "60")),
+    check_interval=float(os.environ.get("USER_CACHE_CHECK_SECONDS", "1")),
+)
+
+# ✅ Result cache for cohort segment queries, invalidated by "cohort" writes
+# (this process's directly, other writers' through the shared write version)
+cohort_cache = VersionedResultCache(
+    max_bytes=int(os.environ.get("COHORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.environ.get("COHORT_CACHE_TTL_SECONDS", "300")),
+    check_interval=float(os.environ.get("COHORT_CACHE_CHECK_SECONDS", "1")),
+)
+
+# ✅ Drop cached cohort results if another process wrote "cohort" since the last check
+async def refresh_cohort_cache():
+    if cohort_cache.check_due():
+        cohort_cache.observe(await read_write_version_async(versions_collection, "cohort"))
+
+# ✅ Drop cached profiles if another process wrote "unique" since the last check
+async def refresh_user_cache():
+    if user_cache.check_due():
+        user_cache.observe(await read_write_version_async(versions_collection, "unique"))
+
+client = None
+users_collection = None
+unique_collection = None
+cohort_collection = None
+segments_collection = None
+versions_collection = None  # Shared write versions of cached collections (cache.py)
+cluster_model = None  # Fitted user cluster model (clustering.py)
+bitmap_index = BitmapIndex()  # Boolean segment counts over "unique" (built at startup)
+BITMAP_REBUILD_SECONDS = float(os.environ.get("BITMAP_REBUILD_SECONDS", "60"))
+raw_events = RawEventStore(capacity=int(os.environ.get("RAW_DEDUP_CAPACITY", "10000000")))  # Raw "users" dedup
+metrics = ServiceMetrics()  # Served on /api/metrics
+metrics.watch_state(user_cache, cohort_cache, raw_events)
+
+# ✅ Rebuild the bitmap index when other processes wrote "unique" (at most every
+# BITMAP_REBUILD_SECONDS; other requests keep counting on the current index meanwhile)
+async def refresh_bitmap_index():
+    if not bitmap_index.check_due(BITMAP_REBUILD_SECONDS):
+        return
+    shared_version = await read_write_version_async(versions_collection, "unique")
+    if bitmap_index.behind(shared_version) and bitmap_index.rebuilding.acquire(blocking=False):
+        try:
+            await bitmap_index.build_async(unique_collection, shared_version)
+        finally:
+            bitmap_index.rebuilding.release()
+
+# ✅ Open the client on startup and close it on shutdown
+@asynccontextmanager
+async def lifespan(app):
+    global client, users_collection, unique_collection, cohort_collection, segments_collection, versions_collection
+    global cluster_model
+
+    # ✅ asyncio-native driver; pool, timeouts and write concerns from connection.py settings
+    settings = load_settings()
+    client = create_client(settings, asynchronous=True, event_listeners=metrics.listeners)
+    db = client[settings["database"]]
+    users_collection = configure_collection(db, "users", settings)
+    unique_collection = configure_collection(db, "unique", settings)
+    cohort_collection = configure_collection(db, "cohort", settings)
+    segments_collection = configure_collection(db, SEGMENTS_COLLECTION, settings)
+    versions_collection = configure_collection(db, VERSIONS_COLLECTION, settings)
+
+    # ✅ Create the declared indexes (unique cookie/email, cohort filters)
+    await ensure_indexes_async(db)
+
+    # ✅ Load the cluster model once (predict only, never refitted per request)
+    cluster_model = await run_in_threadpool(load_cluster_model)
+    await bitmap_index.build_async(unique_collection, await read_write_version_async(versions_collection, "unique"))
+    await raw_events.load_async(users_collection)
+
+    yield
+
+    await client.close()
+
+app = FastAPI(lifespan=lifespan, default_response_class=MongoJSONResponse)
+app.add_middleware(MetricsMiddleware, histogram=metrics.requests)
+
+# ✅ Insert or Update Unique & Cohort Users
+@app.post("/api/ingest")
+async def insert_user(payload: Dict):
+    with metrics.ingest_stages.time("sanitize"):
+        data = prepare_ingest_data(payload)
+
+    # ✅ 1. Insert into "users" (Raw Data - No transformation); repeated payloads are skipped
+    with metrics.ingest_stages.time("raw_insert"):
+        await raw_events.insert_many_async(users_collection, [{"data": data}])
+
+    # ✅ 2. Merge into "unique" with one atomic upsert (cookie match, email match or insert)
+    with metrics.ingest_stages.time("merge"):
+        outcome, merged_data, profile_id = await merge_into_unique(data)
+    metrics.count_outcomes([outcome])
+
+    if outcome == EMAIL_MERGED:
+        # ✅ Email match: replace the identity's "cohort" document with the merged profile
+        with metrics.ingest_stages.time("cohort_upsert"):
+            previous = await cohort_collection.find_one_and_update(
+                *cohort_update(profile_id, merged_data, datetime.now(timezone.utc)),
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+            shared_version = await bump_write_version_async(versions_collection, "cohort")
+        cohort_cache.record_write(lambda key: cohort_filters_match(key[1], merged_data) or (
+            previous is not None and cohort_filters_match(key[1], previous["data"])
+        ), shared_version)
+
+    return {"message": INGEST_MESSAGES[outcome]}
+
+# ✅ Atomic merge into "unique" (retried once after a concurrent insert of the same key)
+async def merge_into_unique(data):
+    for attempt in range(2):
+        try:
+            before = await unique_collection.find_one_and_update(
+                merge_filter(data),
+                merge_pipeline(data),
+                upsert=True,
+                return_document=ReturnDocument.BEFORE,
+            )
+            outcome, merged_data = classify_merge(before, data)
+            if before is None or before["data"] != merged_data:
+                # ✅ Drop cached lookups for the new keys and the profile's previous keys,
+                # here and (through the shared version) in every other process
+                user_cache.invalidate(user_cache_keys(data), [before["_id"]] if before else [])
+                shared_version = await bump_write_version_async(versions_collection, "unique")
+                user_cache.record_write(shared_version)
+                bitmap_index.record_write(shared_version)  # Its change is applied below
+
+            # ✅ Move the profile between materialized segments (only what changed)
+            await unique_collection.update_one(*membership_update(merged_data))
+            ops = size_ops(add_segment_delta(Counter(), before["data"] if before else None, merged_data))
+            if ops:
+                await segments_collection.bulk_write(ops, ordered=False)
+            bitmap_index.apply_change(before["data"] if before else None, merged_data)
+            return outcome, merged_data, before["_id"] if before else None
+        except DuplicateKeyError:
+            if attempt:
+                raise HTTPException(status_code=409, detail=INGEST_MESSAGES[CONFLICT])
+
+# ✅ Bulk Insert or Update (JSON array or NDJSON body)
+@app.post("/api/ingest/batch")
+async def insert_users_batch(request: Request):
+    body = await request.body()
+    payloads = parse_batch_body(body, request.headers.get("content-type", ""))
+
+    with metrics.ingest_stages.time("sanitize"):
+        results, valid_indexes, records = validate_batch(payloads)
+    outcomes = []
+
+    if records:
+        with metrics.ingest_stages.time("batch_raw_insert"):
+            await raw_events.insert_many_async(users_collection, [{"data": record["data"]} for record in records])
+
+        with metrics.ingest_stages.time("batch_merge"):
+            versions = {}
+            outcomes, updated_ids, changes = await apply_identity_batch_async(
+                unique_collection, cohort_collection, records, keep_created_at_on_email_merge=True, versions=versions
+            )
+        metrics.count_outcomes(outcomes)
+        bitmap_index.apply_changes(changes)
+        user_cache.invalidate([key for record in records for key in user_cache_keys(record["data"])], updated_ids)
+        if "unique" in versions:
+            user_cache.record_write(versions["unique"])
+            bitmap_index.record_write(versions["unique"])
+        if "cohort" in versions:
+            # Batch cohort upserts (shared version bumped by apply_identity_batch_async): every cached segment is stale
+            cohort_cache.record_write(shared_version=versions["cohort"])
+
+    return batch_response(results, valid_indexes, outcomes)
+
+# ✅ Retrieve User by Email or Cookie (From Unique Table)
+@app.get("/api/user")
+async def get_user(email: Optional[str] = None, cookie: Optional[str] = None):
+    if not email and not cookie:
+        raise HTTPException(status_code=400, detail="Provide either 'email' or 'cookie'")
+
+    key = ("email", email) if email else ("cookie", cookie)
+    await refresh_user_cache()
+    body = user_cache.get(key)
+    if body is not None:
+        return MongoJSONResponse(body)
+
+    epoch = user_cache.epoch
+    query = {"data.email": email} if email else {"data.cookie": cookie}
+    user = await unique_collection.find_one(query)
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    profile_id = user.pop("_id")
+    body = json_bytes(user)  # Cached rendered, so a hit costs no serialization
+    user_cache.set(key, body, profile_id, epoch)
+    return MongoJSONResponse(body)
+
+# ✅ /api/user cache counters (hits, misses, evictions...) for tuning size and TTL
+@app.get("/api/user/cache")
+async def get_user_cache_stats():
+    return user_cache.stats()
+
+# ✅ Retrieve Cohort Users (Filtered Search)
+@app.get("/api/cohort/user")
+async def get_cohort_users(
+    cookie: Optional[str] = None,
+    email: Optional[str] = None,
+    country: Optional[str] = None,
+    age_min: Optional[int] = None,
+    age_max: Optional[int] = None,
+    gender: Optional[str] = None,
+    income: Optional[str] = None,
+    education: Optional[str] = None,
+    interests: Optional[List[str]] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    stream: bool = False
+):
+    query = build_cohort_query(cookie, email, country, age_min, age_max, gender, income, education, interests)
+    if after:
+        query["_id"] = {"$gt": decode_continuation_token(after)}
+
+    if stream:
+        cursor = cohort_collection.find(query, COHORT_PROJECTION)
+        if after:
+            cursor = cursor.sort("_id", ASCENDING)
+        if limit:
+            cursor = cursor.limit(limit)
+        return StreamingResponse(
+            (to_ndjson_line(doc) async for doc in cursor), media_type="application/x-ndjson"
+        )
+
+    if limit or after:
+        page_size = limit or DEFAULT_PAGE_SIZE
+        docs = await cohort_collection.find(query, COHORT_PROJECTION).sort("_id", ASCENDING).limit(page_size + 1).to_list(None)
+        return build_page(docs, page_size)
+
+    # Cached as the rendered body (its size is the entry's memory cost)
+    key = ("users", canonical_cohort_filters(cookie, email, country, age_min, age_max, gender, income, education, interests))
+    await refresh_cohort_cache()
+    body = cohort_cache.get(key)
+    if body is None:
+        version = cohort_cache.version
+        body = json_bytes(await cohort_collection.find(query, {"_id": 0, "data": 1}).to_list(None))
+        cohort_cache.set(key, body, version, len(body))
+
+    if body == b"[]":
+        raise HTTPException(status_code=404, detail="No users found")
+
+    return MongoJSONResponse(body)
+
+# ✅ Segment Statistics (same filters as /api/cohort/user, aggregated in MongoDB)
+@app.get("/api/cohort/stats")
+async def get_cohort_stats(
+    cookie: Optional[str] = None,
+    email: Optional[str] = None,
+    country: Optional[str] = None,
+    age_min: Optional[int] = None,
+    age_max: Optional[int] = None,
+    gender: Optional[str] = None,
+    income: Optional[str] = None,
+    education: Optional[str] = None,
+    interests: Optional[List[str]] = Query(None)
+):
+    key = ("stats", canonical_cohort_filters(cookie, email, country, age_min, age_max, gender, income, education, interests))
+    await refresh_cohort_cache()
+    body = cohort_cache.get(key)
+    if body is None:
+        version = cohort_cache.version
+        query = build_cohort_query(cookie, email, country, age_min, age_max, gender, income, education, interests)
+        cursor = await cohort_collection.aggregate(cohort_stats_pipeline(query))
+        body = json_bytes(format_cohort_stats((await cursor.to_list(1))[0]))
+        cohort_cache.set(key, body, version, len(body))
+    return MongoJSONResponse(body)
+
+# ✅ Cohort result cache counters (entries, bytes, hits, misses, evictions...)
+@app.get("/api/cohort/cache")
+async def get_cohort_cache_stats():
+    return cohort_cache.stats()
+
+# ✅ Materialized segment sizes (interests / income / age), updated by every ingest.
+# Eventually consistent: counters are bumped in a separate write after the profile
+# write, so a crash in between leaves them off until `python segments.py` rebuilds them
+@app.get("/api/segments")
+async def get_segment_sizes(dimension: Optional[str] = None):
+    return format_segment_sizes(await segments_collection.find(segment_sizes_query(dimension)).to_list(None))
+
+# ✅ Segments a single user belongs to (stored on the "unique" profile)
+@app.get("/api/segments/user")
+async def get_user_segments(email: Optional[str] = None, cookie: Optional[str] = None):
+    if not email and not cookie:
+        raise HTTPException(status_code=400, detail="Provide either 'email' or 'cookie'")
+
+    query = {"data.email": email} if email else {"data.cookie": cookie}
+    user = await unique_collection.find_one(query, {"_id": 0, "segments": 1})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return {"segments": user.get("segments", [])}
+
+# ✅ Boolean segment count from the in-memory bitmap index (see server.count_segment)
+@app.get("/api/segments/count")
+async def count_segment(
+    include: List[str] = Query([]),
+    exclude: List[str] = Query([]),
+    any_of: List[str] = Query([], alias="any")
+):
+    check_bitmap_keys(include + exclude + any_of)
+    await refresh_bitmap_index()
+    return {"count": bitmap_index.count(include, exclude, any_of), "total": len(bitmap_index)}
+
+# ✅ Cluster of a stored user (predicted with the preloaded model, never refitted)
+@app.get("/api/cluster/user")
+async def get_user_cluster(email: Optional[str] = None, cookie: Optional[str] = None):
+    model = require_cluster_model(cluster_model)
+    if not email and not cookie:
+        raise HTTPException(status_code=400, detail="Provide either 'email' or 'cookie'")
+
+    query = {"data.email": email} if email else {"data.cookie": cookie}
+    user = await unique_collection.find_one(query, {"_id": 0, "data": 1})
+
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    from clustering import predict_profiles  # Importable: the model was loaded with it
+    return {"cluster": predict_profiles(model, [user["data"]])[0]}
+
+# ✅ Clusters for a batch of profiles, in request order (scored off the event loop)
+@app.post("/api/cluster/batch")
+async def get_clusters_batch(payloads: List[Dict]):
+    model = require_cluster_model(cluster_model)
+    from clustering import predict_profiles
+    return {"clusters": await run_in_threadpool(predict_profiles, model, parse_cluster_profiles(payloads))}
+
+# ✅ Health Check Endpoint
+@app.get("/api/health")
+async def health_check():
+    return {"status": "OK"}
+
+# ✅ Prometheus-style metrics (request latency, MongoDB commands, pool, ingest outcomes, caches)
+@app.get("/api/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+import pyarrow as pa
+import pyarrow.compute as pc
+from pymongo import ASCENDING
+from connection import cli_settings, configure_collection, create_client
+
+# Columnar snapshot of "unique": Arrow IPC part files with flattened data.* columns.
+# The first export writes every profile; later exports append a part holding only the
+# profiles written since the stored watermark ("updated_at", maintained by every writer).
+# Readers memory-map the parts, read only the columns they ask for and keep the latest
+# row per _id. Parts are merged back into one file once there are more than `max_parts`.
+MANIFEST = "manifest.json"
+
+SCHEMA = pa.schema([
+    ("_id", pa.string()),
+    ("data.cookie", pa.string()),
+    ("data.email", pa.string()),
+    ("data.phone_number", pa.string()),
+    ("data.created_at", pa.timestamp("ms")),
+    ("data.location.state", pa.string()),
+    ("data.location.country", pa.string()),
+    ("data.location.city", pa.string()),
+    ("data.demographics.age", pa.float64()),
+    ("data.demographics.gender", pa.string()),
+    ("data.demographics.income", pa.string()),
+    ("data.demographics.education", pa.string()),
+    ("data.interests", pa.list_(pa.string())),
+    ("updated_at", pa.timestamp("ms")),
+])
+
+# ✅ Value at a dotted path ("data.location.city"), None when any level is missing
+def _get_path(doc, path):
+    value = doc
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+# ✅ Coerce one raw value to the column type (bad values become nulls, not errors)
+def _coerce(value, arrow_type):
+    if value is None:
+        return None
+    if pa.types.is_string(arrow_type):
+        return str(value)
+    if pa.types.is_floating(arrow_type):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return None
+        return None if number != number else number  # NaN -> null
+    if pa.types.is_timestamp(arrow_type):
+        return value if isinstance(value, datetime) else None
+    if pa.types.is_list(arrow_type):
+        if isinstance(value, str):
+            value = [value]
+        return [str(item) for item in value if item is not None] if isinstance(value, list) else None
+    return value
+
+# ✅ One Arrow record batch from a chunk of "unique" documents
+def documents_to_batch(docs):
+    columns = []
+    for field in SCHEMA:
+        if field.name == "_id":
+            values = [str(doc["_id"]) for doc in docs]
+        else:
+            values = [_coerce(_get_path(doc, field.name), field.type) for doc in docs]
+        columns.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(columns, schema=SCHEMA)
+
+def read_manifest(path):
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return {"watermark": None, "parts": [], "next_part": 0}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+# ✅ Write the manifest atomically (readers never see a half-written file)
+def write_manifest(path, manifest):
+    tmp_path = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+
+# ✅ Stream a cursor into a new part file, skipping the (_id, updated_at) rows in
+# `exported`; returns (rows, max updated_at)
+def _write_part(part_path, cursor, chunk_size, exported=frozenset()):
+    rows, watermark = 0, None
+    with pa.OSFile(part_path, "wb") as sink, pa.ipc.new_file(sink, SCHEMA) as writer:
+        chunk = []
+        for doc in cursor:
+            if exported and (str(doc["_id"]), doc.get("updated_at")) in exported:
+                continue
+            chunk.append(doc)
+            updated_at = doc.get("updated_at")
+            if isinstance(updated_at, datetime) and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+            if len(chunk) >= chunk_size:
+                writer.write_batch(documents_to_batch(chunk))
+                rows += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write_batch(documents_to_batch(chunk))
+            rows += len(chunk)
+    return rows, watermark
+
+# ✅ (_id, updated_at) of the rows already exported with updated_at >= since; only the
+# updated_at column is scanned (memory-mapped), _id is read for the matching rows
+def _exported_since(path, parts, since):
+    table = _read_parts(path, parts, ["updated_at"])
+    recent = table.filter(pc.greater_equal(table["updated_at"], pa.scalar(since, pa.timestamp("ms"))))
+    return set(zip(recent["_id"].to_pylist(), recent["updated_at"].to_pylist()))
+
+# ✅ Export "unique" (everything the first time, then only profiles changed since the
+# watermark). `overlap_seconds` re-reads a short window before the watermark so writes
+# that were in flight, or stamped by a slightly skewed clock, are not missed; rows of
+# that window that are already in a part are skipped, so an export without changes
+# writes no part.
+def export_snapshot(unique_collection, path, chunk_size=50000, overlap_seconds=60, max_parts=20):
+    os.makedirs(path, exist_ok=True)
+    manifest = read_manifest(path)
+
+    query, exported = {}, frozenset()
+    if manifest["watermark"]:
+        since = datetime.fromisoformat(manifest["watermark"]) - timedelta(seconds=overlap_seconds)
+        query = {"updated_at": {"$gte": since}}
+        exported = _exported_since(path, manifest["parts"], since)
+
+    part_name = f"part-{manifest['next_part']:05d}.arrow"
+    part_path = os.path.join(path, part_name)
+    cursor = unique_collection.find(query, {"segments": 0}, batch_size=chunk_size).sort("_id", ASCENDING)
+    rows, watermark = _write_part(part_path, cursor, chunk_size, exported)
+
+    if not rows:
+        os.remove(part_path)
+        return 0
+
+    manifest["parts"].append(part_name)
+    manifest["next_part"] += 1
+    if watermark and (not manifest["watermark"] or watermark > datetime.fromisoformat(manifest["watermark"])):
+        manifest["watermark"] = watermark.isoformat()
+    write_manifest(path, manifest)
+
+    if len(manifest["parts"]) > max_parts:
+        compact_snapshot(path)
+    return rows
+
+# ✅ Memory-map every part and read only `columns` (plus _id for de-duplication)
+def _read_parts(path, parts, columns):
+    names = None if columns is None else ["_id"] + [name for name in columns if name != "_id"]
+    tables = []
+    for part in parts:
+        # Zero-copy read: the table's buffers point into the mapped file
+        table = pa.ipc.open_file(pa.memory_map(os.path.join(path, part), "r")).read_all()
+        tables.append(table if names is None else table.select(names))
+    if not tables:
+        return SCHEMA.empty_table() if names is None else SCHEMA.empty_table().select(names)
+    return pa.concat_tables(tables)
+
+# ✅ Latest row per profile as a DataFrame with flattened column names
+def load_snapshot(path, columns=None):
+    manifest = read_manifest(path)
+    df = _read_parts(path, manifest["parts"], columns).to_pandas()
+    if len(manifest["parts"]) > 1:
+        df = df.drop_duplicates("_id", keep="last").reset_index(drop=True)
+    return df if columns is None or "_id" in columns else df.drop(columns="_id")
+
+# ✅ Merge all parts into one de-duplicated part
+def compact_snapshot(path):
+    manifest = read_manifest(path)
+    if len(manifest["parts"]) <= 1:
+        return
+
+    table = pa.Table.from_pandas(load_snapshot(path), schema=SCHEMA, preserve_index=False)
+    part_name = f"part-{manifest['next_part']:05d}.arrow"
+    with pa.OSFile(os.path.join(path, part_name), "wb") as sink, pa.ipc.new_file(sink, SCHEMA) as writer:
+        writer.write_table(table)
+
+    old_parts = manifest["parts"]
+    manifest["parts"] = [part_name]
+    manifest["next_part"] += 1
+    write_manifest(path, manifest)
+    for part in old_parts:
+        os.remove(os.path.join(path, part))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export 'unique' to an incremental columnar snapshot")
+    parser.add_argument("--uri", help="Overrides MONGO_URI / the configured URI (connection.py)")
+    parser.add_argument("--path", default="snapshots/unique")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--compact", action="store_true", help="Merge all parts into one file after exporting")
+    args = parser.parse_args()
+
+    settings = cli_settings(args.uri)
+    unique_collection = configure_collection(create_client(settings)[settings["database"]], "unique", settings)
+    rows = export_snapshot(unique_collection, args.path, args.chunk_size)
+    print(f"✅ Exported {rows} changed profiles to {args.path}")
+    if args.compact:
+        compact_snapshot(args.path)
+        print("✅ Snapshot compacted")
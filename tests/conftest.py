@@ -0,0 +1,23 @@
+import os
+import sys
+
+# The modules live at the repository root (no package), so make them importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from mongomock.collection import BulkOperationBuilder
+except ImportError:
+    BulkOperationBuilder = None
+
+# ✅ mongomock's bulk builder predates the `sort` argument that pymongo (>= 4.10) passes
+# for UpdateOne / ReplaceOne; the ops used here never set it, so drop it when unset
+def _accept_unset_sort(method):
+    def wrapper(self, *args, sort=None, **kwargs):
+        if sort is not None:
+            raise NotImplementedError("mongomock bulk writes do not support sort")
+        return method(self, *args, **kwargs)
+    return wrapper
+
+if BulkOperationBuilder is not None:
+    BulkOperationBuilder.add_update = _accept_unset_sort(BulkOperationBuilder.add_update)
+    BulkOperationBuilder.add_replace = _accept_unset_sort(BulkOperationBuilder.add_replace)
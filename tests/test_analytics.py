@@ -0,0 +1,49 @@
+import mongomock
+import pandas as pd
+import pytest
+from analytics import COUNTRY, INCOME, INTERESTS, UNKNOWN, country_counts, income_by_interest, income_counts, interest_counts, load_frame
+
+PROFILES = [
+    {"location": {"country": "US"}, "demographics": {"income": "High", "age": 30}, "interests": ["Tech", "Sports"]},
+    {"location": {"country": "US"}, "demographics": {"income": "Low", "age": 41}, "interests": ["Tech"]},
+    {"location": {"country": "FR"}, "demographics": {"age": 25}, "interests": ["Tech"]},
+    {"demographics": {"income": "High"}, "interests": []},
+]
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient().db.unique
+    collection.insert_many([{"data": profile} for profile in PROFILES])
+    return collection
+
+# ✅ {value: count} of a count_by frame
+def as_dict(frame, *names):
+    return {tuple(row[name] for name in names) if len(names) > 1 else row[names[0]]: row["count"]
+            for row in frame.to_dict("records")}
+
+# The aggregations match what Marketing_Model computed with json_normalize + value_counts
+def test_counts_match_pandas(collection):
+    frame = pd.json_normalize([{"data": profile} for profile in PROFILES])
+
+    assert as_dict(country_counts(collection), "country") == frame[COUNTRY].value_counts().to_dict()
+    assert as_dict(interest_counts(collection), "interests") == frame[INTERESTS].explode().value_counts().to_dict()
+    assert as_dict(income_counts(collection), "income") == frame[INCOME].fillna(UNKNOWN).value_counts().to_dict()
+
+def test_income_by_interest(collection):
+    assert as_dict(income_by_interest(collection), "interests", "income") == {
+        ("Tech", "High"): 1, ("Tech", "Low"): 1, ("Tech", UNKNOWN): 1, ("Sports", "High"): 1,
+    }
+    assert country_counts(collection, query={"data.demographics.income": "High"})["country"].tolist() == ["US"]
+
+def test_empty_collection():
+    collection = mongomock.MongoClient().db.unique
+    assert country_counts(collection).empty
+    assert load_frame(collection, [COUNTRY]).columns.tolist() == [COUNTRY]
+
+# Chunks are concatenated in order, and fields missing from a whole chunk are still columns
+def test_load_frame_in_chunks(collection):
+    frame = load_frame(collection, [COUNTRY, INCOME], chunk_size=3)
+    assert frame.columns.tolist() == [COUNTRY, INCOME]
+    assert frame[COUNTRY].tolist()[:3] == ["US", "US", "FR"]
+    assert frame[COUNTRY].isna().tolist() == [False, False, False, True]
+    assert frame[INCOME].isna().sum() == 1
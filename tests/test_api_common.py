@@ -0,0 +1,83 @@
+import json
+import mongomock
+import pytest
+from fastapi import HTTPException
+from api_common import (
+    MAX_BATCH_ITEMS, build_page, cohort_stats_pipeline, decode_continuation_token, format_cohort_stats, parse_batch_body,
+)
+
+# ✅ Every page of a collection, following the continuation tokens like /api/cohort/user
+def fetch_pages(collection, page_size):
+    pages, after = [], None
+    while True:
+        query = {"_id": {"$gt": decode_continuation_token(after)}} if after else {}
+        docs = list(collection.find(query, {"data": 1}).sort("_id", 1).limit(page_size + 1))
+        page = json.loads(build_page(docs, page_size).body)
+        pages.append(page["users"])
+        after = page["next"]
+        if after is None:
+            return pages
+
+def test_pages_cover_the_collection_once():
+    collection = mongomock.MongoClient().db.cohort
+    collection.insert_many([{"data": {"cookie": f"c{i}"}} for i in range(5)])
+
+    pages = fetch_pages(collection, 2)
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [user["data"]["cookie"] for page in pages for user in page] == [f"c{i}" for i in range(5)]
+    assert all("_id" not in user for page in pages for user in page)
+
+# An exact multiple of the page size ends without an empty trailing page
+def test_last_full_page_has_no_token():
+    collection = mongomock.MongoClient().db.cohort
+    collection.insert_many([{"data": {"cookie": f"c{i}"}} for i in range(4)])
+
+    assert [len(page) for page in fetch_pages(collection, 2)] == [2, 2]
+
+def test_invalid_token():
+    with pytest.raises(HTTPException) as exc:
+        decode_continuation_token("not-an-object-id")
+    assert exc.value.status_code == 400
+
+def profile(country, gender, age=None, interests=()):
+    demographics = {"gender": gender, "income": "High", "education": "BSc"}
+    if age is not None:
+        demographics["age"] = age
+    return {"data": {"location": {"country": country}, "demographics": demographics, "interests": list(interests)}}
+
+def test_cohort_stats():
+    collection = mongomock.MongoClient().db.unique
+    collection.insert_many([
+        profile("US", "F", 30, ["Tech", "Sports"]),
+        profile("US", "M", 70, ["Tech"]),
+        profile("US", "F"),
+        profile("FR", "F", 30, ["Tech"]),
+    ])
+
+    result = next(collection.aggregate(cohort_stats_pipeline({"data.location.country": "US"})))
+    stats = format_cohort_stats(result)
+    assert stats["total"] == 3
+    assert stats["country"] == [{"value": "US", "count": 3}]
+    assert stats["gender"] == [{"value": "F", "count": 2}, {"value": "M", "count": 1}]
+    assert stats["interests"] == [{"value": "Tech", "count": 2}, {"value": "Sports", "count": 1}]
+    assert sorted(stats["age"], key=lambda group: group["value"]) == [
+        {"value": "25-34", "count": 1}, {"value": "65+", "count": 1}, {"value": "Unknown", "count": 1},
+    ]
+
+def test_cohort_stats_no_match():
+    collection = mongomock.MongoClient().db.unique
+    result = next(collection.aggregate(cohort_stats_pipeline({"data.location.country": "US"})))
+    stats = format_cohort_stats(result)
+    assert stats["total"] == 0
+    assert stats["country"] == [] and stats["age"] == []
+
+@pytest.mark.parametrize("content_type, separator", [("application/json", ","), ("application/x-ndjson", "\n")])
+def test_batch_size_limit(content_type, separator):
+    def body(count):
+        items = separator.join(json.dumps({"data": {"cookie": f"c{i}"}}) for i in range(count))
+        return ("[" + items + "]" if separator == "," else items).encode()
+
+    assert len(parse_batch_body(body(MAX_BATCH_ITEMS), content_type)) == MAX_BATCH_ITEMS
+    with pytest.raises(HTTPException) as exc:
+        parse_batch_body(body(MAX_BATCH_ITEMS + 1), content_type)
+    assert exc.value.status_code == 413
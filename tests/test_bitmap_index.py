@@ -0,0 +1,65 @@
+import mongomock
+from bitmap_index import WORD_BITS, BitmapIndex
+
+def profile(cookie, country="USA", gender="Female", age=30, interests=("Tech",)):
+    return {"cookie": cookie, "location": {"country": country},
+            "demographics": {"gender": gender, "age": age}, "interests": list(interests)}
+
+# New profiles past the first bitsets' capacity grow every bitset and keep earlier bits
+def test_grows_past_word_boundary():
+    index = BitmapIndex()
+    index.build(mongomock.MongoClient().db.unique)
+    capacity = index._words * WORD_BITS
+    for number in range(capacity + 1):
+        index.apply_change(None, profile(f"c{number}", gender="Male" if number % 2 else "Female"))
+
+    assert index._words > 1 and len(index) == capacity + 1
+    assert index.count(["country:USA"]) == capacity + 1
+    assert index.count(["gender:Female"]) == capacity // 2 + 1
+    assert index.count(exclude=["gender:Female"]) == capacity // 2
+
+# A profile leaving a segment clears its bit; the ordinal follows an email merge's new cookie
+def test_change_clears_old_membership():
+    index = BitmapIndex()
+    unique = mongomock.MongoClient().db.unique
+    unique.insert_many([{"data": profile("c1")}, {"data": profile("c2", country="India")}])
+    assert index.build(unique) == 2
+
+    before = profile("c1")
+    after = profile("c9", country="India", age=50, interests=())
+    index.apply_change(before, after)
+
+    assert len(index) == 2
+    assert index.count(["country:USA"]) == 0
+    assert index.count(["country:India"]) == 2
+    assert index.count(["interests:Tech"]) == 1
+    assert index.count(["age:45-54"]) == 1 and index.count(["age:25-34"]) == 1
+
+# include AND any AND NOT exclude
+def test_count_intersection():
+    index = BitmapIndex()
+    index.build(mongomock.MongoClient().db.unique)
+    index.apply_changes([
+        (None, profile("c1", interests=("Tech", "Gaming"))),
+        (None, profile("c2", gender="Male", interests=("Tech",))),
+        (None, profile("c3", country="India", interests=("Gaming",))),
+        (None, profile("c4", interests=("Travel",))),
+    ])
+
+    assert index.count(["country:USA", "interests:Tech"]) == 2
+    assert index.count(["country:USA", "interests:Tech"], exclude=["gender:Male"]) == 1
+    assert index.count(any_of=["interests:Gaming", "interests:Travel"]) == 3
+    assert index.count(["country:USA"], any_of=["interests:Gaming", "interests:Travel"]) == 2
+    assert index.count(["country:Unknown"]) == 0
+
+# Own writes keep the index current; a gap in the shared version means another writer
+def test_behind_another_writer():
+    index = BitmapIndex()
+    index.build(mongomock.MongoClient().db.unique, shared_version=3)
+    assert index.check_due(0) and not index.check_due(60)
+
+    index.record_write(4)
+    assert not index.behind(4)
+    assert index.behind(5)
+    index.record_write(7)
+    assert index.behind(7)
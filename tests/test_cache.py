@@ -0,0 +1,152 @@
+import mongomock
+import pytest
+import cache
+from cache import (
+    VERSIONS_COLLECTION,
+    LRUTTLCache,
+    VersionedResultCache,
+    bump_write_version,
+    read_write_version,
+)
+
+# ✅ Controllable time.monotonic for TTL and check-interval tests
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    return clock
+
+# A load that started before an invalidation is not cached (it may hold the pre-write profile)
+def test_load_racing_an_invalidation_is_discarded():
+    users = LRUTTLCache()
+    epoch = users.epoch
+    users.invalidate([("email", "a@example.com")])
+
+    assert not users.set(("email", "a@example.com"), b"old profile", 1, epoch)
+    assert users.get(("email", "a@example.com")) is None
+    assert users.set(("email", "a@example.com"), b"new profile", 1, users.epoch)
+
+# The least recently used key is evicted first
+def test_lru_eviction():
+    users = LRUTTLCache(maxsize=2)
+    users.set("a", b"a", 1, users.epoch)
+    users.set("b", b"b", 2, users.epoch)
+    users.get("a")
+    users.set("c", b"c", 3, users.epoch)
+
+    assert users.get("b") is None
+    assert users.get("a") == b"a" and users.get("c") == b"c"
+    assert users.stats()["evictions"] == 1
+
+def test_ttl_expiry(clock):
+    users = LRUTTLCache(ttl=60)
+    users.set("a", b"a", 1, users.epoch)
+    clock.now += 59
+    assert users.get("a") == b"a"
+    clock.now += 2
+    assert users.get("a") is None
+    assert users.stats()["expirations"] == 1
+
+# Invalidating a profile's new keys also drops the keys it was cached under before
+# (e.g. its old email after an email change)
+def test_invalidate_drops_every_key_of_the_profile():
+    users = LRUTTLCache()
+    users.set(("email", "old@example.com"), b"profile", 1, users.epoch)
+    users.set(("cookie", "c1"), b"profile", 1, users.epoch)
+    users.set(("cookie", "c2"), b"other", 2, users.epoch)
+
+    users.invalidate([("cookie", "c1"), ("email", "new@example.com")])
+    assert users.get(("email", "old@example.com")) is None
+    assert users.get(("cookie", "c2")) == b"other"
+
+    users.invalidate(profile_ids=[2])
+    assert users.get(("cookie", "c2")) is None
+
+# Another process's write (a shared version this process did not record) drops everything
+def test_shared_version_from_another_writer(clock):
+    users = LRUTTLCache(check_interval=1)
+    users.observe(5)
+    users.set("a", b"a", 1, users.epoch)
+
+    users.record_write(6)  # This process's own write
+    assert users.get("a") == b"a"
+    assert not users.check_due()
+    clock.now += 1
+    assert users.check_due()
+    users.observe(6)
+    assert users.get("a") == b"a"
+
+    users.observe(7)  # Written elsewhere
+    assert users.get("a") is None
+    users.set("a", b"a", 1, users.epoch)
+    users.record_write(9)  # 8 was written elsewhere
+    assert users.get("a") is None
+
+# ✅ Process-level view of a cohort cache over a shared cache_versions collection
+# (what server.py does per request)
+class CohortProcess:
+    def __init__(self, versions_collection, **options):
+        self.versions_collection = versions_collection
+        self.cache = VersionedResultCache(check_interval=0, **options)
+
+    def lookup(self, key):
+        if self.cache.check_due():
+            self.cache.observe(read_write_version(self.versions_collection, "cohort"))
+        return self.cache.get(key)
+
+    def store(self, key, body):
+        return self.cache.set(key, body, self.cache.version, len(body))
+
+    def write(self, affected=None):
+        self.cache.record_write(affected, bump_write_version(self.versions_collection, "cohort"))
+
+PAGE = ("page", (("country", "USA"),))
+OTHER_PAGE = ("page", (("country", "India"),))
+
+# A page cached by one process is dropped once another process bumps the shared version
+def test_cohort_page_dropped_after_write_elsewhere():
+    versions = mongomock.MongoClient().db[VERSIONS_COLLECTION]
+    first, second = CohortProcess(versions), CohortProcess(versions)
+    assert first.lookup(PAGE) is None and second.lookup(PAGE) is None
+    first.store(PAGE, b"[usa]")
+    assert first.lookup(PAGE) == b"[usa]"
+
+    second.write()
+    assert first.lookup(PAGE) is None
+    assert first.cache.stats()["invalidations"] == 1
+
+# A process's own write only drops the entries it affects; the rest move to the new version
+def test_own_write_keeps_unaffected_pages():
+    versions = mongomock.MongoClient().db[VERSIONS_COLLECTION]
+    process = CohortProcess(versions)
+    process.lookup(PAGE)
+    process.store(PAGE, b"[usa]")
+    process.store(OTHER_PAGE, b"[india]")
+
+    process.write(affected=lambda key: key == PAGE)
+    assert process.lookup(PAGE) is None
+    assert process.lookup(OTHER_PAGE) == b"[india]"
+
+    # A result computed before the write is not stored
+    stale_version = process.cache.version - 1
+    assert not process.cache.set(PAGE, b"[old usa]", stale_version, 9)
+
+# Entries are evicted least recently used first once their sizes exceed the byte budget
+def test_byte_budget_eviction():
+    results = VersionedResultCache(max_bytes=10)
+    results.set("a", b"aaaa", results.version, 4)
+    results.set("b", b"bbbb", results.version, 4)
+    results.get("a")
+    results.set("c", b"cccc", results.version, 4)
+
+    assert results.get("b") is None
+    assert results.get("a") == b"aaaa" and results.get("c") == b"cccc"
+    assert results.stats()["bytes"] == 8 and results.stats()["evictions"] == 1
+    assert not results.set("d", b"d" * 11, results.version, 11)  # Larger than the whole budget
@@ -0,0 +1,34 @@
+import mongomock
+import pytest
+from clustering import fit_clusters, predict_profiles
+
+def profile(age, income, education, interests=None):
+    data = {"demographics": {"age": age, "income": income, "education": education}}
+    if interests is not None:
+        data["interests"] = interests
+    return {"data": data}
+
+@pytest.fixture
+def unique_collection():
+    collection = mongomock.MongoClient().db.unique
+    collection.insert_many([
+        profile(22, "Under $25,000", "High School", ["Sports", "Movies"]),
+        profile(35, "$50,000-$74,999", "Bachelor's Degree", ["Tech"]),
+        profile(48, "$100,000-$149,999", "Master's Degree", ["Finance", "Tech"]),
+        profile(61, "$150,000+", "Doctorate"),
+    ])
+    return collection
+
+def test_predict_profile_without_interests(unique_collection):
+    bundle = fit_clusters(unique_collection, n_clusters=2, chunk_size=2)
+
+    clusters = predict_profiles(bundle, [profile(30, "$25,000-$49,999", "Some College")["data"]])
+    assert len(clusters) == 1 and clusters[0] in (0, 1)
+    assert len(predict_profiles(bundle, [{"demographics": {"age": 40}}, {}])) == 2
+
+# A chunk in which no profile has interests is encoded like any other chunk
+def test_fit_chunk_without_interests(unique_collection):
+    unique_collection.insert_many([profile(70, "$150,000+", "Doctorate") for _ in range(2)])
+    bundle = fit_clusters(unique_collection, n_clusters=2, chunk_size=2, query={"data.interests": {"$exists": False}})
+    assert bundle["vocabulary"] == []
+    assert len(predict_profiles(bundle, [profile(25, "Under $25,000", "High School", ["Tech"])["data"]])) == 1
@@ -0,0 +1,20 @@
+import numpy as np
+import pandas as pd
+from cohort_assignment import OTHER, assign_cohorts, cohort_counts, cohort_membership, explode_interests
+
+def test_mixed_interest_values():
+    interests = pd.Series([["Tech", "Crypto"], "football, movies", None, ["gardening"]])
+    assert assign_cohorts(interests).tolist() == [["Tech", "Finance"], ["Sports", "Movies"], [OTHER], [OTHER]]
+    assert assign_cohorts(interests, multi_label=False).tolist() == ["Tech", "Sports", OTHER, OTHER]
+
+# A CSV chunk whose interests column is empty is read as all-NaN float64
+def test_all_missing_interests():
+    interests = pd.Series([np.nan, np.nan], index=[10, 11])
+
+    assert explode_interests(interests).empty
+    assert assign_cohorts(interests).tolist() == [[OTHER], [OTHER]]
+    assert assign_cohorts(interests, multi_label=False).tolist() == [OTHER, OTHER]
+    membership = cohort_membership(interests)
+    assert membership.index.tolist() == [10, 11]
+    assert membership[OTHER].all()
+    assert cohort_counts(interests)[OTHER] == 2
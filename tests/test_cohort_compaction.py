@@ -0,0 +1,47 @@
+import mongomock
+from bson import ObjectId
+from cache import VERSIONS_COLLECTION, read_write_version
+from cohort_compaction import compact_cohort
+
+def copy(email, cookie, city):
+    return {"_id": ObjectId(), "data": {"email": email, "cookie": cookie, "city": city}}
+
+def test_compaction_folds_copies_per_identity():
+    db = mongomock.MongoClient().db
+    owner = db.unique.insert_one({"data": {"email": "a@x.com", "cookie": "a2"}}).inserted_id
+    db.cohort.insert_many([
+        copy("a@x.com", "a1", "Paris"), copy("b@x.com", "b1", "Lyon"),
+        copy("a@x.com", "a2", "Nice"), copy("b@x.com", "b2", "Lille"), copy("a@x.com", "a3", "Rome"),
+    ])
+
+    assert compact_cohort(db.cohort, db.unique, batch_size=1, history_limit=2) == (2, 3)
+    assert db.cohort.count_documents({}) == 2
+
+    folded = db.cohort.find_one({"_id": owner})
+    assert folded["data"]["city"] == "Rome"
+    assert folded["merges"] == 3
+    assert [entry["cookie"] for entry in folded["history"]] == ["a2", "a3"]
+    # The orphaned email (no unique profile) keeps its latest copy
+    orphan = db.cohort.find_one({"data.email": "b@x.com"})
+    assert orphan["data"]["city"] == "Lille" and orphan["merges"] == 2
+    assert read_write_version(db[VERSIONS_COLLECTION], "cohort") == 1
+
+# A document written by the new merge path keeps its profile; older copies add to its count
+def test_compaction_into_current_document():
+    db = mongomock.MongoClient().db
+    owner = db.unique.insert_one({"data": {"email": "a@x.com"}}).inserted_id
+    db.cohort.insert_many([copy("a@x.com", "a1", "Paris"), copy("a@x.com", "a2", "Nice")])
+    db.cohort.insert_one({"_id": owner, "data": {"email": "a@x.com", "city": "Oslo"}, "merges": 1,
+                          "history": [{"cookie": "a3"}]})
+
+    assert compact_cohort(db.cohort, db.unique) == (1, 1)
+    assert db.cohort.count_documents({}) == 1
+    current = db.cohort.find_one({"_id": owner})
+    assert current["data"]["city"] == "Oslo"
+    assert current["merges"] == 3
+    assert [entry["cookie"] for entry in current["history"]] == ["a1", "a2", "a3"]
+
+def test_nothing_to_compact():
+    db = mongomock.MongoClient().db
+    assert compact_cohort(db.cohort, db.unique) == (0, 0)
+    assert read_write_version(db[VERSIONS_COLLECTION], "cohort") == 0
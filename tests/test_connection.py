@@ -0,0 +1,19 @@
+from connection import cli_settings, client_options, load_settings
+
+def test_environment_overrides_defaults(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # No mongo_config.json
+    settings = load_settings(environ={"MONGO_MAX_POOL_SIZE": "7", "MONGO_WRITE_CONCERN_USERS": "0"})
+    assert client_options(settings)["maxPoolSize"] == 7
+    assert settings["collections"]["users"]["write_concern"] == {"w": 0}
+
+# Scripts keep the configured pool, timeouts and write concerns; --uri only replaces the URI
+def test_cli_uri_only_overrides_the_uri(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MONGO_URI", "mongodb://configured:27017/")
+    monkeypatch.setenv("MONGO_SOCKET_TIMEOUT_MS", "5000")
+
+    assert cli_settings()["uri"] == "mongodb://configured:27017/"
+    settings = cli_settings("mongodb://other:27017/")
+    assert settings["uri"] == "mongodb://other:27017/"
+    assert client_options(settings)["socketTimeoutMS"] == 5000
+    assert settings["collections"]["unique"]["write_concern"] == {"w": "majority"}
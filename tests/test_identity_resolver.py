@@ -0,0 +1,77 @@
+import asyncio
+import mongomock
+from identity_resolver import (
+    apply_identity_batch,
+    apply_identity_batch_async,
+    CONFLICT,
+    EMAIL_MERGED,
+    INSERTED,
+    UPDATED,
+)
+
+# ✅ Awaitable view of a mongomock collection (the calls apply_identity_batch_async makes)
+class AsyncCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    @property
+    def database(self):
+        return AsyncDatabase(self._collection.database)
+
+    def find(self, *args, **kwargs):
+        docs = list(self._collection.find(*args, **kwargs))
+
+        class Cursor:
+            async def to_list(self, length=None):
+                return docs
+        return Cursor()
+
+    async def bulk_write(self, *args, **kwargs):
+        return self._collection.bulk_write(*args, **kwargs)
+
+    async def find_one_and_update(self, *args, **kwargs):
+        return self._collection.find_one_and_update(*args, **kwargs)
+
+class AsyncDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return AsyncCollection(self._database[name])
+
+def new_database():
+    db = mongomock.MongoClient().db
+    db.unique.create_index("data.cookie", unique=True)
+    db.unique.create_index("data.email", unique=True)
+    db.unique.insert_one({"data": {"cookie": "c0", "email": "old@example.com", "created_at": "then"}})
+    return db
+
+RECORDS = [
+    {"data": {"cookie": "c1", "email": "a@example.com", "interests": ["Tech"]}},
+    {"data": {"cookie": "c2", "email": "a@example.com", "created_at": "now"}},     # In-batch email merge
+    {"data": {"cookie": "c9", "email": "old@example.com", "created_at": "now"}},   # Stored email merge
+    {"data": {"cookie": "c2", "email": "b@example.com"}},                          # Cookie update
+    {"data": {"cookie": "c9", "email": "b@example.com"}},                          # Email owned by another profile
+]
+
+def snapshot(db):
+    unique = sorted(({**doc["data"], "segments": doc["segments"]} for doc in db.unique.find()), key=lambda data: data["cookie"])
+    cohort = sorted(((doc["data"], doc["merges"]) for doc in db.cohort.find()), key=lambda item: item[0]["cookie"])
+    segments = sorted((doc["_id"], doc["size"]) for doc in db.segments.find())
+    return unique, cohort, segments, db.cache_versions.find_one({"_id": "cohort"})["version"]
+
+# Both servers write batches through the same resolution rounds
+def test_sync_and_async_batches_match():
+    sync_db, async_db = new_database(), new_database()
+
+    outcomes, updated_ids, changes = apply_identity_batch(sync_db.unique, sync_db.cohort, RECORDS, True)
+    async_outcomes, async_updated_ids, async_changes = asyncio.run(apply_identity_batch_async(
+        AsyncCollection(async_db.unique), AsyncCollection(async_db.cohort), RECORDS, True
+    ))
+
+    assert outcomes == [INSERTED, EMAIL_MERGED, EMAIL_MERGED, UPDATED, CONFLICT]
+    assert async_outcomes == outcomes
+    assert len(async_updated_ids) == len(updated_ids) == 1
+    assert async_changes == changes
+    assert snapshot(async_db) == snapshot(sync_db)
+    assert sync_db.unique.find_one({"data.cookie": "c9"})["data"]["created_at"] == "then"
@@ -0,0 +1,42 @@
+from indexes import INDEXES, check_query_plans, page_queries
+
+# ✅ Every keyset page query with a filter has an index led by one of its equality
+# fields and ending with _id (the page's sort key)
+def test_page_queries_have_an_id_ordered_index():
+    id_indexes = {tuple(field for field, _ in keys) for keys, _ in INDEXES["cohort"] if keys[-1][0] == "_id"}
+    for label, _, query in page_queries():
+        equality = {field for field, value in query.items() if not isinstance(value, dict) or "$in" in value}
+        if query:
+            assert any(len(keys) == 2 and keys[0] in equality for keys in id_indexes), label
+
+# ✅ Cursor / collection stand-ins returning a canned winning plan from explain()
+class Cursor:
+    def __init__(self, plan):
+        self.plan = plan
+
+    def sort(self, *args):
+        return Cursor(self.sorted_plan)
+
+    def limit(self, count):
+        return self
+
+    def explain(self):
+        return {"queryPlanner": {"winningPlan": self.plan}}
+
+class Collection:
+    def __init__(self, sorted_plan):
+        self.sorted_plan = sorted_plan
+
+    def find(self, query):
+        cursor = Cursor({"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}})
+        cursor.sorted_plan = self.sorted_plan
+        return cursor
+
+def test_check_query_plans_reports_in_memory_sorts(capsys):
+    indexed = {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "keyPattern": {"_id": 1}}}}
+    assert check_query_plans({"unique": Collection(indexed), "cohort": Collection(indexed)}) == []
+
+    blocking = {"stage": "SORT", "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}
+    problems = check_query_plans({"unique": Collection(indexed), "cohort": Collection(blocking)})
+    assert [label for label, _ in problems] == [label for label, _, _ in page_queries()]
+    assert "In-memory SORT" in capsys.readouterr().out
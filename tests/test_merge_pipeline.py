@@ -0,0 +1,76 @@
+from datetime import datetime
+import pytest
+from fastapi import HTTPException
+import server
+from identity_resolver import EMAIL_MERGED, INSERTED, UPDATED, classify_merge, merge_filter, merge_pipeline
+from indexes import ensure_indexes
+
+# The $or upsert pipeline runs server-side (mongomock cannot evaluate it), so these tests
+# start a throwaway mongod with pymongo_inmemory and are skipped where none can be started
+# (it downloads the mongod binary on first use)
+pymongo_inmemory = pytest.importorskip("pymongo_inmemory")
+
+@pytest.fixture(scope="module")
+def client():
+    try:
+        client = pymongo_inmemory.MongoClient()
+        client.admin.command("ping")
+    except Exception as exc:
+        pytest.skip(f"pymongo_inmemory could not start a mongod: {exc}")
+    yield client
+    client.close()
+
+@pytest.fixture
+def db(client, monkeypatch):
+    client.drop_database("merge_pipeline_test")
+    db = client["merge_pipeline_test"]
+    ensure_indexes(db)
+    monkeypatch.setattr(server, "unique_collection", db.unique)
+    monkeypatch.setattr(server, "versions_collection", db.cache_versions)
+    return db
+
+def merge(db, data, keep_created_at_on_email_merge=True):
+    before = db.unique.find_one_and_update(
+        merge_filter(data), merge_pipeline(data, keep_created_at_on_email_merge), upsert=True
+    )
+    return classify_merge(before, data, keep_created_at_on_email_merge)
+
+def stored(db, **query):
+    return db.unique.find_one({f"data.{field}": value for field, value in query.items()}, {"_id": 0})
+
+# Cookie match: new fields merge over the stored profile; a payload that changes
+# nothing keeps updated_at
+def test_cookie_match_merges_fields(db):
+    assert merge(db, {"cookie": "c1", "email": "a@example.com", "city": "Austin"})[0] == INSERTED
+    outcome, merged = merge(db, {"cookie": "c1", "email": "a@example.com", "age": 30})
+
+    assert outcome == UPDATED
+    assert stored(db, cookie="c1")["data"] == merged == {"cookie": "c1", "email": "a@example.com", "city": "Austin", "age": 30}
+    assert db.unique.count_documents({}) == 1
+
+    updated_at = stored(db, cookie="c1")["updated_at"]
+    merge(db, {"cookie": "c1", "email": "a@example.com", "age": 30})
+    assert stored(db, cookie="c1")["updated_at"] == updated_at
+
+# Email match with a new cookie: the profile takes the cookie and keeps its created_at
+def test_email_merge_keeps_created_at(db):
+    first_seen, later = datetime(2024, 1, 2, 10, 0), datetime(2024, 6, 1, 9, 0)
+    merge(db, {"cookie": "c1", "email": "a@example.com", "created_at": first_seen})
+    outcome, merged = merge(db, {"cookie": "c2", "email": "a@example.com", "created_at": later, "age": 41})
+
+    assert outcome == EMAIL_MERGED
+    profile = stored(db, email="a@example.com")["data"]
+    assert profile == merged == {"cookie": "c2", "email": "a@example.com", "created_at": first_seen, "age": 41}
+    assert stored(db, cookie="c1") is None
+
+# A cookie whose new email belongs to another profile is rejected with 409 by the
+# server's merge (after retrying once), and neither profile changes
+def test_conflict_returns_409(db):
+    server.merge_into_unique({"cookie": "c1", "email": "a@example.com"})
+    server.merge_into_unique({"cookie": "c2", "email": "b@example.com"})
+
+    with pytest.raises(HTTPException) as exc:
+        server.merge_into_unique({"cookie": "c1", "email": "b@example.com"})
+    assert exc.value.status_code == 409
+    assert stored(db, cookie="c1")["data"]["email"] == "a@example.com"
+    assert stored(db, cookie="c2")["data"]["email"] == "b@example.com"
@@ -0,0 +1,73 @@
+import asyncio
+from types import SimpleNamespace
+from metrics import CommandMetrics, Counter, Gauge, Histogram, MetricsMiddleware, Registry
+
+def test_render_counter_and_gauge():
+    registry = Registry()
+    counter = registry.register(Counter("ingest_outcomes_total", "Ingested records", ("outcome",)))
+    registry.register(Gauge("queue_pending", "Pending payloads", lambda: 3))
+    registry.register(Gauge("cache_entries", "Entries", lambda: {("user",): 2}, ("cache",)))
+    counter.inc("inserted")
+    counter.inc("inserted", amount=2)
+    counter.inc("updated")
+
+    assert registry.render() == (
+        "# HELP ingest_outcomes_total Ingested records\n"
+        "# TYPE ingest_outcomes_total counter\n"
+        'ingest_outcomes_total{outcome="inserted"} 3\n'
+        'ingest_outcomes_total{outcome="updated"} 1\n'
+        "# HELP queue_pending Pending payloads\n"
+        "# TYPE queue_pending gauge\n"
+        "queue_pending 3\n"
+        "# HELP cache_entries Entries\n"
+        "# TYPE cache_entries gauge\n"
+        'cache_entries{cache="user"} 2\n'
+    )
+
+# Buckets are cumulative, values above the last bound only count in +Inf
+def test_histogram_buckets():
+    histogram = Histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, "merge")
+
+    assert histogram.samples() == [
+        ("latency_seconds_bucket", '{stage="merge",le="0.1"}', 2),
+        ("latency_seconds_bucket", '{stage="merge",le="1.0"}', 3),
+        ("latency_seconds_bucket", '{stage="merge",le="+Inf"}', 4),
+        ("latency_seconds_sum", '{stage="merge"}', 3.65),
+        ("latency_seconds_count", '{stage="merge"}', 4),
+    ]
+
+def test_command_metrics():
+    registry = Registry()
+    commands = CommandMetrics(registry)
+    started = dict(connection_id=("localhost", 27017), command_name="find")
+    commands.started(SimpleNamespace(request_id=1, command={"find": "unique"}, **started))
+    commands.started(SimpleNamespace(request_id=2, command={"find": "cohort"}, **started))
+    commands.succeeded(SimpleNamespace(request_id=1, duration_micros=2000, **started))
+    commands.failed(SimpleNamespace(request_id=2, duration_micros=500, **started))
+
+    text = registry.render()
+    assert 'mongo_command_duration_seconds_count{command="find",collection="unique"} 1' in text
+    assert 'mongo_command_duration_seconds_count{command="find",collection="cohort"} 1' in text
+    assert 'mongo_command_failures_total{command="find",collection="cohort"} 1' in text
+
+# Requests are labelled with the route template, not the raw path
+def test_middleware_labels():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 404})
+
+    async def send(message):
+        pass
+
+    histogram = Histogram("http_request_duration_seconds", "Latency", ("method", "path", "status"))
+    middleware = MetricsMiddleware(app, histogram)
+    route = SimpleNamespace(path="/api/user/{cookie}")
+    asyncio.run(middleware({"type": "http", "method": "GET", "route": route}, None, send))
+    asyncio.run(middleware({"type": "http", "method": "GET"}, None, send))
+
+    counts = {labels: value for name, labels, value in histogram.samples() if name.endswith("_count")}
+    assert counts == {
+        '{method="GET",path="/api/user/{cookie}",status="404"}': 1,
+        '{method="GET",path="unmatched",status="404"}': 1,
+    }
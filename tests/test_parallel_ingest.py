@@ -0,0 +1,75 @@
+import os
+import pickle
+import mongomock
+import numpy as np
+import parallel_ingest
+from identity_resolver import apply_identity_batch
+from parallel_ingest import _keys_path, _partition_path, _spill_path, ingest_partition, partition_chunks
+
+PARTITIONS = 4
+
+def new_database():
+    db = mongomock.MongoClient().db
+    db.unique.create_index("data.cookie", unique=True)
+    db.unique.create_index("data.email", unique=True)
+    db.unique.insert_one({"data": {"cookie": "c0", "email": "old@example.com"}})
+    return db
+
+# Two files of two chunks; c0 links "old@example.com" (file 0) to the stored profile
+FILES = [
+    [
+        [{"data": {"cookie": "c1", "email": "a@example.com"}}, {"data": {"cookie": "c0", "email": "b@example.com"}}],
+        [{"data": {"cookie": "c2", "email": "a@example.com"}}, {"data": {"cookie": "c3", "email": "c@example.com"}}],
+    ],
+    [
+        [{"data": {"cookie": "c4", "email": "old@example.com"}}, {"data": {"cookie": "c5", "email": "d@example.com"}}],
+        [{"data": {"cookie": "c3", "email": "e@example.com"}}],
+    ],
+]
+
+def write_spills(workdir):
+    chunks = []
+    for file_index, file_chunks in enumerate(FILES):
+        for chunk_index, records in enumerate(file_chunks):
+            raw = [{"data": {**record["data"], "row": f"{file_index}-{chunk_index}-{row}"}} for row, record in enumerate(records)]
+            with open(_spill_path(workdir, file_index, chunk_index), "wb") as f:
+                pickle.dump((raw, records), f)
+            chunks.append((file_index, chunk_index))
+        with open(_keys_path(workdir, file_index), "wb") as f:
+            pickle.dump([[(record["data"]["cookie"], record["data"]["email"]) for record in records] for records in file_chunks], f)
+    return chunks
+
+def profiles(db):
+    return sorted((doc["data"]["cookie"], doc["data"]["email"]) for doc in db.unique.find())
+
+# Every chunk gets its own partition array; records of one identity group share a partition
+def test_partition_arrays_per_chunk(tmp_path):
+    workdir = str(tmp_path)
+    write_spills(workdir)
+    assert partition_chunks(workdir, len(FILES), new_database().unique, PARTITIONS) == 4
+
+    owners = {}
+    for file_index, file_chunks in enumerate(FILES):
+        for chunk_index, records in enumerate(file_chunks):
+            array = np.load(_partition_path(workdir, file_index, chunk_index))
+            assert array.shape == (len(records),) and array.max() < PARTITIONS
+            for record, owner in zip(records, array):
+                owners.setdefault(record["data"]["cookie"], set()).add(int(owner))
+    assert owners["c1"] == owners["c2"]
+    assert owners["c0"] == owners["c4"]
+    assert all(len(partitions) == 1 for partitions in owners.values())
+    assert not any(name.startswith("assignment") for name in os.listdir(workdir))
+
+# Ingesting every partition gives the same profiles as one batch of all rows in file order
+def test_partitions_match_one_batch(tmp_path, monkeypatch):
+    workdir = str(tmp_path)
+    chunks = write_spills(workdir)
+    db, expected = new_database(), new_database()
+    monkeypatch.setattr(parallel_ingest, "get_collection", lambda name: db[name])
+
+    partition_chunks(workdir, len(FILES), db.unique, PARTITIONS)
+    totals = [ingest_partition(workdir, partition, PARTITIONS, chunks) for partition in range(PARTITIONS)]
+    apply_identity_batch(expected.unique, expected.cohort, [record for file_chunks in FILES for records in file_chunks for record in records])
+
+    assert profiles(db) == profiles(expected)
+    assert sum(total["raw"] for total in totals) == db.users.count_documents({}) == 7
@@ -0,0 +1,52 @@
+import mongomock
+from raw_events import HASH_FIELD, RawEventStore, content_hash
+
+def users_collection():
+    users = mongomock.MongoClient().db.users
+    users.create_index(HASH_FIELD, unique=True, sparse=True)
+    return users
+
+def event(number):
+    return {"data": {"cookie": f"c{number}", "email": f"u{number}@example.com", "page": "/home"}}
+
+# load() seeds the filter with every stored hash: stored events are "maybe seen" and
+# confirmed with one lookup, new ones are inserted without any
+def test_load_seeds_the_filter():
+    users = users_collection()
+    RawEventStore(capacity=1000).insert_many(users, [event(n) for n in range(3)])
+
+    store = RawEventStore(capacity=1000)
+    assert store.load(users) == 3 and store.loaded
+    assert store._bloom.contains_many([content_hash(event(n)["data"]) for n in range(3)]).all()
+
+    assert store.insert_many(users, [event(n) for n in range(3)]) == 0
+    assert store.lookups == 1 and store.dropped == 3
+    assert store.insert_many(users, [event(9)]) == 1
+    assert store.lookups == 1  # Certainly new: no lookup
+    assert users.count_documents({}) == 4
+
+# A Bloom false positive ("maybe") is settled by the lookup and the event is written
+def test_bloom_maybe_falls_back_to_lookup():
+    users = users_collection()
+    store = RawEventStore(capacity=1000)
+    store.load(users)
+    store._bloom._bits[:] = 0xFF  # Every hash now looks like a possible repeat
+
+    assert store.insert_many(users, [event(1), event(2)]) == 2
+    assert store.lookups == 1 and users.count_documents({}) == 2
+
+# An event another process wrote after this one loaded its filter passes as "certainly
+# new" and is rejected by the unique hash index (E11000 in a BulkWriteError)
+def test_duplicate_from_another_process_caught_by_unique_index():
+    users = users_collection()
+    first, second = RawEventStore(capacity=1000), RawEventStore(capacity=1000)
+    first.load(users)
+    second.load(users)
+
+    assert first.insert_many(users, [event(1)]) == 1
+    assert second.insert_many(users, [event(1), event(2)]) == 1
+    assert second.lookups == 0 and second.dropped == 1
+    assert users.count_documents({}) == 2
+
+    # The rejected hash is remembered: a retry is dropped without a round trip
+    assert second.insert_many(users, [event(1)]) == 0 and second.lookups == 0
@@ -0,0 +1,56 @@
+from collections import Counter
+import mongomock
+from segments import (
+    SEGMENTS_COLLECTION,
+    add_segment_delta,
+    membership_update,
+    rebuild_segments,
+    segment_delta,
+    size_ops,
+)
+
+def profile(cookie, age, interests=("Tech",), income="$50,000-$74,999"):
+    return {"cookie": cookie, "interests": list(interests), "demographics": {"age": age, "income": income}}
+
+# A profile moving from one age band to the next leaves one counter and joins the other;
+# unchanged segments are not touched
+def test_delta_moves_profile_between_age_bands():
+    delta = add_segment_delta(Counter(), profile("c1", 34), profile("c1", 35))
+    assert {segment: change for segment, change in delta.items() if change} == {"age:25-34": -1, "age:35-44": 1}
+
+    # New profile: +1 for each of its segments
+    assert add_segment_delta(Counter(), None, profile("c2", 20)) == Counter(
+        {"interests:Tech": 1, "income:$50,000-$74,999": 1, "age:18-24": 1}
+    )
+
+# Several writes of one profile net out, and zero changes produce no counter write
+def test_segment_delta_nets_out():
+    delta = segment_delta([
+        (None, profile("c1", 30)),
+        (profile("c1", 30), profile("c1", 40)),
+        (profile("c1", 40), profile("c1", 30, interests=("Football",))),
+    ])
+    assert {segment for segment, change in delta.items() if change} == {"interests:Sports", "income:$50,000-$74,999", "age:25-34"}
+    segments = mongomock.MongoClient().db[SEGMENTS_COLLECTION]
+    segments.bulk_write(size_ops(delta))
+    assert {doc["_id"]: doc["size"] for doc in segments.find()} == {"interests:Sports": 1, "income:$50,000-$74,999": 1, "age:25-34": 1}
+
+# Stored segments only follow the data they were computed from: a stale membership
+# update after a newer write matches nothing
+def test_membership_update_skips_stale_data():
+    unique = mongomock.MongoClient().db.unique
+    unique.insert_one({"data": profile("c1", 40)})
+    assert unique.update_one(*membership_update(profile("c1", 30))).matched_count == 0
+    assert unique.update_one(*membership_update(profile("c1", 40))).matched_count == 1
+    assert unique.find_one()["segments"][-1] == "age:35-44"
+
+# A rebuild restores counters left wrong (e.g. by a crash between the two writes)
+def test_rebuild_reconciles_counters():
+    db = mongomock.MongoClient().db
+    db.unique.insert_many([{"data": profile("c1", 30)}, {"data": profile("c2", 50, interests=())}])
+    db[SEGMENTS_COLLECTION].insert_one({"_id": "age:25-34", "dimension": "age", "value": "25-34", "size": 7})
+
+    rebuild_segments(db)
+    sizes = {doc["_id"]: doc["size"] for doc in db[SEGMENTS_COLLECTION].find()}
+    assert sizes == {"interests:Tech": 1, "interests:Other": 1, "income:$50,000-$74,999": 2, "age:25-34": 1, "age:45-54": 1}
+    assert db.cache_versions.find_one({"_id": "unique"})["version"] == 1
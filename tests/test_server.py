@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The server installs without scikit-learn / scipy / joblib: clustering is only imported
+# at startup, and its endpoints answer 503 when it cannot be
+def test_server_starts_without_clustering_dependencies():
+    script = (
+        "import sys\n"
+        "sys.modules.update({'sklearn': None, 'scipy': None, 'joblib': None})\n"
+        "import server\n"
+        "assert 'clustering' not in sys.modules\n"
+        "assert server.load_cluster_model() is None\n"
+        "from fastapi import HTTPException\n"
+        "try:\n"
+        "    server.get_clusters_batch([{'data': {}}])\n"
+        "except HTTPException as exc:\n"
+        "    assert exc.status_code == 503\n"
+        "else:\n"
+        "    raise AssertionError('expected 503')\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+# server_async shares api_common / identity_resolver with server.py, not server.py's
+# module state (caches, raw event store, metrics, write-behind queue)
+def test_server_async_does_not_import_server():
+    script = "import sys\nimport server_async\nassert 'server' not in sys.modules\n"
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,55 @@
+from datetime import datetime
+import mongomock
+import pytest
+from snapshot import MANIFEST, compact_snapshot, export_snapshot, load_snapshot, read_manifest
+
+def profile(cookie, city, updated_at, age=30):
+    return {"_id": cookie, "data": {"cookie": cookie, "location": {"city": city}, "demographics": {"age": age}},
+            "segments": ["age:25-34"], "updated_at": updated_at}
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient().db.unique
+    collection.insert_many([profile("a", "Paris", datetime(2024, 1, 1, 10)), profile("b", "Lyon", datetime(2024, 1, 1, 11))])
+    return collection
+
+def test_first_export_and_load(collection, tmp_path):
+    assert export_snapshot(collection, tmp_path) == 2
+    assert read_manifest(tmp_path)["watermark"] == "2024-01-01T11:00:00"
+
+    df = load_snapshot(tmp_path, ["data.location.city", "data.demographics.age"])
+    assert df.columns.tolist() == ["data.location.city", "data.demographics.age"]
+    assert df["data.location.city"].tolist() == ["Paris", "Lyon"]
+
+# Rows of the overlap window already in a part are skipped, so nothing changed -> no part
+def test_export_without_changes_writes_no_part(collection, tmp_path):
+    export_snapshot(collection, tmp_path)
+    assert export_snapshot(collection, tmp_path, overlap_seconds=3600 * 24) == 0
+    assert read_manifest(tmp_path)["parts"] == ["part-00000.arrow"]
+
+def test_incremental_export_keeps_latest_row(collection, tmp_path):
+    export_snapshot(collection, tmp_path)
+    collection.update_one({"_id": "a"}, {"$set": {"data.location.city": "Nice", "updated_at": datetime(2024, 1, 2)}})
+    collection.insert_one(profile("c", "Lille", datetime(2024, 1, 2, 1)))
+
+    assert export_snapshot(collection, tmp_path) == 2
+    manifest = read_manifest(tmp_path)
+    assert len(manifest["parts"]) == 2
+    assert manifest["watermark"] == "2024-01-02T01:00:00"
+
+    df = load_snapshot(tmp_path, ["_id", "data.location.city"])
+    assert dict(zip(df["_id"], df["data.location.city"])) == {"a": "Nice", "b": "Lyon", "c": "Lille"}
+
+def test_compact(collection, tmp_path):
+    export_snapshot(collection, tmp_path)
+    collection.update_one({"_id": "b"}, {"$set": {"data.demographics.age": "unknown", "updated_at": datetime(2024, 1, 2)}})
+    export_snapshot(collection, tmp_path)
+    before = load_snapshot(tmp_path)
+
+    compact_snapshot(tmp_path)
+    manifest = read_manifest(tmp_path)
+    assert manifest["parts"] == ["part-00002.arrow"]
+    assert sorted(file.name for file in tmp_path.iterdir()) == [MANIFEST, "part-00002.arrow"]
+    after = load_snapshot(tmp_path)
+    assert after.equals(before)
+    assert after.set_index("_id")["data.demographics.age"].isna().tolist() == [False, True]
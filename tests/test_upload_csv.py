@@ -0,0 +1,71 @@
+import mongomock
+import pandas as pd
+import pytest
+import upload_csv
+from identity_resolver import CONFLICT, EMAIL_MERGED, FAILED, INSERTED, UPDATED
+
+# One frame covering every path of the identity resolution
+ROWS = [
+    {"cookie": "c1", "email": "a@example.com", "interests": "Tech", "created_at": "01/02/2024 10:00"},
+    {"cookie": "c1", "email": "a@example.com", "interests": "Tech | Gaming"},   # Cookie update
+    {"cookie": "c9", "email": "old@example.com", "country": "USA"},            # Email merge with a stored profile
+    {"cookie": "c2", "email": "a@example.com", "age": 30},                     # Email merge within the frame
+    {"cookie": "c2", "email": "old@example.com"},                              # Email owned by another profile
+    {"cookie": "c5", "email": "e@example.com", "gender": "Female"},
+]
+
+def write_csv(tmp_path, rows):
+    path = tmp_path / "users.csv"
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return str(path)
+
+def bind_database(monkeypatch):
+    db = mongomock.MongoClient().db
+    db.unique.create_index("data.cookie", unique=True)
+    db.unique.create_index("data.email", unique=True)
+    db.unique.insert_one({"data": {"cookie": "c0", "email": "old@example.com", "interests": ["Travel"]}})
+    for name in ("users", "unique", "cohort"):
+        monkeypatch.setattr(upload_csv, f"{name}_collection", db[name])
+    monkeypatch.setattr(upload_csv, "get_collection", lambda name: db[name])
+    return db
+
+def snapshot(db):
+    unique = sorted(({**doc["data"], "segments": doc.get("segments")} for doc in db.unique.find({}, {"_id": 0})),
+                    key=lambda data: data["cookie"])
+    cohort = sorted(((doc["data"], doc["merges"]) for doc in db.cohort.find({}, {"_id": 0})),
+                    key=lambda item: item[0]["cookie"])
+    # The row path can leave a counter at 0 where the batch path nets the deltas and writes none
+    segments = sorted((doc["_id"], doc["size"]) for doc in db.segments.find({"size": {"$ne": 0}}))
+    return unique, cohort, segments
+
+# The row-by-row and batched uploads leave the same profiles, cohort documents and counts
+def test_row_and_batch_paths_match(tmp_path, monkeypatch):
+    csv_path = write_csv(tmp_path, ROWS)
+    row_db = bind_database(monkeypatch)
+    row_totals = upload_csv.insert_to_unique_and_cohort(csv_path)
+
+    batch_db = bind_database(monkeypatch)
+    batch_totals = upload_csv.insert_to_unique_and_cohort(csv_path, batch_size=100)
+
+    assert row_totals == batch_totals == {UPDATED: 1, EMAIL_MERGED: 2, INSERTED: 2, CONFLICT: 1, FAILED: 0}
+    assert snapshot(row_db) == snapshot(batch_db)
+    assert [data["cookie"] for data, _ in snapshot(batch_db)[1]] == ["c2", "c9"]
+
+# Uploading the same file again writes nothing: updated_at, cohort merges and the
+# cohort write version keep the values of the first upload (one row per identity:
+# replaying several rows of one profile row by row rewrites its intermediate states)
+@pytest.mark.parametrize("batch_size", [None, 100])
+def test_reupload_is_idempotent(tmp_path, monkeypatch, batch_size):
+    csv_path = write_csv(tmp_path, ROWS[1:3] + ROWS[5:])
+    db = bind_database(monkeypatch)
+    upload_csv.insert_to_unique_and_cohort(csv_path, batch_size=batch_size)
+    stamps = {doc["data"]["cookie"]: doc.get("updated_at") for doc in db.unique.find()}
+    state, cohort = snapshot(db), list(db.cohort.find())
+    version = db.cache_versions.find_one({"_id": "cohort"})["version"]
+
+    totals = upload_csv.insert_to_unique_and_cohort(csv_path, batch_size=batch_size)
+
+    assert totals == {UPDATED: 3, EMAIL_MERGED: 0, INSERTED: 0, CONFLICT: 0, FAILED: 0}
+    assert {doc["data"]["cookie"]: doc.get("updated_at") for doc in db.unique.find()} == stamps
+    assert snapshot(db) == state and list(db.cohort.find()) == cohort
+    assert db.cache_versions.find_one({"_id": "cohort"})["version"] == version
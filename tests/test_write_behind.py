@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+from pymongo.errors import AutoReconnect
+from write_behind import WriteBehindQueue, coalesce_records
+
+# ✅ Stub apply_batch: records every applied (raw_id, data) entry; `fail` decides per
+# call whether to raise instead
+class Recorder:
+    def __init__(self, fail=None):
+        self.entries = []
+        self.calls = 0
+        self.fail = fail
+
+    def __call__(self, entries):
+        self.calls += 1
+        if self.fail is not None:
+            error = self.fail(self.calls, entries)
+            if error is not None:
+                raise error
+        self.entries.extend(entries)
+
+def new_queue(tmp_path, apply_batch, **options):
+    return WriteBehindQueue(str(tmp_path / "ingest.wal"), apply_batch, fsync=False, linger_seconds=0, retry_delay=0, **options)
+
+def user(number, **fields):
+    return {"cookie": f"c{number}", "email": f"u{number}@example.com", **fields}
+
+# Entries logged before a crash (checkpoint behind the log) are written on the next start
+def test_replays_entries_past_checkpoint(tmp_path):
+    wal_path = tmp_path / "ingest.wal"
+    with open(wal_path, "w") as f:
+        for seq in (1, 2, 3):
+            f.write(json.dumps({"seq": seq, "raw_id": f"r{seq}", "data": user(seq)}) + "\n")
+        f.write('{"seq": 4, "raw_id"')  # Torn last line
+    (tmp_path / "ingest.wal.checkpoint").write_text("1")
+
+    recorder = Recorder()
+    queue = new_queue(tmp_path, recorder)
+    assert queue.start() == 2
+    assert queue.submit(user(5))
+    queue.stop()
+
+    assert [raw_id for raw_id, _ in recorder.entries[:2]] == ["r2", "r3"]
+    assert [data["cookie"] for _, data in recorder.entries] == ["c2", "c3", "c5"]
+    assert queue.stats()["last_applied_seq"] == 4
+
+# Once everything logged is applied, the log starts over and the checkpoint is kept
+def test_log_truncated_when_drained(tmp_path):
+    recorder = Recorder()
+    queue = new_queue(tmp_path, recorder)
+    queue.start()
+    for n in range(5):
+        assert queue.submit(user(n))
+    queue.stop()
+
+    assert len(recorder.entries) == 5
+    assert os.path.getsize(tmp_path / "ingest.wal") == 0
+    assert (tmp_path / "ingest.wal.checkpoint").read_text() == "5"
+    assert new_queue(tmp_path, Recorder()).start() == 0
+
+# A full queue rejects new payloads after put_timeout instead of blocking the caller
+def test_submit_rejected_when_queue_full(tmp_path):
+    release = threading.Event()
+    queue = new_queue(tmp_path, Recorder(fail=lambda calls, entries: release.wait()), max_pending=1, put_timeout=0.01)
+    queue.start()
+    assert queue.submit(user(1))
+    assert not queue.submit(user(2))
+    assert queue.stats()["rejected"] == 1
+    release.set()
+    queue.stop()
+
+# Connection errors are retried; any other failure dead-letters only the failing entry
+# and the checkpoint moves past it
+def test_dead_letters_entries_that_keep_failing(tmp_path):
+    def fail(calls, entries):
+        if calls == 1:
+            return AutoReconnect("primary stepped down")
+        if any("n" in data for _, data in entries):
+            return OverflowError("MongoDB can only handle up to 8-byte ints")
+        return None
+
+    recorder = Recorder(fail)
+    queue = new_queue(tmp_path, recorder, batch_size=10)
+    queue.start()
+    for data in (user(1), user(2, n=2 ** 70), user(3)):
+        queue.submit(data)
+    queue.stop()
+
+    assert [data["cookie"] for _, data in recorder.entries] == ["c1", "c3"]
+    assert queue.stats()["dead_lettered"] == 1 and queue.stats()["last_applied_seq"] == 3
+    with open(tmp_path / "ingest.wal.dead") as f:
+        dead = [json.loads(line) for line in f]
+    assert [entry["data"]["cookie"] for entry in dead] == ["c2"] and "OverflowError" in dead[0]["error"]
+
+# Repeated updates of one (cookie, email) fold together unless the cookie or email was
+# used with another key in between, or the update carries created_at
+def test_coalesce_records():
+    datas = [
+        {"cookie": "c1", "email": "a@example.com", "age": 30},
+        {"cookie": "c1", "email": "a@example.com", "city": "Austin"},
+        {"cookie": "c2", "email": "b@example.com"},
+        {"cookie": "c3", "email": "a@example.com"},   # Email used by another cookie
+        {"cookie": "c1", "email": "a@example.com", "age": 31},
+        {"cookie": "c2", "email": "b@example.com", "created_at": "now"},
+    ]
+    assert coalesce_records(datas) == [
+        {"cookie": "c1", "email": "a@example.com", "age": 30, "city": "Austin"},
+        {"cookie": "c2", "email": "b@example.com"},
+        {"cookie": "c3", "email": "a@example.com"},
+        {"cookie": "c1", "email": "a@example.com", "age": 31},
+        {"cookie": "c2", "email": "b@example.com", "created_at": "now"},
+    ]
@@ -0,0 +1,94 @@
+import pandas as pd
+
+DATE_FORMAT = "%m/%d/%Y %H:%M"
+
+# Columns copied into the nested "unique" profile (column -> default when absent)
+LOCATION_COLUMNS = {"state": "", "country": "", "city": ""}
+DEMOGRAPHIC_COLUMNS = {"age": None, "gender": "", "income": "", "education": ""}
+
+# ✅ Column of the frame, or a constant column when the CSV does not have it
+def _column(df, name, default):
+    if name in df.columns:
+        return df[name]
+    return pd.Series([default] * len(df.index), index=df.index, dtype=object)
+
+# ✅ Strip string values; anything that is not a string becomes None
+def _strip(series):
+    return series.map(lambda value: value.strip() if isinstance(value, str) else None)
+
+# ✅ NaN -> None for a whole column (object dtype keeps Python values for Mongo)
+def _none_for_nan(series):
+    return series.astype(object).where(series.notna(), None)
+
+# ✅ Vectorized CSV transformation shared by the ingest paths.
+# Returns (raw_records, unique_records, invalid_rows):
+#   raw_records    -> {"data": row} documents for "users"
+#   unique_records -> nested {"data": {...}} profiles for "unique" (rows with cookie & email)
+#   invalid_rows   -> frame of rows skipped because created_at did not match DATE_FORMAT
+def transform_frame(df):
+    df = df.copy()
+
+    # Convert created_at to datetime in one pass; unparsable values become NaT
+    if "created_at" in df.columns:
+        created_at = pd.to_datetime(df["created_at"], format=DATE_FORMAT, errors="coerce")
+        invalid = df["created_at"].notna() & created_at.isna()
+        invalid_rows = df[invalid]
+        df = df[~invalid]
+        df["created_at"] = created_at[~invalid]
+    else:
+        invalid_rows = df.iloc[0:0]
+
+    # Ensure interests are stored as an array ("A | B" -> ["A", "B"])
+    if "interests" in df.columns and pd.api.types.is_string_dtype(df["interests"]):
+        df["interests"] = (
+            df["interests"]
+            .str.replace(r"\s*\|\s*", "|", regex=True)
+            .str.strip()
+            .str.split("|")
+        )
+
+    df = df.apply(_none_for_nan)
+    raw_records = [{"data": record} for record in df.to_dict(orient="records")]
+
+    # Extract important details (records without cookie or email are skipped)
+    cookie = _strip(_column(df, "cookie", None))
+    email = _strip(_column(df, "email", None))
+    valid = cookie.notna() & (cookie != "") & email.notna() & (email != "")
+
+    rows = df[valid]
+    location = {name: _column(rows, name, default) for name, default in LOCATION_COLUMNS.items()}
+    demographics = {name: _column(rows, name, default) for name, default in DEMOGRAPHIC_COLUMNS.items()}
+
+    unique_records = [
+        {
+            "data": {
+                "cookie": row_cookie,
+                "email": row_email,
+                "phone_number": phone_number,
+                "created_at": created_at,
+                "location": {"state": state, "country": country, "city": city},
+                "demographics": {"age": age, "gender": gender, "income": income, "education": education},
+                "interests": interests,
+            }
+        }
+        for row_cookie, row_email, phone_number, created_at, state, country, city,
+            age, gender, income, education, interests in zip(
+            cookie[valid],
+            email[valid],
+            _column(rows, "phone_number", ""),
+            _column(rows, "created_at", None),
+            location["state"], location["country"], location["city"],
+            demographics["age"], demographics["gender"], demographics["income"], demographics["education"],
+            _column(rows, "interests", []),
+        )
+    ]
+
+    return raw_records, unique_records, invalid_rows
+
+# ✅ Report skipped rows once per batch instead of once per record
+def report_invalid_dates(invalid_rows, sample_size=5):
+    if invalid_rows.empty:
+        return
+    sample = ", ".join(f"row {index}: {value!r}" for index, value in invalid_rows["created_at"].head(sample_size).items())
+    more = f" (+{len(invalid_rows) - sample_size} more)" if len(invalid_rows) > sample_size else ""
+    print(f"⚠️ Skipped {len(invalid_rows)} records with invalid created_at format: {sample}{more}")
@@ -1,90 +1,68 @@
+import argparse
 import pandas as pd
-from pymongo import MongoClient
-from datetime import datetime
-
-# MongoDB Connection
-MONGO_URI = "mongodb://localhost:27017/"
-client = MongoClient(MONGO_URI)
-db = client["user_database"]
-users_collection = db["users"]
-unique_collection = db["unique"]
-cohort_collection = db["cohort"]
+import queue
+import threading
+from datetime import datetime, timezone
+from pymongo.errors import DuplicateKeyError
+from cache import VERSIONS_COLLECTION, bump_write_version
+from connection import get_collection, get_database
+from indexes import ensure_indexes
+from identity_resolver import apply_identity_batch, cohort_update, UPDATED, EMAIL_MERGED, INSERTED, CONFLICT, FAILED
+from transform import transform_frame, report_invalid_dates
+from segments import profile_segments, record_profile_change
+from raw_events import RawEventStore
+
+# MongoDB Connection (shared client from connection.py, opened by connect())
+db = None
+users_collection = None
+unique_collection = None
+cohort_collection = None
+
+# ✅ Raw events already in "users" are skipped, so re-running an upload does not
+# write the same rows again (Bloom filter built by connect())
+raw_events = None
+
+# ✅ Bind the collections (each with its configured write concern) before ingesting,
+# and load the stored raw event hashes: the filter is sized for the stored events plus
+# as many new ones, so only likely repeats cost a lookup
+def connect():
+    global db, users_collection, unique_collection, cohort_collection, raw_events
+    db = get_database()
+    users_collection = get_collection("users")
+    unique_collection = get_collection("unique")
+    cohort_collection = get_collection("cohort")
+    raw_events = RawEventStore(capacity=max(100_000, 2 * users_collection.estimated_document_count()))
+    raw_events.load(users_collection)
 
 # ✅ Insert CSV Data (Only to "users")
 def insert_csv_to_users(csv_path):
     df = pd.read_csv(csv_path)
-    records = df.to_dict(orient="records")
-
-    formatted_records = []
-    for record in records:
-        # Convert created_at to datetime
-        if "created_at" in record and pd.notna(record["created_at"]):
-            try:
-                record["created_at"] = datetime.strptime(str(record["created_at"]), "%m/%d/%Y %H:%M")
-            except ValueError:
-                print(f"⚠️ Invalid date format for record: {record}")
-                continue  # Skip invalid date format records
-
-        # Ensure interests are stored as an array
-        if "interests" in record and pd.notna(record["interests"]):
-            record["interests"] = [interest.strip() for interest in record["interests"].split("|")]
-
-        # Format for MongoDB
-        formatted_record = {"data": record}
-        formatted_records.append(formatted_record)
+    formatted_records, _, invalid_rows = transform_frame(df)
+    report_invalid_dates(invalid_rows)
 
     # Insert into "users" collection (Raw Data)
     if formatted_records:
-        users_collection.insert_many(formatted_records)
-        print("✅ CSV Data Successfully Inserted into 'users' Collection!")
+        inserted = raw_events.insert_many(users_collection, formatted_records)
+        print(f"✅ CSV Data Successfully Inserted into 'users' Collection! ({inserted} new, {len(formatted_records) - inserted} duplicates skipped)")
     else:
         print("⚠️ No valid records found to insert.")
 
 # ✅ Insert or Update Unique & Cohort Users (Including `created_at`)
-def insert_to_unique_and_cohort(csv_path):
+# batch_size=None keeps the row-by-row path; otherwise records are resolved in
+# batches (one $in lookup + ordered bulk writes per batch) with the same final state.
+# Both paths return the count of every merge outcome.
+def insert_to_unique_and_cohort(csv_path, batch_size=None):
     df = pd.read_csv(csv_path)
-    records = df.to_dict(orient="records")
+    _, records, invalid_rows = transform_frame(df)
+    report_invalid_dates(invalid_rows)
 
-    for record in records:
-        # Convert created_at to datetime
-        if "created_at" in record and pd.notna(record["created_at"]):
-            try:
-                record["created_at"] = datetime.strptime(str(record["created_at"]), "%m/%d/%Y %H:%M")
-            except ValueError:
-                print(f"⚠️ Skipping record due to invalid date format: {record}")
-                continue
+    if batch_size:
+        return insert_to_unique_and_cohort_batched(records, batch_size)
 
-        # Ensure interests are stored as an array
-        if "interests" in record and pd.notna(record["interests"]):
-            record["interests"] = [interest.strip() for interest in record["interests"].split("|")]
-
-        # Extract important details
-        cookie = record.get("cookie", "").strip()
-        email = record.get("email", "").strip()
-
-        if not cookie or not email:
-            continue  # Skip records missing required fields
-
-        formatted_record = {
-            "data": {
-                "cookie": cookie,
-                "email": email,
-                "phone_number": record.get("phone_number", ""),
-                "created_at": record.get("created_at"),  # ✅ Ensure `created_at` is included
-                "location": {
-                    "state": record.get("state", ""),
-                    "country": record.get("country", ""),
-                    "city": record.get("city", "")
-                },
-                "demographics": {
-                    "age": record.get("age", None),
-                    "gender": record.get("gender", ""),
-                    "income": record.get("income", ""),
-                    "education": record.get("education", "")
-                },
-                "interests": record.get("interests", [])
-            }
-        }
+    totals = {UPDATED: 0, EMAIL_MERGED: 0, INSERTED: 0, CONFLICT: 0, FAILED: 0}
+    for formatted_record in records:
+        cookie = formatted_record["data"]["cookie"]
+        email = formatted_record["data"]["email"]
 
         # ✅ Check if user exists in "unique" (by cookie)
         existing_cookie_user = unique_collection.find_one({"data.cookie": cookie})
@@ -93,7 +71,18 @@ def insert_to_unique_and_cohort(csv_path):
         if existing_cookie_user:
             # ✅ Update Unique user by cookie (Keep all previous data and update new fields)
             merged_data = {**existing_cookie_user["data"], **formatted_record["data"]}
-            unique_collection.update_one({"data.cookie": cookie}, {"$set": {"data": merged_data}})
+            if merged_data == existing_cookie_user["data"] and existing_cookie_user.get("segments") == profile_segments(merged_data):
+                totals[UPDATED] += 1  # Re-ingested row: nothing to write, updated_at is kept
+                continue
+            try:
+                unique_collection.update_one({"data.cookie": cookie}, {"$set": {"data": merged_data, "updated_at": datetime.now(timezone.utc)}})
+            except DuplicateKeyError:
+                # New email already belongs to another profile (same conflict as the batch path)
+                totals[CONFLICT] += 1
+                print(f"⚠️ Conflict: {email} already belongs to another profile, skipped cookie {cookie}")
+                continue
+            record_profile_change(unique_collection, existing_cookie_user["data"], merged_data)
+            totals[UPDATED] += 1
             print(f"🔄 Updated user with cookie: {cookie} in 'unique' collection")
 
         elif existing_email_user:
@@ -102,17 +91,91 @@ def insert_to_unique_and_cohort(csv_path):
             merged_data["cookie"] = cookie  # Update cookie ID with latest
 
             # ✅ Update unique collection
-            unique_collection.update_one({"data.email": email}, {"$set": {"data": merged_data}})
+            merged_at = datetime.now(timezone.utc)
+            unique_collection.update_one({"data.email": email}, {"$set": {"data": merged_data, "updated_at": merged_at}})
+            record_profile_change(unique_collection, existing_email_user["data"], merged_data)
             
-            # ✅ Store merged profile in "cohort"
-            cohort_collection.insert_one({"data": merged_data})
+            # ✅ Update the identity's single document in "cohort"
+            cohort_collection.update_one(*cohort_update(existing_email_user["_id"], merged_data, merged_at), upsert=True)
+            totals[EMAIL_MERGED] += 1
             print(f"📌 Email match: {email}, merged profile stored in 'cohort' collection")
 
         else:
             # ✅ Insert as a new user into "unique" table
+            formatted_record["updated_at"] = datetime.now(timezone.utc)
             unique_collection.insert_one(formatted_record)
+            record_profile_change(unique_collection, None, formatted_record["data"])
+            totals[INSERTED] += 1
             print(f"✅ Inserted new unique user: {email}")
 
+    if totals[UPDATED] or totals[EMAIL_MERGED] or totals[INSERTED]:
+        bump_write_version(get_collection(VERSIONS_COLLECTION), "unique")  # Running servers drop cached profiles
+    if totals[EMAIL_MERGED]:
+        bump_write_version(get_collection(VERSIONS_COLLECTION), "cohort")  # Running servers drop cached cohorts
+    if totals[CONFLICT]:
+        print(f"⚠️ Conflicts: {totals[CONFLICT]}")
+    return totals
+
+# ✅ Batched mode: resolve identities per chunk in memory and flush with bulk_write
+def insert_to_unique_and_cohort_batched(records, batch_size=5000):
+    totals = {UPDATED: 0, EMAIL_MERGED: 0, INSERTED: 0, CONFLICT: 0, FAILED: 0}
+
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        outcomes, _, _ = apply_identity_batch(unique_collection, cohort_collection, batch)
+        for outcome in outcomes:
+            totals[outcome] += 1
+
+    print(f"🔄 Updated: {totals[UPDATED]} | 📌 Email merged: {totals[EMAIL_MERGED]} | ✅ Inserted: {totals[INSERTED]} | ⚠️ Conflicts: {totals[CONFLICT]} | ❌ Failed: {totals[FAILED]}")
+    return totals
+
+# ✅ Writer thread: drains parsed chunks into "users", "unique" and "cohort"
+def _write_chunks(chunk_queue, totals, errors):
+    while True:
+        item = chunk_queue.get()
+        if item is None:
+            return
+        if errors:
+            continue  # Keep draining so the reader never blocks on a failed writer
+
+        raw_records, unique_records = item
+        try:
+            inserted = raw_events.insert_many(users_collection, raw_records) if raw_records else 0
+            outcomes, _, _ = apply_identity_batch(unique_collection, cohort_collection, unique_records)
+            for outcome in outcomes:
+                totals[outcome] += 1
+            totals["raw"] += inserted
+        except Exception as exc:
+            errors.append(exc)
+
+# ✅ Streaming ingest: parse the CSV once, chunk by chunk, and feed both writers.
+# At most `max_pending` parsed chunks wait in the queue, so memory stays bounded
+# while the next chunk is parsed during the previous chunk's writes.
+def ingest_csv(csv_path, chunk_size=5000, max_pending=2):
+    totals = {"raw": 0, UPDATED: 0, EMAIL_MERGED: 0, INSERTED: 0, CONFLICT: 0, FAILED: 0}
+    errors = []
+    chunk_queue = queue.Queue(maxsize=max_pending)
+    writer = threading.Thread(target=_write_chunks, args=(chunk_queue, totals, errors), daemon=True)
+    writer.start()
+
+    try:
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+            if errors:
+                break
+            raw_records, unique_records, invalid_rows = transform_frame(chunk)
+            report_invalid_dates(invalid_rows)
+            chunk_queue.put((raw_records, unique_records))
+    finally:
+        chunk_queue.put(None)
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
+    print(f"✅ Raw rows inserted into 'users': {totals['raw']}")
+    print(f"🔄 Updated: {totals[UPDATED]} | 📌 Email merged: {totals[EMAIL_MERGED]} | ✅ Inserted: {totals[INSERTED]} | ⚠️ Conflicts: {totals[CONFLICT]} | ❌ Failed: {totals[FAILED]}")
+    return totals
+
 # ✅ Retrieve User by Email or Cookie (From Unique Table)
 def get_user(email=None, cookie=None):
     if not email and not cookie:
@@ -149,7 +212,7 @@ def get_cohort_users(cookie=None, email=None, country=None, age_min=None, age_ma
     if interests:
         query["data.interests"] = {"$in": interests}
 
-    users = list(cohort_collection.find(query, {"_id": 0}))
+    users = list(cohort_collection.find(query, {"_id": 0, "data": 1}))
 
     if not users:
         return {"error": "No users found"}
@@ -158,12 +221,15 @@ def get_cohort_users(cookie=None, email=None, country=None, age_min=None, age_ma
 
 # ✅ Run the script
 if __name__ == "__main__":
-    csv_path = r"D:\alter_office\sample_user_data.csv"
+    parser = argparse.ArgumentParser(description="Ingest one CSV file (see parallel_ingest.py for many)")
+    parser.add_argument("csv_path", nargs="?", default="sample_user_data.csv")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
 
-    print("\n📂 Importing data into 'users' collection...")
-    insert_csv_to_users(csv_path)  # Insert raw CSV data into users
+    connect()
+    ensure_indexes(db)  # Unique cookie/email + cohort filter indexes
 
-    print("\n🔍 Processing data for 'unique' and 'cohort' collections...")
-    insert_to_unique_and_cohort(csv_path)  # Process data for unique & cohort
+    print("\n📂 Streaming data into 'users', 'unique' and 'cohort' collections...")
+    ingest_csv(args.csv_path, chunk_size=args.chunk_size)  # Single pass: raw users + unique & cohort
 
     print("\n✅ All operations completed successfully!")
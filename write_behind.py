@@ -0,0 +1,227 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from bson import ObjectId
+from pymongo.errors import ConnectionFailure
+
+# Write-behind ingest: payloads are appended to a local write-ahead log (one JSON line
+# per payload, with a sequence number and the _id of its raw "users" document) and
+# handed to a single background writer that flushes them in batches. The writer
+# checkpoints the last applied sequence number; on start-up every logged entry past
+# the checkpoint is queued again ahead of new payloads, so an accepted payload survives
+# a crash. Raw documents reuse their logged _id, so replaying a batch that was partly
+# written is idempotent. Only connection errors are retried: an entry that fails for
+# any other reason is moved to a dead-letter file so it cannot block the queue.
+
+# Errors retried until MongoDB is reachable again (AutoReconnect, NetworkTimeout and
+# server selection timeouts are ConnectionFailure subclasses)
+TRANSIENT_ERRORS = (ConnectionFailure,)
+
+# ✅ Merge repeated updates for the same (cookie, email) into one record, in order.
+# A record is only folded into an earlier one when no record in between used the
+# same cookie or email with another key, and when it carries no created_at (an email
+# merge keeps the stored created_at, a later cookie match would overwrite it), so
+# merge outcomes match one-by-one ingest.
+def coalesce_records(datas):
+    merged, position, last_key = [], {}, {}
+    for data in datas:
+        key = (data["cookie"], data["email"])
+        identities = (("cookie", data["cookie"]), ("email", data["email"]))
+        if ("created_at" not in data and key in position
+                and all(last_key.get(identity) == key for identity in identities)):
+            merged[position[key]] = {**merged[position[key]], **data}
+        else:
+            position[key] = len(merged)
+            merged.append(data)
+        for identity in identities:
+            last_key[identity] = key
+    return merged
+
+class WriteBehindQueue:
+    def __init__(self, wal_path, apply_batch, max_pending=10000, batch_size=1000,
+                 linger_seconds=0.05, put_timeout=1.0, fsync=True, retry_delay=0.5, max_retry_delay=30):
+        self.wal_path = wal_path
+        self.checkpoint_path = wal_path + ".checkpoint"
+        self.dead_letter_path = wal_path + ".dead"
+        self.apply_batch = apply_batch  # apply_batch([(raw_id, data), ...]) -> None
+        self.batch_size = batch_size
+        self.linger_seconds = linger_seconds
+        self.put_timeout = put_timeout
+        self.fsync = fsync
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._slots = threading.BoundedSemaphore(max_pending)  # Backpressure on callers
+        self._pending = deque()  # (seq, raw_id, data)
+        self._ready = threading.Condition()
+        self._log_lock = threading.Lock()
+        self._log = None
+        self._seq = 0
+        self._applied = 0
+        self._replayed_upto = 0  # Replayed entries hold no backpressure slot
+        self._stopping = False
+        self._writer = None
+        self.max_pending = max_pending
+        self.batches = 0
+        self.rejected = 0
+        self.replayed = 0
+        self.dead_lettered = 0
+
+    def _read_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path) as f:
+            return int(f.read().strip() or 0)
+
+    def _write_checkpoint(self, seq):
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(seq))
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # ✅ Logged entries past the checkpoint (a torn last line from a crash is skipped)
+    def _unapplied_entries(self, checkpoint):
+        entries = []
+        if not os.path.exists(self.wal_path):
+            return entries
+        with open(self.wal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry["seq"] > checkpoint:
+                    entries.append((entry["seq"], entry["raw_id"], entry["data"]))
+        return entries
+
+    # ✅ Queue the unapplied log entries for the writer thread, then start it. Nothing
+    # is written here, so start-up does not wait for MongoDB: the writer drains the
+    # backlog (retrying while MongoDB is down) before the payloads submitted after it.
+    def start(self):
+        self._applied = self._read_checkpoint()
+        replay = self._unapplied_entries(self._applied)
+        self._seq = max([self._applied] + [seq for seq, _, _ in replay])
+        self._replayed_upto = self._seq
+        self._log = open(self.wal_path, "a")
+
+        self._pending.extend(replay)
+        self.replayed = len(replay)
+        if replay:
+            print(f"🔁 Replaying {len(replay)} logged ingest payloads in the background")
+        self._truncate_if_drained()
+
+        self._writer = threading.Thread(target=self._run, daemon=True)
+        self._writer.start()
+        return len(replay)
+
+    # ✅ Drain what is queued, then stop the writer
+    def stop(self):
+        with self._ready:
+            self._stopping = True
+            self._ready.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+        if self._log is not None:
+            self._log.close()
+
+    # ✅ Log and enqueue one sanitized payload; False when the queue stays full
+    # for `put_timeout` seconds (the caller should retry later)
+    def submit(self, data):
+        if not self._slots.acquire(timeout=self.put_timeout):
+            self.rejected += 1
+            return False
+
+        raw_id = str(ObjectId())
+        with self._log_lock:
+            self._seq += 1
+            seq = self._seq
+            self._log.write(json.dumps({"seq": seq, "raw_id": raw_id, "data": data}, default=str) + "\n")
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+            with self._ready:
+                self._pending.append((seq, raw_id, data))
+                self._ready.notify()
+        return True
+
+    def _next_batch(self):
+        with self._ready:
+            while not self._pending and not self._stopping:
+                self._ready.wait()
+            if not self._pending:
+                return None
+            if len(self._pending) < self.batch_size and not self._stopping:
+                self._ready.wait(self.linger_seconds)  # Let a burst build up a bigger batch
+            count = min(self.batch_size, len(self._pending))
+            return [self._pending.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._apply_with_retry(batch)
+            for seq, _, _ in batch:
+                if seq > self._replayed_upto:
+                    self._slots.release()
+            self._truncate_if_drained()
+
+    # ✅ Apply a batch; the checkpoint moves once every entry is written or dead-lettered
+    def _apply_with_retry(self, batch):
+        self._apply_or_isolate(batch)
+        self._applied = batch[-1][0]
+        self._write_checkpoint(self._applied)
+        self.batches += 1
+
+    # ✅ A batch failing for a non-transient reason is applied entry by entry, so only
+    # the entries that fail on their own are dead-lettered
+    def _apply_or_isolate(self, batch):
+        try:
+            self._apply_until_reachable(batch)
+        except Exception as exc:
+            if len(batch) == 1:
+                self._dead_letter(batch[0], exc)
+                return
+            for entry in batch:
+                self._apply_or_isolate([entry])
+
+    # ✅ Retry with backoff while MongoDB is unreachable; other errors are raised
+    def _apply_until_reachable(self, batch):
+        delay = self.retry_delay
+        while True:
+            try:
+                self.apply_batch([(raw_id, data) for _, raw_id, data in batch])
+                return
+            except TRANSIENT_ERRORS as exc:
+                print(f"⚠️ Write-behind batch failed, retrying in {delay}s: {exc}")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    # ✅ Keep an entry that cannot be written (with its error) out of the queue
+    def _dead_letter(self, entry, exc):
+        seq, raw_id, data = entry
+        print(f"❌ Write-behind entry {seq} cannot be written, moved to {self.dead_letter_path}: {exc!r}")
+        with open(self.dead_letter_path, "a") as f:
+            f.write(json.dumps({"seq": seq, "raw_id": raw_id, "data": data, "error": repr(exc)}, default=str) + "\n")
+        self.dead_lettered += 1
+
+    # ✅ Start a fresh log once every logged entry has been applied
+    def _truncate_if_drained(self):
+        with self._log_lock:
+            if self._log is not None and self._applied == self._seq:
+                self._log.seek(0)
+                self._log.truncate()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "max_pending": self.max_pending,
+            "last_logged_seq": self._seq,
+            "last_applied_seq": self._applied,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "replayed": self.replayed,
+            "dead_lettered": self.dead_lettered,
+        }